@@ -0,0 +1,166 @@
+import hashlib
+import json
+import re
+import ssl
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlencode, urlparse
+except ImportError:  # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib import urlencode
+    from urlparse import parse_qs, urlparse
+
+
+MANIFEST_MEDIA_TYPE = 'application/vnd.docker.distribution.manifest.v2+json'
+TAGS_PATTERN = re.compile(r'^/v2/(?P<image>.+)/tags/list$')
+MANIFEST_PATTERN = re.compile(r'^/v2/(?P<image>.+)/manifests/(?P<reference>[^/]+)$')
+
+
+class FakeRegistry(object):
+    '''
+    In-memory docker registry serving the tags list and manifests endpoints over TLS,
+    with a fixed latency added to every request. Every image starts with `tags` tags.
+    '''
+    def __init__(self, images, tags, latency, certfile, keyfile):  # pylint: disable=too-many-arguments
+        self.tags = dict((image, ['tag-%d' % index for index in range(tags)]) for image in images)
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+        handler = type('FakeRegistryHandler', (_FakeRegistryHandler,), dict(registry=self))
+        self._server = _ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        context = ssl.SSLContext(getattr(ssl, 'PROTOCOL_TLS_SERVER', ssl.PROTOCOL_SSLv23))
+        context.load_cert_chain(certfile, keyfile)
+        self._server.socket = context.wrap_socket(self._server.socket, server_side=True)
+        self.address = 'localhost:%d' % self._server.server_address[1]
+
+    def start(self):
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def get_tags(self, image):
+        with self._lock:
+            return list(self.tags[image]) if image in self.tags else None
+
+    def put_tag(self, image, tag):
+        with self._lock:
+            self.tags.setdefault(image, [])
+            if tag not in self.tags[image]:
+                self.tags[image].append(tag)
+
+    def delete_digest(self, image, digest):
+        with self._lock:
+            tags = self.tags.get(image, [])
+            self.tags[image] = [tag for tag in tags if get_digest(image, tag) != digest]
+            return len(self.tags[image]) != len(tags)
+
+
+def get_digest(image, tag):
+    return 'sha256:' + hashlib.sha256((image + ':' + tag).encode('utf-8')).hexdigest()
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _FakeRegistryHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    registry = None
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        self._handle(send_body=True)
+
+    def do_HEAD(self):  # pylint: disable=invalid-name
+        self._handle(send_body=False)
+
+    def do_PUT(self):  # pylint: disable=invalid-name
+        self._start()
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        match = MANIFEST_PATTERN.match(urlparse(self.path).path)
+        if match is None:
+            return self._send_error(404, 'NAME_UNKNOWN')
+        self.registry.put_tag(match.group('image'), match.group('reference'))
+        return self._send(201, b'', {'Docker-Content-Digest': get_digest(match.group('image'), match.group('reference'))})
+
+    def do_DELETE(self):  # pylint: disable=invalid-name
+        self._start()
+        match = MANIFEST_PATTERN.match(urlparse(self.path).path)
+        if match is None or not self.registry.delete_digest(match.group('image'), match.group('reference')):
+            return self._send_error(404, 'MANIFEST_UNKNOWN')
+        return self._send(202, b'')
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+    def _start(self):
+        self.registry.count_request()
+        if self.registry.latency:
+            time.sleep(self.registry.latency)
+
+    def _handle(self, send_body):
+        self._start()
+        url = urlparse(self.path)
+        if url.path == '/v2/':
+            return self._send(200, b'{}', send_body=send_body)
+
+        match = TAGS_PATTERN.match(url.path)
+        if match is not None:
+            return self._send_tags(match.group('image'), parse_qs(url.query), send_body)
+
+        match = MANIFEST_PATTERN.match(url.path)
+        if match is not None:
+            return self._send_manifest(match.group('image'), match.group('reference'), send_body)
+        return self._send_error(404, 'NAME_UNKNOWN')
+
+    def _send_tags(self, image, query, send_body):
+        tags = self.registry.get_tags(image)
+        if tags is None:
+            return self._send_error(404, 'NAME_UNKNOWN')
+
+        page_size = int(query.get('n', [len(tags) or 1])[0])
+        start = tags.index(query['last'][0]) + 1 if query.get('last', [None])[0] in tags else 0
+        page = tags[start:start + page_size]
+        headers = {}
+        if start + page_size < len(tags):
+            next_query = urlencode(dict(n=page_size, last=page[-1]))
+            headers['Link'] = '</v2/%(image)s/tags/list?%(query)s>; rel="next"' % dict(image=image, query=next_query)
+        body = json.dumps(dict(name=image, tags=page)).encode('utf-8')
+        return self._send(200, body, headers, send_body)
+
+    def _send_manifest(self, image, reference, send_body):
+        tags = self.registry.get_tags(image) or []
+        tag = reference if reference in tags else next((tag for tag in tags if get_digest(image, tag) == reference), None)
+        if tag is None:
+            return self._send_error(404, 'MANIFEST_UNKNOWN', send_body)
+
+        body = json.dumps(dict(schemaVersion=2, mediaType=MANIFEST_MEDIA_TYPE, layers=[])).encode('utf-8')
+        headers = {'Docker-Content-Digest': get_digest(image, tag), 'Content-Type': MANIFEST_MEDIA_TYPE}
+        return self._send(200, body, headers, send_body)
+
+    def _send_error(self, status, code, send_body=True):
+        body = json.dumps(dict(errors=[dict(code=code, message=code.lower().replace('_', ' '))])).encode('utf-8')
+        return self._send(status, body, send_body=send_body)
+
+    def _send(self, status, body, headers=None, send_body=True):
+        self.send_response(status)
+        headers = dict(headers or {})
+        headers.setdefault('Content-Type', 'application/json')
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
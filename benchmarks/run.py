@@ -0,0 +1,222 @@
+'''
+Measures the overhead of skipper itself. Every command runs the skipper entry point
+in a scratch project, against the stub docker client of benchmarks/bin and a fake
+registry, and reports its wall time, the processes it started and the registry
+requests it made. Run from the top directory of the repository:
+
+    python -m benchmarks.run --repeat 5 --output results.json
+'''
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import click
+import tabulate
+from benchmarks import fake_registry
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STUB_BIN_DIR = os.path.join(ROOT_DIR, 'benchmarks', 'bin')
+RESULTS_VERSION = 1
+BUILD_CONTAINER_IMAGE = 'build'
+COMMANDS = [
+    ('build', ['build']),
+    ('push', ['push']),
+    ('images -r', ['images', '-r']),
+    ('run', ['run', 'true']),
+    ('make', ['make', 'all']),
+]
+METRICS = ['wall_median', 'wall_min', 'wall_max', 'forks', 'http_requests']
+
+
+@click.command()
+@click.option('--repeat', help='Runs of every command', type=click.IntRange(min=1), default=5)
+@click.option('--images', 'image_count', help='Images of the project, besides the build container', type=click.IntRange(min=1),
+              default=3)
+@click.option('--tags', help='Tags of every image in the registry', type=click.IntRange(min=0), default=100)
+@click.option('--latency', help='Milliseconds added to every registry request', type=click.FloatRange(min=0), default=0.0)
+@click.option('--warm', help='Keep the skipper caches between runs, after an untimed first run', is_flag=True, default=False)
+@click.option('--command', 'commands', help='Command to measure, all by default', multiple=True,
+              type=click.Choice([name for name, _ in COMMANDS]))
+@click.option('--python', help='Interpreter running skipper', default=sys.executable)
+@click.option('--format', 'output_format', help='Format of the results printed on stdout', type=click.Choice(['table', 'json']),
+              default='table')
+@click.option('--output', help='Also write the results as JSON to this file', type=click.Path(dir_okay=False))
+@click.option('--baseline', help='Results file to compare with, exits with 1 on regressions', type=click.Path(exists=True, dir_okay=False))
+@click.option('--tolerance', help='Allowed relative increase of the median wall time over the baseline', type=click.FloatRange(min=0),
+              default=0.2)
+def main(repeat, image_count, tags, latency, warm, commands, python,  # pylint: disable=too-many-arguments
+         output_format, output, baseline, tolerance):
+    '''
+    Benchmark skipper commands against a stub docker client and a fake registry
+    '''
+    workdir = tempfile.mkdtemp(prefix='skipper-bench-')
+    try:
+        images = [BUILD_CONTAINER_IMAGE] + ['image%d' % index for index in range(image_count)]
+        registry = fake_registry.FakeRegistry(images, tags, latency / 1000.0, *_create_certificate(workdir))
+        registry.start()
+        try:
+            project = _create_project(workdir, registry.address, images)
+            runs = [(name, args) for name, args in COMMANDS if not commands or name in commands]
+            results = [_measure(python, workdir, project, registry, name, args, repeat, warm) for name, args in runs]
+        finally:
+            registry.stop()
+    finally:
+        shutil.rmtree(workdir)
+
+    report = dict(
+        version=RESULTS_VERSION,
+        skipper_commit=_get_commit(),
+        python=_get_python_version(python),
+        platform=platform.platform(),
+        time=datetime.datetime.utcnow().isoformat() + 'Z',
+        parameters=dict(repeat=repeat, images=image_count, tags=tags, latency=latency, warm=warm),
+        results=results,
+    )
+    if output:
+        with open(output, 'w') as output_file:
+            json.dump(report, output_file, indent=2, sort_keys=True)
+    if output_format == 'json':
+        click.echo(json.dumps(report, indent=2, sort_keys=True))
+    else:
+        rows = [[result['command']] + [result[metric] for metric in METRICS] + [result['exit_code']] for result in results]
+        click.echo(tabulate.tabulate(rows, headers=['COMMAND'] + [metric.upper() for metric in METRICS] + ['EXIT CODE'],
+                                     tablefmt='grid'))
+
+    if baseline:
+        with open(baseline) as baseline_file:
+            regressions = _compare(json.load(baseline_file), results, tolerance)
+        for regression in regressions:
+            click.echo('Regression: ' + regression, err=True)
+        sys.exit(1 if regressions else 0)
+
+
+def _measure(python, workdir, project, registry, name, args, repeat, warm):  # pylint: disable=too-many-arguments
+    cache_dir = os.path.join(workdir, 'cache')
+    stats_path = os.path.join(workdir, 'stats.json')
+    env = dict(os.environ)
+    env['PATH'] = STUB_BIN_DIR + os.pathsep + env.get('PATH', '')
+    env['PYTHONPATH'] = ROOT_DIR + os.pathsep + env.get('PYTHONPATH', '')
+    env['XDG_CACHE_HOME'] = cache_dir
+    env['SKIPPER_BENCH_STATS'] = stats_path
+    env['SKIPPER_BENCH_LOCAL_IMAGES'] = BUILD_CONTAINER_IMAGE + ':latest'
+    # skipper doesn't verify the certificate of registries, unless a CA bundle is forced through the environment
+    for variable in ('DOCKER_HOST', 'REQUESTS_CA_BUNDLE', 'CURL_CA_BUNDLE'):
+        env.pop(variable, None)
+    command = [python, '-m', 'benchmarks.skipper_command'] + args
+
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    if warm:
+        _run(command, project, env)
+
+    walls = []
+    exit_code = 0
+    stats = dict(forks=None)
+    http_requests = 0
+    for _ in range(repeat):
+        if not warm:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+        requests_before = registry.requests
+        start_time = time.time()
+        returncode, stderr = _run(command, project, env)
+        walls.append(time.time() - start_time)
+        http_requests = registry.requests - requests_before
+        if returncode != 0:
+            exit_code = returncode
+            click.echo('skipper %(command)s exited with %(code)d: %(error)s' %
+                       dict(command=name, code=returncode, error=stderr.strip().splitlines()[-1:]), err=True)
+        with open(stats_path) as stats_file:
+            stats = json.load(stats_file)
+
+    walls.sort()
+    return dict(
+        command=name,
+        wall_median=round(walls[len(walls) // 2], 4),
+        wall_min=round(walls[0], 4),
+        wall_max=round(walls[-1], 4),
+        forks=stats['forks'],
+        http_requests=http_requests,
+        exit_code=exit_code,
+    )
+
+
+def _run(command, project, env):
+    with open(os.devnull, 'w') as devnull:
+        proc = subprocess.Popen(command, cwd=project, env=env, stdout=devnull, stderr=subprocess.PIPE)
+        _, stderr = proc.communicate()
+    return proc.returncode, stderr.decode('utf-8', 'replace')
+
+
+def _create_project(workdir, registry, images):
+    project = os.path.join(workdir, 'project')
+    os.makedirs(os.path.join(project, 'src'))
+    for image in images:
+        base = 'centos:7' if image == BUILD_CONTAINER_IMAGE else BUILD_CONTAINER_IMAGE
+        _write(os.path.join(project, 'Dockerfile.' + image), 'FROM %(base)s\nCOPY src /src\n' % dict(base=base))
+    _write(os.path.join(project, 'src', 'main.py'), 'print("hello")\n')
+    _write(os.path.join(project, 'Makefile'), 'all:\n\ttrue\n')
+    _write(os.path.join(project, 'skipper.yaml'),
+           'registry: %(registry)s\nbuild-container-image: %(image)s\nbuild-container-tag: latest\ndocker-backend: cli\n' %
+           dict(registry=registry, image=BUILD_CONTAINER_IMAGE))
+
+    git_env = dict(os.environ, GIT_AUTHOR_NAME='bench', GIT_AUTHOR_EMAIL='bench@localhost',
+                   GIT_COMMITTER_NAME='bench', GIT_COMMITTER_EMAIL='bench@localhost')
+    with open(os.devnull, 'w') as devnull:
+        for git_command in (['git', 'init', '-q'], ['git', 'add', '.'], ['git', 'commit', '-q', '-m', 'Benchmark project']):
+            subprocess.check_call(git_command, cwd=project, env=git_env, stdout=devnull)
+    return project
+
+
+def _create_certificate(workdir):
+    certfile = os.path.join(workdir, 'registry.crt')
+    keyfile = os.path.join(workdir, 'registry.key')
+    command = ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1', '-subj', '/CN=localhost',
+               '-keyout', keyfile, '-out', certfile]
+    with open(os.devnull, 'w') as devnull:
+        subprocess.check_call(command, stdout=devnull, stderr=devnull)
+    return certfile, keyfile
+
+
+def _get_commit():
+    try:
+        with open(os.devnull, 'w') as devnull:
+            output = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT_DIR, stderr=devnull)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode('utf-8').strip()
+
+
+def _get_python_version(python):
+    output = subprocess.check_output([python, '-c', 'import platform; print(platform.python_version())'])
+    return output.decode('utf-8').strip()
+
+
+def _compare(baseline, results, tolerance):
+    regressions = []
+    baseline_results = dict((result['command'], result) for result in baseline['results'])
+    for result in results:
+        previous = baseline_results.get(result['command'])
+        if previous is None:
+            continue
+        if result['wall_median'] > previous['wall_median'] * (1 + tolerance):
+            regressions.append('%(command)s took %(now).3fs, %(before).3fs in the baseline' %
+                               dict(command=result['command'], now=result['wall_median'], before=previous['wall_median']))
+        for metric in ('forks', 'http_requests'):
+            if previous[metric] is not None and result[metric] is not None and result[metric] > previous[metric]:
+                regressions.append('%(command)s made %(now)d %(metric)s, %(before)d in the baseline' %
+                                   dict(command=result['command'], now=result[metric], metric=metric, before=previous[metric]))
+    return regressions
+
+
+def _write(path, content):
+    with open(path, 'w') as target:
+        target.write(content)
+
+
+if __name__ == '__main__':
+    main()   # pylint: disable=no-value-for-parameter
@@ -0,0 +1,90 @@
+'''
+Measures the overhead of runner.Process over a bare subprocess.Popen. Every mode starts
+and waits for the same short command, and the time of every run is reported along with
+its overhead over Popen. Run from the top directory of the repository:
+
+    python -m benchmarks.runner_overhead --repeat 200
+'''
+import os
+import subprocess
+import time
+import click
+import tabulate
+from skipper import runner
+
+
+def _popen(command, devnull):
+    subprocess.Popen(command, stdout=devnull).wait()
+
+
+def _popen_pipe(command, devnull):  # pylint: disable=unused-argument
+    proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    for _ in iter(proc.stdout.readline, b''):
+        pass
+    proc.stdout.close()
+    proc.wait()
+
+
+def _process(command, devnull):
+    runner.Process(command, stdout=devnull).wait()
+
+
+def _process_timeout(command, devnull):
+    runner.Process(command, stdout=devnull, timeout=60).wait()
+
+
+def _process_on_output(command, devnull):  # pylint: disable=unused-argument
+    runner.Process(command, on_output=lambda line: None).wait()
+
+
+# Every mode is compared with the Popen mode doing the same work
+MODES = [
+    ('popen', _popen, 'popen'),
+    ('process', _process, 'popen'),
+    ('process timeout', _process_timeout, 'popen'),
+    ('popen pipe', _popen_pipe, 'popen pipe'),
+    ('process on_output', _process_on_output, 'popen pipe'),
+]
+
+
+@click.command()
+@click.option('--repeat', help='Runs of every mode', type=click.IntRange(min=1), default=200)
+@click.option('--lines', help='Lines written by the command', type=click.IntRange(min=0), default=100)
+def main(repeat, lines):
+    '''
+    Benchmark runner.Process against subprocess.Popen
+    '''
+    command = ['seq', str(lines)] if lines else ['true']
+    with open(os.devnull, 'wb') as devnull:
+        medians = {}
+        rows = []
+        for name, func, baseline in MODES:
+            times = _measure(func, command, devnull, repeat)
+            medians[name] = _median(times)
+            rows.append([name, _ms(medians[name]), _ms(min(times)), _ms(medians[name] - medians[baseline])])
+    click.echo(tabulate.tabulate(rows, headers=['MODE', 'MEDIAN MS', 'MIN MS', 'OVERHEAD MS']))
+
+
+def _measure(func, command, devnull, repeat):
+    # The first, untimed, run warms the caches of the command
+    func(command, devnull)
+    times = []
+    for _ in range(repeat):
+        start_time = time.time()
+        func(command, devnull)
+        times.append(time.time() - start_time)
+    return times
+
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2.0
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 3)
+
+
+if __name__ == '__main__':
+    main()   # pylint: disable=no-value-for-parameter
@@ -0,0 +1,28 @@
+'''
+Runs skipper.main.main like the skipper console script does, counting the processes it
+starts. The count is written as JSON to the file named by SKIPPER_BENCH_STATS on exit.
+'''
+import json
+import os
+import subprocess
+
+
+def main():
+    stats = dict(forks=0)
+    execute_child = subprocess.Popen._execute_child   # pylint: disable=protected-access
+
+    def _counting_execute_child(self, *args, **kwargs):
+        stats['forks'] += 1
+        return execute_child(self, *args, **kwargs)
+
+    subprocess.Popen._execute_child = _counting_execute_child   # pylint: disable=protected-access
+    from skipper import main as skipper_main
+    try:
+        skipper_main.main()
+    finally:
+        with open(os.environ['SKIPPER_BENCH_STATS'], 'w') as stats_file:
+            json.dump(stats, stats_file)
+
+
+if __name__ == '__main__':
+    main()
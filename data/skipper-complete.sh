@@ -108,15 +108,20 @@ _get_makefile() {
 }
 
 _skipper_completion() {
-    local COMMANDS="build push images rmi run make shell"
+    local COMMANDS="build push promote images rmi gc run make shell cache"
     local -A OPTS=(
-        [GLOBAL]="-v --verbose --registry --build-container-image --build-container-tag --help"
-        [BUILD]="--help"
-        [PUSH]="--help"
-        [IMAGES]="-r --help"
-        [RMI]="-r --help"
-        [RUN]="-e --env --help"
-        [MAKE]="-e --env -f --help"
+        [GLOBAL]="-v --verbose --registry --build-container-image --build-container-tag --build-cache --registry-cache-ttl --no-cache --docker-backend --session --session-idle-timeout --user-image --mark-dirty --build-context --trace --metrics-dir --help"
+        [BUILD]="-j --jobs --help"
+        [PUSH]="-j --jobs --force --help"
+        [IMAGES]="-r --format --help"
+        [PROMOTE]="--help"
+        [RMI]="-r --keep-shared --help"
+        [GC]="-r --remote --keep-last --keep-branch --keep --delete -n --dry-run -j --jobs --rate --help"
+        [RUN]="-e --env --shards --shard-files --help"
+        [MAKE]="-e --env -f -P --parallel --help"
+        [CACHE]="ls prune"
+        [CACHE_LS]="-a --all --help"
+        [CACHE_PRUNE]="-a --all -n --dry-run --help"
     )
     local cur=${COMP_WORDS[$COMP_CWORD]}
     local prev=${COMP_WORDS[$COMP_CWORD-1]}
@@ -129,6 +134,14 @@ _skipper_completion() {
         images=( $(_get_images_from_dockerfiles) )
         COMPREPLY=( $(compgen -W "${images[*]}" -- $cur) )
 
+    elif __contains_word "promote" ${COMP_WORDS[*]}; then
+        if [[ $cur == -* ]]; then
+            COMPREPLY=( $(compgen -W "${OPTS[PROMOTE]}" -- $cur) )
+        else
+            images=( $(_get_images_from_dockerfiles) )
+            COMPREPLY=( $(compgen -W "${images[*]}" -- $cur) )
+        fi
+
     elif __contains_word "images" ${COMP_WORDS[*]}; then
         COMPREPLY=( $(compgen -W "${OPTS[IMAGES]}" -- $cur) )
 
@@ -140,12 +153,20 @@ _skipper_completion() {
             COMPREPLY=( $(compgen -W "${images[*]}" -- $cur) )
         fi
 
+    elif __contains_word "gc" ${COMP_WORDS[*]}; then
+        if [[ $cur == -* ]]; then
+            COMPREPLY=( $(compgen -W "${OPTS[GC]}" -- $cur) )
+        else
+            images=( $(_get_images_from_dockerfiles) )
+            COMPREPLY=( $(compgen -W "${images[*]}" -- $cur) )
+        fi
+
     elif __contains_word "run" ${COMP_WORDS[*]}; then
         COMPREPLY=( $(compgen -W "${OPTS[RUN]}" -- $cur) )
 
     elif __contains_word "make" ${COMP_WORDS[*]}; then
         if [[ $cur == -* ]]; then
-            COMPREPLY=( $(compgen -W "${OPTS[RUN]}" -- $cur) )
+            COMPREPLY=( $(compgen -W "${OPTS[MAKE]}" -- $cur) )
         else
             if [[ $prev == -f ]]; then 
                 COMPREPLY=( $(compgen -f -X '!*[mM]akefile' -- $cur) )
@@ -163,6 +184,15 @@ _skipper_completion() {
                                command sed -nf <(_make_target_extract_script $mode "$cur") ) )
             fi
         fi
+
+    elif __contains_word "cache" ${COMP_WORDS[*]}; then
+        if __contains_word "ls" ${COMP_WORDS[*]}; then
+            COMPREPLY=( $(compgen -W "${OPTS[CACHE_LS]}" -- $cur) )
+        elif __contains_word "prune" ${COMP_WORDS[*]}; then
+            COMPREPLY=( $(compgen -W "${OPTS[CACHE_PRUNE]}" -- $cur) )
+        else
+            COMPREPLY=( $(compgen -W "${OPTS[CACHE]}" -- $cur) )
+        fi
     
     else
         if [[ $cur == -* ]]; then
@@ -8,5 +8,10 @@ fi
 groupadd -g ${SKIPPER_DOCKER_GID} --non-unique docker
 usermod -G root,docker ${SKIPPER_USERNAME}
 
+IFS=: read -ra cache_paths <<< "${SKIPPER_CACHE_PATHS}"
+for cache_path in "${cache_paths[@]}"; do
+	chown ${SKIPPER_UID} "${cache_path}"
+done
+
 su -m ${SKIPPER_USERNAME} -c "$@"
 
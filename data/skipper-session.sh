@@ -0,0 +1,61 @@
+#!/usr/bin/env bash
+#
+# Keeps a skipper build container alive between commands:
+#   skipper-session.sh start IDLE_TIMEOUT - prepares the user and exits after IDLE_TIMEOUT seconds without commands
+#   skipper-session.sh exec COMMAND       - runs the command as the user, through docker exec
+#
+# Every running command keeps an active.PID marker, so the session doesn't exit under it.
+# Markers of killed commands, which couldn't remove their own, are removed once their pid is gone.
+
+SESSION_DIR=/tmp/skipper-session
+
+case "$1" in
+start)
+	getent passwd ${SKIPPER_USERNAME} > /dev/null
+	if [ x"$?" != x"0" ]; then
+		useradd -u ${SKIPPER_UID} --non-unique -M "${SKIPPER_USERNAME}"
+	fi
+
+	groupadd -g ${SKIPPER_DOCKER_GID} --non-unique docker
+	usermod -G root,docker ${SKIPPER_USERNAME}
+
+	IFS=: read -ra cache_paths <<< "${SKIPPER_CACHE_PATHS}"
+	for cache_path in "${cache_paths[@]}"; do
+		chown ${SKIPPER_UID} "${cache_path}"
+	done
+
+	mkdir -p ${SESSION_DIR}
+	touch ${SESSION_DIR}/last-used ${SESSION_DIR}/ready
+	trap "exit 0" TERM
+
+	while true; do
+		sleep 5
+		active=0
+		for marker in ${SESSION_DIR}/active.*; do
+			[ -e "${marker}" ] || continue
+			if kill -0 "${marker##*.}" 2> /dev/null; then
+				active=1
+			else
+				rm -f "${marker}"
+				touch ${SESSION_DIR}/last-used
+			fi
+		done
+		if [ ${active} = 1 ]; then
+			continue
+		fi
+		if [ $(( $(date +%s) - $(stat -c %Y ${SESSION_DIR}/last-used) )) -ge $2 ]; then
+			exit 0
+		fi
+	done
+	;;
+exec)
+	shift
+	while [ ! -e ${SESSION_DIR}/ready ]; do
+		sleep 0.1
+	done
+
+	touch ${SESSION_DIR}/active.$$
+	trap "rm -f ${SESSION_DIR}/active.$$; touch ${SESSION_DIR}/last-used" EXIT
+	su -m ${SKIPPER_USERNAME} -c "$@"
+	;;
+esac
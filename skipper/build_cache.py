@@ -0,0 +1,138 @@
+import glob
+import hashlib
+import json
+import os
+from skipper import docker
+from skipper import utils
+
+
+CACHE_TAG_PREFIX = 'cache-'
+CACHE_TAG_LENGTH = 20
+BUILD_CONTEXT = '.'
+
+
+def get_cache_tag(image, project_images, build_args=None):
+    '''
+    Returns a tag derived from the content of the image: its Dockerfile, its
+    build args, the files it COPY/ADDs and the content of the project images
+    it is based on. Images with the same cache tag are interchangeable.
+    '''
+    return CACHE_TAG_PREFIX + _get_content_hash(image, project_images, build_args or [], {})[:CACHE_TAG_LENGTH]
+
+
+def find_cached_image(registry, image, cache_tag):
+    if utils.local_image_exist(image, cache_tag):
+        return image + ':' + cache_tag
+
+    if registry is not None and utils.remote_image_exist(registry, image, cache_tag):
+        fqdn_image = utils.generate_fqdn_image(registry, image, cache_tag)
+        ret = docker.get_backend().pull_image(fqdn_image)
+        utils.invalidate_local_images()
+        if ret == 0:
+            return fqdn_image
+
+    return None
+
+
+def is_cache_tag_of(image, tag, cache_tag):
+    '''
+    Returns whether image:cache_tag is a local tag of the image of image:tag, so the cache tag
+    describes the content of image:tag rather than the content of the working tree now
+    '''
+    backend = docker.get_backend()
+    try:
+        return backend.inspect_image(image + ':' + cache_tag)['id'] == backend.inspect_image(image + ':' + tag)['id']
+    except docker.DockerError:
+        return False
+
+
+def tag_image(source, target):
+    utils.logger.debug("Adding tag %(tag)s", dict(tag=target))
+    ret = docker.get_backend().tag_image(source, target)
+    utils.invalidate_local_images()
+    return ret
+
+
+def _get_content_hash(image, project_images, build_args, hashes):
+    if image in hashes:
+        return hashes[image]
+
+    dockerfile = utils.image_to_dockerfile(image)
+    content_hash = hashlib.sha256()
+    with open(dockerfile, 'rb') as dockerfile_file:
+        content_hash.update(dockerfile_file.read())
+    content_hash.update(json.dumps(sorted(build_args)).encode('utf-8'))
+
+    for path in _get_dockerfile_sources(dockerfile):
+        content_hash.update(path.encode('utf-8'))
+        if os.path.isfile(path):
+            _update_file_hash(content_hash, path)
+
+    for dependency in sorted(utils.get_image_dependencies(image, project_images)):
+        content_hash.update(_get_content_hash(dependency, project_images, [], hashes).encode('utf-8'))
+
+    hashes[image] = content_hash.hexdigest()
+    return hashes[image]
+
+
+def _update_file_hash(content_hash, path):
+    content_hash.update(str(os.stat(path).st_mode & 0o777).encode('utf-8'))
+    with open(path, 'rb') as source_file:
+        for chunk in iter(lambda: source_file.read(65536), b''):
+            content_hash.update(chunk)
+
+
+def get_source_patterns(dockerfile):
+    '''
+    Returns the sources of the COPY and ADD instructions of the Dockerfile that read from the build context
+    '''
+    patterns = []
+    for instruction, arguments in _get_dockerfile_instructions(dockerfile):
+        if instruction not in ('COPY', 'ADD'):
+            continue
+        if any(argument.startswith('--from') for argument in arguments):
+            continue
+        arguments = [argument for argument in arguments if not argument.startswith('--')]
+        patterns += arguments[:-1]
+    return patterns
+
+
+def _get_dockerfile_sources(dockerfile):
+    sources = set()
+    for pattern in get_source_patterns(dockerfile):
+        sources.update(_expand_source(pattern))
+    return sorted(sources)
+
+
+def _get_dockerfile_instructions(dockerfile):
+    with open(dockerfile) as dockerfile_file:
+        lines = dockerfile_file.read().replace('\\\n', ' ').splitlines()
+
+    for line in lines:
+        tokens = line.strip().split(None, 1)
+        if len(tokens) < 2 or tokens[0].startswith('#'):
+            continue
+        instruction, arguments = tokens[0].upper(), tokens[1].strip()
+        if arguments.startswith('['):
+            try:
+                yield instruction, [str(argument) for argument in json.loads(arguments)]
+                continue
+            except ValueError:
+                pass
+        yield instruction, arguments.split()
+
+
+def _expand_source(pattern):
+    if '://' in pattern:
+        return [pattern]
+
+    paths = glob.glob(os.path.normpath(os.path.join(BUILD_CONTEXT, pattern))) or [pattern]
+    sources = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs[:] = sorted(name for name in dirs if name != '.git')
+                sources += [os.path.join(root, name) for name in files]
+        else:
+            sources.append(path)
+    return sources
@@ -0,0 +1,213 @@
+import glob
+import os
+import re
+import subprocess
+import threading
+from skipper import build_cache
+from skipper import runner
+from skipper import utils
+
+
+DOCKER = 'docker'
+DOCKERIGNORE = 'dockerignore'
+REFERENCED = 'referenced'
+MODES = [DOCKER, DOCKERIGNORE, REFERENCED]
+DOCKERIGNORE_FILE = '.dockerignore'
+STDIN_CONTEXT = '-'
+
+
+def run_build(command, dockerfile, mode=DOCKER):
+    '''
+    Run a docker build command, given without its context argument, and return its exit code
+    '''
+    if mode == DOCKER:
+        returncode = runner.run(command + [build_cache.BUILD_CONTEXT])
+    else:
+        proc = start_build(command, dockerfile, mode)
+        proc.wait()
+        returncode = proc.returncode
+    utils.invalidate_local_images()
+    return returncode
+
+
+def start_build(command, dockerfile, mode=DOCKER):
+    '''
+    Start a docker build command, given without its context argument, and return its process.
+    In the docker mode the docker client computes the context of the current directory.
+    Otherwise skipper computes it, applying .dockerignore and in the referenced mode keeping
+    only the paths the Dockerfile COPY/ADDs, and streams it as a tar to the standard input of docker build.
+    '''
+    if mode == DOCKER:
+        return runner.start(command + [build_cache.BUILD_CONTEXT])
+
+    paths = get_context_paths(dockerfile, narrow=mode == REFERENCED)
+    files, size = get_context_stats(paths)
+    utils.logger.info('Sending build context: %(files)d files, %(size)s', dict(files=files, size=utils.format_size(size)))
+    proc = runner.start(command + [STDIN_CONTEXT], stdin=subprocess.PIPE)
+    thread = threading.Thread(target=_write_context, args=(proc.stdin, paths))
+    thread.daemon = True
+    thread.start()
+    return proc
+
+
+def get_context_paths(dockerfile, narrow=False):
+    '''
+    Returns the paths of the files and directories of the build context, parents before children.
+    The Dockerfile and .dockerignore are always part of the context, like with the docker client.
+    '''
+    matcher = DockerignoreMatcher(_read_dockerignore(DOCKERIGNORE_FILE))
+    referenced = _get_referenced_paths(dockerfile) if narrow else None
+    paths = []
+    for root, dirs, files in os.walk(build_cache.BUILD_CONTEXT):
+        kept_dirs = []
+        for name in sorted(dirs):
+            path = os.path.normpath(os.path.join(root, name))
+            if os.path.islink(path):
+                files.append(name)
+            elif not matcher.matches(path):
+                paths.append(path)
+                kept_dirs.append(name)
+            elif matcher.has_exclusions:
+                # A !pattern may bring back files of an ignored directory
+                kept_dirs.append(name)
+        dirs[:] = kept_dirs
+        for name in sorted(files):
+            path = os.path.normpath(os.path.join(root, name))
+            if not matcher.matches(path):
+                paths.append(path)
+
+    if referenced is not None:
+        paths = [path for path in paths if _is_referenced(path, referenced)]
+    for path in (DOCKERIGNORE_FILE, dockerfile):
+        if path not in paths and os.path.exists(path):
+            paths.append(path)
+    return paths
+
+
+def get_context_stats(paths):
+    '''
+    Returns the number of files of the context and their size in bytes
+    '''
+    files = 0
+    size = 0
+    for path in paths:
+        stat = os.lstat(path)
+        if not os.path.isdir(path) or os.path.islink(path):
+            files += 1
+            size += stat.st_size
+    return files, size
+
+
+def write_context(fileobj, paths):
+    import tarfile
+    tar = tarfile.open(fileobj=fileobj, mode='w|')
+    try:
+        for path in paths:
+            tar.add(path, recursive=False)
+    finally:
+        tar.close()
+
+
+class DockerignoreMatcher(object):
+    '''
+    Matches paths relative to the context with .dockerignore patterns, following the rules of docker:
+    the last matching pattern wins, a !pattern brings back what previous patterns ignored,
+    ** matches any number of directories and a pattern matching a directory ignores its content.
+    '''
+    def __init__(self, patterns):
+        self._patterns = []
+        for pattern in patterns:
+            exclusion = pattern.startswith('!')
+            if exclusion:
+                pattern = pattern[1:].strip()
+            pattern = os.path.normpath(pattern).lstrip('/')
+            if pattern in ('', '.'):
+                continue
+            self._patterns.append((_pattern_to_regex(pattern), exclusion))
+        self.has_exclusions = any(exclusion for _, exclusion in self._patterns)
+
+    def matches(self, path):
+        parts = path.split('/')
+        matched = False
+        for regex, exclusion in self._patterns:
+            if exclusion and not matched:
+                continue
+            match = any(regex.match('/'.join(parts[:depth])) for depth in range(1, len(parts) + 1))
+            if match:
+                matched = not exclusion
+        return matched
+
+
+def _read_dockerignore(path):
+    try:
+        with open(path) as dockerignore_file:
+            lines = dockerignore_file.read().splitlines()
+    except (IOError, OSError):
+        return []
+    return [line.strip() for line in lines if line.strip() and not line.startswith('#')]
+
+
+def _pattern_to_regex(pattern):
+    regex = ''
+    index = 0
+    while index < len(pattern):
+        char = pattern[index]
+        if pattern.startswith('**/', index):
+            regex += '(.*/)?'
+            index += 3
+            continue
+        if pattern.startswith('**', index):
+            regex += '.*'
+            index += 2
+            continue
+        if char == '*':
+            regex += '[^/]*'
+        elif char == '?':
+            regex += '[^/]'
+        elif char == '[' and ']' in pattern[index + 1:]:
+            end = pattern.index(']', index + 1)
+            char_class = pattern[index + 1:end].replace('\\', '\\\\')
+            if char_class.startswith('!'):
+                char_class = '^' + char_class[1:]
+            regex += '[' + char_class + ']'
+            index = end
+        elif char == '\\' and index + 1 < len(pattern):
+            index += 1
+            regex += re.escape(pattern[index])
+        else:
+            regex += re.escape(char)
+        index += 1
+    return re.compile('^' + regex + '$')
+
+
+def _get_referenced_paths(dockerfile):
+    paths = set()
+    for pattern in build_cache.get_source_patterns(dockerfile):
+        if '://' in pattern:
+            continue
+        for path in glob.glob(os.path.normpath(os.path.join(build_cache.BUILD_CONTEXT, pattern))):
+            paths.add(os.path.normpath(path))
+    return paths
+
+
+def _is_referenced(path, referenced):
+    # Keeps the referenced paths, their content and the directories leading to them
+    for referenced_path in referenced:
+        if referenced_path in ('.', path):
+            return True
+        if path.startswith(referenced_path + '/') or referenced_path.startswith(path + '/'):
+            return True
+    return False
+
+
+def _write_context(fileobj, paths):
+    try:
+        write_context(fileobj, paths)
+    except (IOError, OSError) as exc:
+        # docker build exited before reading the whole context, its exit code reports the failure
+        utils.logger.debug('Stopped sending build context: %(error)s', dict(error=exc))
+    finally:
+        try:
+            fileobj.close()
+        except (IOError, OSError):
+            pass
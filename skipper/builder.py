@@ -0,0 +1,208 @@
+import collections
+import os.path
+import threading
+import time
+from skipper import build_cache
+from skipper import build_context
+from skipper import metrics
+from skipper import tracing
+from skipper import utils
+
+
+BUILT = 'built'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+CACHED = 'cached'
+LATEST_TAG = 'latest'
+
+# What every build of build_images needs, the images other images are based on in bases
+_BuildSettings = collections.namedtuple('_BuildSettings', 'tag registry project_images context_mode bases')
+# The state of the builds of build_images, guarded by condition
+_Builds = collections.namedtuple('_Builds', 'dependencies jobs pending running results condition')
+
+
+def build_command(image, tag, cache_tag=None, latest=False):
+    '''
+    Returns the docker build command of image:tag, without its context argument.
+    With latest, the image is also tagged image:latest.
+    '''
+    command = [
+        'docker',
+        'build',
+        '-f', utils.image_to_dockerfile(image),
+        '-t', image + ':' + tag,
+    ]
+    if cache_tag is not None:
+        command += ['-t', image + ':' + cache_tag]
+    if latest:
+        command += ['-t', image + ':' + LATEST_TAG]
+    return command
+
+
+def retag_from_cache(registry, image, tag, cache_tag, latest=False):
+    '''
+    Tag the cached image with the given cache tag as image:tag, and with latest also as image:latest.
+    Returns None when there is no such image, otherwise the exit code of tagging it.
+    '''
+    cached_image = build_cache.find_cached_image(registry, image, cache_tag)
+    if cached_image is None:
+        return None
+
+    utils.logger.info('Image %(image)s is up to date, using %(cached_image)s', dict(image=image, cached_image=cached_image))
+    ret = build_cache.tag_image(cached_image, image + ':' + tag)
+    if ret == 0 and latest:
+        ret = build_cache.tag_image(image + ':' + tag, image + ':' + LATEST_TAG)
+    return ret
+
+
+def get_base_images(images):
+    '''
+    Returns the images which other images of the given images are based on, which are
+    tagged latest when built. Images whose Dockerfile can't be read are skipped.
+    '''
+    bases = set()
+    for image in images:
+        try:
+            bases.update(utils.get_image_dependencies(image, images))
+        except (IOError, OSError):
+            continue
+    return bases
+
+
+def build_images(images, tag, jobs, registry=None, use_build_cache=False,  # pylint: disable=too-many-arguments
+                 context_mode=build_context.DOCKER):
+    '''
+    Build images concurrently, at most `jobs` at a time. An image whose
+    Dockerfile is based on another image of the project is built only after
+    that image was built successfully. Images other images are based on are
+    also tagged latest, which is what `FROM image` of the dependents refers to.
+    The first failure terminates every running build and cancels the pending ones.
+    Returns the exit code and a list of [image, status, seconds] rows.
+    '''
+    images = [image for image in images if _validate_image(image)]
+    dependencies = dict((image, utils.get_image_dependencies(image, images)) for image in images)
+    cycle = _find_cycle(dependencies)
+    if cycle:
+        utils.logger.error('Circular dependency between images: %(images)s', dict(images=', '.join(cycle)))
+        return 1, []
+
+    settings = _BuildSettings(tag, registry, utils.get_images_from_dockerfiles() if use_build_cache else None, context_mode,
+                              set(base for bases in dependencies.values() for base in bases))
+    builds = _Builds(dependencies, max(jobs, 1), sorted(dependencies), {}, {}, threading.Condition())
+    with builds.condition:
+        while builds.pending or builds.running:
+            if not _has_failed(builds):
+                _start_ready_builds(builds, settings)
+            else:
+                _cancel_pending_builds(builds)
+            if builds.running:
+                builds.condition.wait()
+
+    results = [[image] + list(builds.results[image]) for image in sorted(dependencies)]
+    return (1 if _has_failed(builds) else 0), results
+
+
+def _validate_image(image):
+    if not os.path.exists(utils.image_to_dockerfile(image)):
+        utils.logger.warning('Image %(image)s is not valid for this project! Skipping...', dict(image=image))
+        return False
+    return True
+
+
+def _find_cycle(dependencies):
+    visited = set()
+    for image in dependencies:
+        path = []
+        stack = [(image, iter(dependencies[image]))]
+        on_path = set([image])
+        path.append(image)
+        while stack:
+            node, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                visited.add(node)
+                on_path.discard(node)
+                path.pop()
+                stack.pop()
+            elif child in on_path:
+                return path[path.index(child):]
+            elif child not in visited:
+                on_path.add(child)
+                path.append(child)
+                stack.append((child, iter(dependencies[child])))
+    return []
+
+
+def _has_failed(builds):
+    return any(status == FAILED for status, _ in builds.results.values())
+
+
+def _start_ready_builds(builds, settings):
+    for image in list(builds.pending):
+        if len(builds.running) >= builds.jobs:
+            return
+        if all(builds.results.get(dependency, (None,))[0] in (BUILT, CACHED) for dependency in builds.dependencies[image]):
+            builds.pending.remove(image)
+            builds.running[image] = None
+            thread = threading.Thread(target=_build, args=(image, builds, settings))
+            thread.daemon = True
+            thread.start()
+
+
+def _cancel_pending_builds(builds):
+    for image in builds.pending:
+        builds.results[image] = (CANCELLED, 0.0)
+    del builds.pending[:]
+
+
+def _build(image, builds, settings):
+    utils.logger.info('Building image: %(image)s', dict(image=image))
+    start_time = time.time()
+    latest = image in settings.bases
+    cache_tag = None
+    if settings.project_images is not None:
+        cache_tag = build_cache.get_cache_tag(image, settings.project_images)
+        ret = retag_from_cache(settings.registry, image, settings.tag, cache_tag, latest)
+        if ret is not None:
+            with builds.condition:
+                if ret == 0:
+                    _finish(builds, image, CACHED, start_time)
+                else:
+                    _fail(builds, image, start_time)
+            return
+
+    with builds.condition:
+        if _has_failed(builds):
+            _finish(builds, image, CANCELLED, start_time)
+            return
+        proc = build_context.start_build(build_command(image, settings.tag, cache_tag, latest),
+                                         utils.image_to_dockerfile(image), settings.context_mode)
+        builds.running[image] = proc
+
+    returncode = proc.wait()
+    utils.invalidate_local_images()
+
+    with builds.condition:
+        if returncode == 0:
+            _finish(builds, image, BUILT, start_time)
+        elif _has_failed(builds):
+            _finish(builds, image, CANCELLED, start_time)
+        else:
+            _fail(builds, image, start_time)
+
+
+def _fail(builds, image, start_time):
+    utils.logger.error('Failed to build image: %(image)s', dict(image=image))
+    _finish(builds, image, FAILED, start_time)
+    for running_proc in builds.running.values():
+        if running_proc is not None and running_proc.poll() is None:
+            running_proc.terminate()
+
+
+def _finish(builds, image, status, start_time):
+    del builds.running[image]
+    end_time = time.time()
+    builds.results[image] = (status, round(end_time - start_time, 2))
+    tracing.add_span('build ' + image, start_time, end_time, 'build', status=status)
+    metrics.observe(metrics.BUILD_DURATION, end_time - start_time, image=image, status=status)
+    builds.condition.notify()
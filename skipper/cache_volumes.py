@@ -0,0 +1,95 @@
+import hashlib
+import json
+import os
+import re
+
+
+VOLUME_PREFIX = 'skipper-cache-'
+CACHE_LABEL = 'skipper.cache'
+PROJECT_LABEL = 'skipper.cache.project'
+IMAGE_LABEL = 'skipper.cache.image'
+PATHS_VARIABLE = 'SKIPPER_CACHE_PATHS'
+WOULD_DELETE = 'would delete'
+DELETED = 'deleted'
+FAILED = 'failed'
+
+_caches = {}   # pylint: disable=invalid-name
+_image = None   # pylint: disable=invalid-name
+
+
+def configure(caches, image):
+    '''
+    Mount a named volume for every cache, a dict of cache names to their paths in the build
+    container, in the build containers of image. Volumes are kept per project and build
+    container image, so every build of the project in that image reuses them.
+    '''
+    global _caches, _image   # pylint: disable=global-statement,invalid-name
+    _caches = dict(caches or {})
+    _image = image
+
+
+def get_volume_name(cache, project, image):
+    key = json.dumps([project, image, cache])
+    return VOLUME_PREFIX + re.sub(r'[^a-zA-Z0-9_.-]', '_', cache) + '-' + hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]
+
+
+def get_mount_params():
+    '''
+    Returns the docker run params mounting the configured caches. The volumes are created on
+    first use by docker run itself, labeled with their cache, project and image.
+    '''
+    project = os.getcwd()
+    params = []
+    for cache in sorted(_caches):
+        fields = ['type=volume', 'src=' + get_volume_name(cache, project, _image), 'dst=' + _caches[cache],
+                  'volume-label=%(label)s=%(cache)s' % dict(label=CACHE_LABEL, cache=cache),
+                  'volume-label=%(label)s=%(project)s' % dict(label=PROJECT_LABEL, project=project),
+                  'volume-label=%(label)s=%(image)s' % dict(label=IMAGE_LABEL, image=_image or '')]
+        params += ['--mount', ','.join(_quote_field(field) for field in fields)]
+    return params
+
+
+def get_paths():
+    '''
+    Returns the paths of the configured caches in the build container
+    '''
+    return [_caches[cache] for cache in sorted(_caches)]
+
+
+def list_volumes(backend, all_projects=False):
+    '''
+    Returns a [volume, cache, image, project, size] row per cache volume of the project, or
+    of every project. size is in bytes, None if the backend doesn't report it.
+    '''
+    project = os.getcwd()
+    rows = []
+    for volume in backend.list_volumes(CACHE_LABEL):
+        labels = volume['labels']
+        if all_projects or labels.get(PROJECT_LABEL) == project:
+            rows.append([volume['name'], labels[CACHE_LABEL], labels.get(IMAGE_LABEL), labels.get(PROJECT_LABEL), volume['size']])
+    return sorted(rows, key=lambda row: (row[3], row[2], row[1]))
+
+
+def prune(backend, caches=(), all_projects=False, dry_run=False):
+    '''
+    Deletes the cache volumes of the project, or of every project, optionally only those
+    of the given caches. Volumes of running build containers can't be deleted.
+    Returns a [volume, cache, project, status] row per volume.
+    '''
+    rows = []
+    for name, cache, _, project, _ in list_volumes(backend, all_projects):
+        if caches and cache not in caches:
+            continue
+        if dry_run:
+            status = WOULD_DELETE
+        else:
+            status = DELETED if backend.remove_volume(name) == 0 else FAILED
+        rows.append([name, cache, project, status])
+    return rows
+
+
+def _quote_field(field):
+    # docker parses --mount as a CSV record
+    if ',' in field or '"' in field:
+        return '"' + field.replace('"', '""') + '"'
+    return field
@@ -1,40 +1,113 @@
+import itertools
+import json
 import logging
 import os.path
-import tabulate
+import subprocess
+import time
 import click
+from skipper import build_cache
+from skipper import build_context
+from skipper import builder
+from skipper import cache_volumes
+from skipper import config
+from skipper import docker
 from skipper import git
+from skipper import maker
+from skipper import metrics
+from skipper import pusher
+from skipper import registry_cache
+from skipper import retention
 from skipper import runner
+from skipper import sharder
+from skipper import tracing
 from skipper import utils
 
 
+DIRTY_TAG_SUFFIX = '-dirty'
+
+
+def _resolve_cli_path(ctx, param, value):
+    # skipper runs from the project directory, paths typed on the command line are relative to
+    # the directory it was started in, and defaults, also those of skipper.yaml, to the project
+    if value is None or not _is_from_command_line(ctx, param, value):
+        return value
+    return config.resolve_path(value)
+
+
+def _is_from_command_line(ctx, param, value):
+    if hasattr(ctx, 'get_parameter_source'):
+        return ctx.get_parameter_source(param.name) == click.core.ParameterSource.COMMANDLINE
+    # Click before 8.0 doesn't tell where a value came from, a value equal to the default is taken as the default
+    return value not in (param.default, ctx.lookup_default(param.name))
+
+
 @click.group()
 @click.option('-v', '--verbose', help='Increase verbosity', is_flag=True, default=False)
 @click.option('--registry', help='URL of the docker registry')
 @click.option('--build-container-image', help='Image to use as build container')
 @click.option('--build-container-tag', help='Tag of the build container')
+@click.option('--build-cache', help='Reuse images whose Dockerfile and sources did not change', is_flag=True, default=False)
+@click.option('--registry-cache-ttl', help='Seconds to trust cached registry metadata without revalidating it', type=click.IntRange(min=0),
+              default=registry_cache.DEFAULT_TTL)
+@click.option('--no-cache', help='Do not use cached registry metadata', is_flag=True, default=False)
+@click.option('--docker-backend', help='How to talk to docker, auto uses the Engine API socket when available',
+              type=click.Choice(docker.BACKENDS), default='auto')
+@click.option('--session', help='Run commands in a long-lived build container with docker exec', is_flag=True, default=False)
+@click.option('--session-idle-timeout', help='Seconds without commands after which the session container exits',
+              type=click.IntRange(min=1), default=runner.DEFAULT_SESSION_IDLE_TIMEOUT)
+@click.option('--user-image', help='Run commands in a cached image of the build container in which your user is set up',
+              is_flag=True, default=False)
+@click.option('--mark-dirty', help='Add -dirty to the tag of images built from a tree with uncommitted changes',
+              is_flag=True, default=False)
+@click.option('--build-context', 'build_context_mode',
+              help='Context of image builds: computed by docker, or by skipper from .dockerignore '
+                   'and optionally narrowed to the paths referenced by the Dockerfile',
+              type=click.Choice(build_context.MODES), default=build_context.DOCKER)
+@click.option('--trace', help='Write timing spans of the command to this file, in Chrome trace event format',
+              type=click.Path(dir_okay=False, writable=True), callback=_resolve_cli_path)
+@click.option('--metrics-dir', help='node_exporter textfile collector directory to add metrics of the command to',
+              type=click.Path(file_okay=False), callback=_resolve_cli_path)
 @click.pass_context
-def cli(ctx, registry, build_container_image, build_container_tag, verbose):
+def cli(ctx, verbose, trace, metrics_dir, no_cache, registry_cache_ttl,  # pylint: disable=too-many-arguments
+        docker_backend, session, session_idle_timeout, **options):
     '''
     Easily dockerize your Git repository
     '''
+    # The options of the process-wide modules are handled here, the others are passed to the commands as is
     logging_level = logging.DEBUG if verbose else logging.INFO
     utils.configure_logging(name='skipper', level=logging_level)
-
-    ctx.obj['registry'] = registry
-    ctx.obj['build_container_image'] = build_container_image
-    ctx.obj['build_container_tag'] = build_container_tag
+    tracing.configure(trace)
+    metrics.configure(metrics_dir, ctx.invoked_subcommand)
+    registry_cache.configure(None if no_cache else registry_cache.RegistryCache(ttl=registry_cache_ttl))
+    docker.configure_backend(docker_backend)
+    cache_volumes.configure(ctx.default_map.get('caches', {}), options['build_container_image'])
+
+    ctx.obj.update(options)
+    ctx.obj['session_idle_timeout'] = session_idle_timeout if session else None
     ctx.obj['env'] = ctx.default_map.get('env', {})
 
 
 @cli.command()
+@click.option('-j', '--jobs', help='Number of images to build in parallel', type=click.IntRange(min=1), default=1)
 @click.argument('images_to_build', nargs=-1, metavar='[IMAGE...]')
-def build(images_to_build):
+@click.pass_context
+def build(ctx, jobs, images_to_build):
     '''
     Build a container
     '''
     utils.logger.debug("Executing build command")
-    images_to_build = images_to_build or utils.get_images_from_dockerfiles()
-    tag = git.get_hash()
+    project_images = utils.get_images_from_dockerfiles()
+    images_to_build = images_to_build or project_images
+    tag = _get_tag(ctx)
+    if jobs > 1:
+        ret, results = builder.build_images(images_to_build, tag, jobs, ctx.obj['registry'], ctx.obj['build_cache'],
+                                            ctx.obj['build_context_mode'])
+        _print_table(results, headers=['IMAGE', 'STATUS', 'SECONDS'])
+        return ret
+
+    ret = 0
+    results = []
+    base_images = builder.get_base_images(images_to_build)
     for image in images_to_build:
         utils.logger.info('Building image: %(image)s', dict(image=image))
         dockerfile = utils.image_to_dockerfile(image)
@@ -43,140 +116,250 @@ def build(images_to_build):
             utils.logger.warning('Image %(image)s is not valid for this project! Skipping...', dict(image=image))
             continue
 
-        fqdn_image = image + ':' + tag
+        start_time = time.time()
+        ret, status = _build_image(ctx, image, tag, project_images, image in base_images)
+        results.append([image, status, round(time.time() - start_time, 2)])
+        if ret != 0:
+            break
 
-        command = [
-            'docker',
-            'build',
-            '-f', dockerfile,
-            '-t', fqdn_image,
-            '.'
-        ]
+    _print_table(results, headers=['IMAGE', 'STATUS', 'SECONDS'])
+    return ret
 
-        ret = runner.run(command)
-        if ret != 0:
-            utils.logger.error('Failed to build image: %(image)s', dict(image=image))
-            return ret
 
-    return 0
+def _build_image(ctx, image, tag, project_images, latest):
+    dockerfile = utils.image_to_dockerfile(image)
+    cache_tag = None
+    if ctx.obj['build_cache']:
+        cache_tag = build_cache.get_cache_tag(image, project_images)
+        ret = builder.retag_from_cache(ctx.obj['registry'], image, tag, cache_tag, latest)
+        if ret == 0:
+            return ret, builder.CACHED
+        if ret is not None:
+            utils.logger.error('Failed to tag image: %(image)s', dict(image=image))
+            return ret, builder.FAILED
+
+    start_time = time.time()
+    with tracing.span('build ' + image, 'build'):
+        ret = build_context.run_build(builder.build_command(image, tag, cache_tag, latest), dockerfile, ctx.obj['build_context_mode'])
+    status = builder.BUILT if ret == 0 else builder.FAILED
+    metrics.observe(metrics.BUILD_DURATION, time.time() - start_time, image=image, status=status)
+    if ret != 0:
+        utils.logger.error('Failed to build image: %(image)s', dict(image=image))
+    return ret, status
 
 
 @cli.command()
-@click.argument('image')
+@click.option('-j', '--jobs', help='Number of images to push in parallel', type=click.IntRange(min=1), default=4)
+@click.option('--force', help='Push images even if the registry already has them', is_flag=True, default=False)
+@click.argument('images_to_push', nargs=-1, metavar='[IMAGE...]')
 @click.pass_context
-def push(ctx, image):
+def push(ctx, jobs, force, images_to_push):
     '''
-    Push a container
+    Push containers
     '''
     utils.logger.debug("Executing push command")
     _validate_global_params(ctx, 'registry')
-    tag = git.get_hash()
-    image_name = image + ':' + tag
-    fqdn_image = utils.generate_fqdn_image(ctx.obj['registry'], image, tag)
-
-    utils.logger.debug("Adding tag %(tag)s", dict(tag=fqdn_image))
-    command = [
-        'docker',
-        'tag',
-        image_name,
-        fqdn_image
-    ]
-    runner.run(command)
+    project_images = utils.get_images_from_dockerfiles()
+    images_to_push = images_to_push or project_images
+    tag = _get_tag(ctx)
+    targets = []
+    for image in images_to_push:
+        remote_tags = [tag]
+        if ctx.obj['build_cache']:
+            cache_tag = build_cache.get_cache_tag(image, project_images)
+            if build_cache.is_cache_tag_of(image, tag, cache_tag):
+                remote_tags.append(cache_tag)
+            else:
+                utils.logger.info("Not pushing %(image)s:%(cache_tag)s, the sources changed since %(image)s:%(tag)s was built",
+                                  dict(image=image, cache_tag=cache_tag, tag=tag))
+        targets.append((image, tag, remote_tags))
 
     utils.logger.debug("Pushing to registry %(registry)s", dict(registry=ctx.obj['registry']))
-    command = [
-        'docker',
-        'push',
-        fqdn_image
-    ]
-    runner.run(command)
-
-    utils.logger.debug("Removing tag %(tag)s", dict(tag=fqdn_image))
-    command = [
-        'docker',
-        'rmi',
-        fqdn_image
-    ]
-    runner.run(command)
+    ret, results = pusher.push_images(ctx.obj['registry'], targets, jobs, force)
+    _print_table(results, headers=['IMAGE', 'STATUS', 'BYTES', 'SECONDS', 'MB/S'], missingval='-')
+    return ret
 
 
 @cli.command()
 @click.option('-r', '--remote', help='List also remote images', is_flag=True, default=False)
+@click.option('--format', 'output_format', help='Output format, ndjson and plain print the images as they are listed',
+              type=click.Choice(['table', 'ndjson', 'plain']), default='table')
 @click.pass_context
-def images(ctx, remote):
+def images(ctx, remote, output_format):
     '''
     List images
     '''
     utils.logger.debug("Executing images command")
     images_names = utils.get_images_from_dockerfiles()
     utils.logger.info("Expected images: %(images)s\n" % dict(images=", ".join(images_names)))
-    images_info = utils.get_local_images_info(images_names)
     if remote:
         _validate_global_params(ctx, 'registry')
+
+    if output_format != 'table':
+        images_info = utils.get_local_images_info(images_names)
+        if remote:
+            images_info = itertools.chain(images_info, utils.iter_remote_images_info(images_names, ctx.obj['registry']))
+        try:
+            for image_info in images_info:
+                print(_format_image_info(image_info, output_format))
+        except Exception as exp:
+            raise click.exceptions.ClickException('Got unknow error from remote registry %(error)s' % dict(error=exp))
+        return
+
+    images_info = utils.get_local_images_info(images_names)
+    if remote:
         try:
             images_info += utils.get_remote_images_info(images_names, ctx.obj['registry'])
         except Exception as exp:
             raise click.exceptions.ClickException('Got unknow error from remote registry %(error)s' % dict(error=exp.message))
 
-    print(tabulate.tabulate(images_info, headers=['REGISTRY', 'IMAGE', 'TAG'], tablefmt='grid'))
+    _print_table(images_info, headers=['REGISTRY', 'IMAGE', 'TAG'])
 
 
 @cli.command()
 @click.option('-r', '--remote', help='Delete image from registry', is_flag=True, default=False)
-@click.argument('image')
-@click.argument('tag')
+@click.option('--keep-shared', help='Keep registry manifests which other tags point to', is_flag=True, default=False)
+@click.argument('references', nargs=-1, required=True, metavar='IMAGE:TAG...')
 @click.pass_context
-def rmi(ctx, remote, image, tag):
+def rmi(ctx, remote, keep_shared, references):
     '''
-    Delete an image from local docker or from registry
+    Delete images from local docker or from registry.
+    TAG may be a glob, e.g. 'production:pr-*', and IMAGE TAG is the same as IMAGE:TAG.
     '''
     utils.logger.debug("Executing rmi command")
-    _validate_project_image(image)
+    references = _parse_references(references)
     if remote:
         _validate_global_params(ctx, 'registry')
-        utils.delete_image_from_registry(ctx.obj['registry'], image, tag)
+        results = utils.delete_images_from_registry(ctx.obj['registry'], references, keep_shared)
     else:
-        utils.delete_local_image(image, tag)
+        results = utils.delete_local_images(references)
+
+    _print_table([[image, tag, error or 'deleted'] for image, tag, error in results], headers=['IMAGE', 'TAG', 'STATUS'])
+    return 1 if any(error for _, _, error in results) else 0
+
+
+@cli.command()
+@click.argument('image')
+@click.argument('src_tag')
+@click.argument('dst_tags', nargs=-1, required=True, metavar='DST_TAG...')
+@click.pass_context
+def promote(ctx, image, src_tag, dst_tags):
+    '''
+    Tag an image in the registry without pulling or pushing it.
+    IMAGE may be a comma separated list of images.
+    '''
+    utils.logger.debug("Executing promote command")
+    _validate_global_params(ctx, 'registry')
+    images_to_promote = image.split(',')
+    for image_to_promote in images_to_promote:
+        _validate_project_image(image_to_promote)
+
+    results = utils.promote_images(ctx.obj['registry'], images_to_promote, src_tag, dst_tags)
+    _print_table([[image_name, src_tag, tag, error or 'promoted'] for image_name, tag, error in results],
+                 headers=['IMAGE', 'SOURCE', 'TAG', 'STATUS'])
+    return 1 if any(error for _, _, error in results) else 0
+
+
+@cli.command()
+@click.option('-r', '--remote', help='Delete also tags from registry', is_flag=True, default=False)
+@click.option('--keep-last', help='Number of tags of the latest commits to keep', type=click.IntRange(min=0), default=10)
+@click.option('--keep-branch', help='Keep the tags of commits reachable from this branch', multiple=True)
+@click.option('--keep', 'keep_patterns', help='Keep the tags matching this pattern', multiple=True)
+@click.option('--delete', 'delete_patterns', help='Delete the tags which are not commit ids matching this pattern', multiple=True)
+@click.option('-n', '--dry-run', help='Only report the tags that would be deleted', is_flag=True, default=False)
+@click.option('-j', '--jobs', help='Number of concurrent registry requests', type=click.IntRange(min=1), default=8)
+@click.option('--rate', help='Maximal registry requests per second, 0 for unlimited', type=click.FloatRange(min=0), default=0)
+@click.argument('images_to_collect', nargs=-1, metavar='[IMAGE...]')
+@click.pass_context
+def gc(ctx, remote, keep_last, keep_branch, keep_patterns, delete_patterns,  # pylint: disable=invalid-name,too-many-arguments
+       dry_run, jobs, rate, images_to_collect):
+    '''
+    Delete the tags of images which the retention policy doesn't keep
+    '''
+    utils.logger.debug("Executing gc command")
+    for image in images_to_collect:
+        _validate_project_image(image)
+    images_to_collect = images_to_collect or utils.get_images_from_dockerfiles()
+    if remote:
+        _validate_global_params(ctx, 'registry')
+
+    policy = retention.RetentionPolicy(keep_last, keep_branch, keep_patterns, delete_patterns)
+    try:
+        rows = retention.collect_local_images(images_to_collect, policy, dry_run)
+        if remote:
+            rows += retention.collect_remote_images(ctx.obj['registry'], images_to_collect, policy, jobs, rate, dry_run)
+    except subprocess.CalledProcessError as exp:
+        raise click.exceptions.ClickException('Failed to read git history: %(error)s' % dict(error=exp))
+
+    _print_table(rows, headers=['IMAGE', 'TAG', 'LOCATION', 'STATUS', 'DETAILS'], missingval='-')
+    return 1 if any(row[3] == retention.FAILED for row in rows) else 0
 
 
 @cli.command(context_settings=dict(ignore_unknown_options=True))
 @click.option('-i', '--interactive', help='Interactive mode', is_flag=True, default=False)
 @click.option('-e', '--env', multiple=True, help='Environment variables to pass the container')
+@click.option('--shards', help='Number of build containers to run the command in at once, each told its shard '
+                               'by SKIPPER_SHARD_INDEX and SKIPPER_SHARD_COUNT', type=click.IntRange(min=1), default=1)
+@click.option('--shard-files', 'shard_file_patterns', multiple=True,
+              help='Split the files matching this pattern between the shards and add them to the command')
 @click.argument('command', nargs=-1, type=click.UNPROCESSED, required=True)
 @click.pass_context
-def run(ctx, interactive, env, command):
+def run(ctx, interactive, env, shards, shard_file_patterns, command):  # pylint: disable=too-many-arguments
     '''
     Run arbitrary commands
     '''
     utils.logger.debug("Executing run command")
     _validate_global_params(ctx, 'build_container_image')
+    sharded = shards > 1 or shard_file_patterns
+    if interactive and sharded:
+        raise click.BadParameter('Sharded commands can not be interactive', param_hint='interactive')
     build_container = _prepare_build_container(ctx.obj['registry'],
                                                ctx.obj['build_container_image'],
-                                               ctx.obj['build_container_tag'])
-    return runner.run(list(command), fqdn_image=build_container, environment=_expend_env(ctx, env), interactive=interactive)
+                                               ctx.obj['build_container_tag'],
+                                               ctx.obj['build_cache'],
+                                               ctx.obj['build_context_mode'])
+    # Commands start in the directory skipper was started in, so their relative paths work as typed
+    if sharded:
+        return sharder.run_shards(list(command), build_container, _expend_env(ctx, env), shards, ctx.obj['user_image'],
+                                  shard_file_patterns, workdir=config.get_invocation_dir())
+    return runner.run(list(command), fqdn_image=build_container, environment=_expend_env(ctx, env), interactive=interactive,
+                      session_idle_timeout=ctx.obj['session_idle_timeout'], user_image=ctx.obj['user_image'],
+                      workdir=config.get_invocation_dir())
 
 
 @cli.command(context_settings=dict(ignore_unknown_options=True))
 @click.option('-i', '--interactive', help='Interactive mode', is_flag=True, default=False)
 @click.option('-e', '--env', multiple=True, help='Environment variables to pass the container')
-@click.option('-f', 'makefile', help='Makefile to use', default='Makefile')
-@click.argument('target')
+@click.option('-f', 'makefile', help='Makefile to use', default='Makefile',
+              callback=_resolve_cli_path)
+@click.option('-P', '--parallel', 'jobs', help='Number of targets to run in parallel, each in its own build container',
+              type=click.IntRange(min=1), default=1)
+@click.argument('targets', nargs=-1, required=True, metavar='TARGET...')
 @click.pass_context
-def make(ctx, interactive, env, makefile, target):
+def make(ctx, interactive, env, makefile, jobs, targets):  # pylint: disable=too-many-arguments
     '''
-    Execute makefile target
+    Execute makefile targets
     '''
     utils.logger.debug("Executing make command")
     _validate_global_params(ctx, 'build_container_image')
+    if interactive and jobs > 1:
+        raise click.BadParameter('Targets run in parallel can not be interactive', param_hint='interactive')
     build_container = _prepare_build_container(ctx.obj['registry'],
                                                ctx.obj['build_container_image'],
-                                               ctx.obj['build_container_tag'])
+                                               ctx.obj['build_container_tag'],
+                                               ctx.obj['build_cache'],
+                                               ctx.obj['build_context_mode'])
+    if jobs > 1 and len(targets) > 1:
+        ret, results = maker.make_targets(list(targets), makefile, build_container, _expend_env(ctx, env), jobs, ctx.obj['user_image'])
+        _print_table(results, headers=['TARGET', 'STATUS', 'EXIT CODE', 'SECONDS'])
+        return ret
+
     command = [
         'make',
         '-f', makefile,
-        target
-    ]
-    return runner.run(command, fqdn_image=build_container, environment=_expend_env(ctx, env), interactive=interactive)
+    ] + list(targets)
+    return runner.run(command, fqdn_image=build_container, environment=_expend_env(ctx, env), interactive=interactive,
+                      session_idle_timeout=ctx.obj['session_idle_timeout'], user_image=ctx.obj['user_image'])
 
 
 @cli.command()
@@ -190,11 +373,61 @@ def shell(ctx, env):
     _validate_global_params(ctx, 'build_container_image')
     build_container = _prepare_build_container(ctx.obj['registry'],
                                                ctx.obj['build_container_image'],
-                                               ctx.obj['build_container_tag'])
-    return runner.run(['bash'], fqdn_image=build_container, environment=_expend_env(ctx, env), interactive=True)
+                                               ctx.obj['build_container_tag'],
+                                               ctx.obj['build_cache'],
+                                               ctx.obj['build_context_mode'])
+    return runner.run(['bash'], fqdn_image=build_container, environment=_expend_env(ctx, env), interactive=True,
+                      session_idle_timeout=ctx.obj['session_idle_timeout'], user_image=ctx.obj['user_image'],
+                      workdir=config.get_invocation_dir())
+
+
+@cli.group()
+def cache():
+    '''
+    Manage the cache volumes of build containers
+    '''
+
+
+@cache.command('ls')
+@click.option('-a', '--all', 'all_projects', help='List the cache volumes of every project', is_flag=True, default=False)
+def cache_ls(all_projects):
+    '''
+    List cache volumes and their sizes
+    '''
+    utils.logger.debug("Executing cache ls command")
+    try:
+        rows = cache_volumes.list_volumes(docker.get_backend(), all_projects)
+    except (subprocess.CalledProcessError, docker.DockerError) as exp:
+        raise click.exceptions.ClickException('Failed to list cache volumes: %(error)s' % dict(error=exp))
+
+    _print_table([row[:4] + [utils.format_size(row[4])] for row in rows],
+                 headers=['VOLUME', 'CACHE', 'IMAGE', 'PROJECT', 'SIZE'], missingval='-')
 
 
-def _prepare_build_container(registry, image, tag):
+@cache.command('prune')
+@click.option('-a', '--all', 'all_projects', help='Delete the cache volumes of every project', is_flag=True, default=False)
+@click.option('-n', '--dry-run', help='Only report the volumes that would be deleted', is_flag=True, default=False)
+@click.argument('caches', nargs=-1, metavar='[CACHE...]')
+def cache_prune(all_projects, dry_run, caches):
+    '''
+    Delete cache volumes, all caches of the project by default
+    '''
+    utils.logger.debug("Executing cache prune command")
+    try:
+        rows = cache_volumes.prune(docker.get_backend(), caches, all_projects, dry_run)
+    except (subprocess.CalledProcessError, docker.DockerError) as exp:
+        raise click.exceptions.ClickException('Failed to list cache volumes: %(error)s' % dict(error=exp))
+
+    _print_table(rows, headers=['VOLUME', 'CACHE', 'PROJECT', 'STATUS'])
+    return 1 if any(row[3] == cache_volumes.FAILED for row in rows) else 0
+
+
+def _prepare_build_container(registry, image, tag, use_build_cache=False, context_mode=build_context.DOCKER):
+    with tracing.span('prepare build container', 'build', image=image):
+        return _get_build_container(registry, image, tag, use_build_cache, context_mode)
+
+
+def _get_build_container(registry, image, tag, use_build_cache, context_mode):
     if tag is not None:
         if utils.local_image_exist(image, tag):
             image_name = image + ':' + tag
@@ -208,20 +441,51 @@ def _prepare_build_container(registry, image, tag):
 
         raise click.exceptions.ClickException("Couldn't find build image %(image)s with tag %(tag)s" % dict(image=image, tag=tag))
 
-    utils.logger.info("No build container tag was provided. Building from scratch...")
     dockerfile = utils.image_to_dockerfile(image)
+    cache_tag = None
+    if use_build_cache and os.path.exists(dockerfile):
+        cache_tag = build_cache.get_cache_tag(image, utils.get_images_from_dockerfiles())
+        cached_image = build_cache.find_cached_image(registry, image, cache_tag)
+        if cached_image is not None:
+            utils.logger.info("Using build container: %(cached_image)s", dict(cached_image=cached_image))
+            build_cache.tag_image(cached_image, image)
+            return image
+
+    utils.logger.info("No build container tag was provided. Building from scratch...")
     command = [
         'docker',
         'build',
         '-t', image,
+    ]
+    if cache_tag is not None:
+        command += ['-t', image + ':' + cache_tag]
+    command += [
         '-f', dockerfile,
-        '.'
     ]
 
-    runner.run(command)
+    build_context.run_build(command, dockerfile, context_mode)
     return image
 
 
+def _get_tag(ctx):
+    tag = git.get_hash()
+    if ctx.obj['mark_dirty'] and git.is_dirty():
+        tag += DIRTY_TAG_SUFFIX
+    return tag
+
+
+def _print_table(rows, headers, **kwargs):
+    # tabulate is slow to import, so only commands that print a table import it
+    import tabulate
+    print(tabulate.tabulate(rows, headers=headers, tablefmt='grid', **kwargs))
+
+
+def _format_image_info(image_info, output_format):
+    if output_format == 'ndjson':
+        return json.dumps(dict(zip(['registry', 'image', 'tag'], image_info)))
+    return '\t'.join(image_info)
+
+
 def _validate_global_params(ctx, *params):
     for param in params:
         if ctx.obj[param] is None:
@@ -234,6 +498,20 @@ def _validate_project_image(image):
         raise click.BadParameter("'%s' is not an image of this project, try %s" % (image, project_images), param_hint='image')
 
 
+def _parse_references(references):
+    if len(references) == 2 and ':' not in references[0] + references[1]:
+        references = [':'.join(references)]
+
+    parsed = []
+    for reference in references:
+        image, separator, tag = reference.rpartition(':')
+        if not separator or not tag:
+            raise click.BadParameter("'%s' is not an IMAGE:TAG reference" % reference, param_hint='references')
+        _validate_project_image(image)
+        parsed.append((image, tag))
+    return parsed
+
+
 def _expend_env(ctx, extra_env):
     environment = []
     for key, value in ctx.obj['env'].iteritems():
@@ -1,29 +1,128 @@
 from string import Template
 from collections import defaultdict
+import glob
 import os
-import yaml
+from skipper import registry_cache
+from skipper import utils
+
+
+CONFIG_FILE = 'skipper.yaml'
+CACHE_SUBDIR = 'config'
+
+try:
+    STRING_TYPES = basestring   # pylint: disable=invalid-name
+except NameError:  # Python 3
+    STRING_TYPES = str   # pylint: disable=invalid-name
+
+_invocation_dir = None   # pylint: disable=invalid-name
 
 
 def load_defaults():
-    skipper_conf = 'skipper.yaml'
+    '''
+    Returns the normalized content of the skipper.yaml of the project. The result is
+    cached, and reused as long as the file and the environment variables it refers
+    to did not change.
+    '''
+    skipper_conf = find_config_file()
     defaults = {}
-    if os.path.exists(skipper_conf):
-        with open(skipper_conf) as confile:
-            config = yaml.load(confile)
-        _normalize_config(config, defaults)
+    if skipper_conf is not None:
+        cache = registry_cache.RegistryCache(os.path.join(registry_cache.get_cache_dir(), CACHE_SUBDIR))
+        stat = _stat(skipper_conf)
+        entry = cache.get(skipper_conf) if stat is not None else None
+        if entry is not None and _is_cache_entry_valid(entry['value'], stat):
+            return entry['value']['defaults']
+
+        env_vars = set()
+        _normalize_config(_load_yaml(skipper_conf), defaults, env_vars)
+        if stat is not None:
+            cache.put(skipper_conf, dict(mtime=stat.st_mtime, size=stat.st_size, defaults=defaults,
+                                         env=dict((name, os.environ.get(name)) for name in env_vars)))
 
     return defaults
 
 
-def _normalize_config(config, normalized_config):
-    for key, value in config.iteritems():
+def change_to_project_dir():
+    '''
+    Change to the directory of the skipper.yaml of the project, so skipper runs the same from any
+    of its subdirectories. Paths given on the command line stay relative to the directory skipper
+    was started in, see resolve_path.
+    '''
+    global _invocation_dir   # pylint: disable=global-statement,invalid-name
+    _invocation_dir = os.getcwd()
+    skipper_conf = find_config_file()
+    if skipper_conf is not None:
+        os.chdir(os.path.dirname(skipper_conf))
+
+
+def get_invocation_dir():
+    '''
+    Returns the directory skipper was started in
+    '''
+    return _invocation_dir or os.getcwd()
+
+
+def resolve_path(path):
+    '''
+    Returns the path, given on the command line, as seen from the project directory skipper runs in
+    '''
+    invocation_dir = get_invocation_dir()
+    if invocation_dir == os.getcwd():
+        return path
+    return os.path.normpath(os.path.join(invocation_dir, path))
+
+
+def find_config_file():
+    '''
+    Returns the path of the skipper.yaml in the current directory or in the closest of its parents, or None.
+    The search stops at a directory with Dockerfiles of its own, which is a project without a skipper.yaml.
+    '''
+    directory = os.getcwd()
+    while True:
+        skipper_conf = os.path.join(directory, CONFIG_FILE)
+        if os.path.exists(skipper_conf):
+            return skipper_conf
+        if glob.glob(os.path.join(directory, utils.image_to_dockerfile('*'))):
+            return None
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+
+
+def _load_yaml(skipper_conf):
+    import yaml
+    with open(skipper_conf) as confile:
+        return yaml.load(confile, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+
+
+def _stat(path):
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+
+def _is_cache_entry_valid(value, stat):
+    if (value['mtime'], value['size']) != (stat.st_mtime, stat.st_size):
+        return False
+    return all(os.environ.get(name) == env_value for name, env_value in value['env'].items())
+
+
+def _normalize_config(config, normalized_config, env_vars):
+    for key, value in config.items():
         if isinstance(value, dict):
             normalized_config[key] = {}
-            _normalize_config(value, normalized_config[key])
+            _normalize_config(value, normalized_config[key], env_vars)
         else:
             normalized_key = key.replace('-', '_')
-            normalized_config[normalized_key] = _interpolate_env_vars(value)
+            normalized_config[normalized_key] = _interpolate_env_vars(value, env_vars)
 
 
-def _interpolate_env_vars(key):
-    return Template(key).substitute(defaultdict(lambda: "", os.environ))
+def _interpolate_env_vars(key, env_vars):
+    if not isinstance(key, STRING_TYPES):
+        return key
+    template = Template(key)
+    for match in template.pattern.finditer(key):
+        env_vars.add(match.group('named') or match.group('braced'))
+    env_vars.discard(None)
+    return template.substitute(defaultdict(lambda: "", os.environ))
@@ -0,0 +1,454 @@
+import base64
+import json
+import logging
+import os
+import socket
+import stat
+import subprocess
+import sys
+import threading
+from skipper import runner
+from skipper import tracing
+
+try:
+    import http.client as httplib
+    from urllib.parse import quote, urlencode
+except ImportError:  # Python 2
+    import httplib
+    from urllib import quote, urlencode
+
+
+DEFAULT_SOCKET_PATH = '/var/run/docker.sock'
+API_VERSION = 'v1.24'
+DOCKER_CONFIG_PATH = os.path.join(os.environ.get('DOCKER_CONFIG', os.path.expanduser('~/.docker')), 'config.json')
+LOCAL_IMAGES_FORMAT = '{"name": "{{.Repository}}", "tag": "{{.Tag}}"}'
+INSPECT_FORMAT = '{"id": {{json .Id}}, "digests": {{json .RepoDigests}}}'
+BACKENDS = ['auto', 'api', 'cli']
+DOCKER_HUB_AUTH_KEY = 'https://index.docker.io/v1/'
+CREDENTIAL_HELPER_TOKEN_USERNAME = '<token>'
+
+_backend = None   # pylint: disable=invalid-name
+_output_lock = threading.Lock()   # pylint: disable=invalid-name
+
+
+class DockerError(Exception):
+    pass
+
+
+def configure_backend(name='auto', socket_path=None):
+    '''
+    Select the backend returned by get_backend: 'api' talks to the Engine API
+    over its unix socket, 'cli' forks the docker binary and 'auto' uses the
+    Engine API whenever its socket is available.
+    '''
+    global _backend   # pylint: disable=global-statement,invalid-name
+    socket_path = socket_path or _get_socket_path()
+    if name == 'api' or (name == 'auto' and EngineAPIBackend.is_available(socket_path)):
+        _backend = EngineAPIBackend(socket_path)
+    else:
+        _backend = CLIBackend()
+    return _backend
+
+
+def get_backend():
+    if _backend is None:
+        return configure_backend()
+    return _backend
+
+
+def _get_socket_path():
+    docker_host = os.environ.get('DOCKER_HOST')
+    if not docker_host:
+        return DEFAULT_SOCKET_PATH
+    if docker_host.startswith('unix://'):
+        return docker_host[len('unix://'):]
+    return None
+
+
+def _parse_repo_tag(repo_tag):
+    '''
+    Returns the repository and the tag of a name:tag reference, or the digest of a name@digest reference
+    '''
+    if '@' in repo_tag:
+        name, _, digest = repo_tag.partition('@')
+        return name, digest
+    name, _, tag = repo_tag.rpartition(':')
+    if not name or '/' in tag:
+        return repo_tag, 'latest'
+    return name, tag
+
+
+def _get_registry(repo):
+    # The first component of a repository is its registry when it looks like a host name
+    first, separator, _ = repo.partition('/')
+    if separator and ('.' in first or ':' in first or first == 'localhost'):
+        return first
+    return None
+
+
+def _get_auth_key_host(key):
+    return key.split('://', 1)[-1].split('/', 1)[0]
+
+
+def _log_event(name, event):
+    # Layer progress arrives many times a second, so only its state changes are shown
+    status = event.get('status')
+    if not status:
+        return
+    progress = event.get('progressDetail') or {}
+    log = logging.getLogger('skipper').debug if progress.get('current') is not None else logging.getLogger('skipper').info
+    if event.get('id'):
+        log('%(name)s %(id)s: %(status)s', dict(name=name, id=event['id'], status=status))
+    else:
+        log('%(name)s: %(status)s', dict(name=name, status=status))
+
+
+class CLIBackend(object):
+    '''
+    Runs the docker binary for every operation
+    '''
+    name = 'cli'
+
+    @staticmethod
+    def list_images():
+        command = [
+            'docker',
+            'images',
+            '--format', LOCAL_IMAGES_FORMAT,
+        ]
+        with tracing.span('docker images', 'subprocess', command=' '.join(command)):
+            output = subprocess.check_output(command)
+        return [json.loads(record) for record in output.splitlines()]
+
+    @staticmethod
+    def inspect_image(name):
+        try:
+            with tracing.span('docker image inspect', 'subprocess', image=name):
+                output = subprocess.check_output(['docker', 'image', 'inspect', '--format', INSPECT_FORMAT, name])
+        except subprocess.CalledProcessError as exc:
+            raise DockerError('Failed to inspect %(name)s: %(error)s' % dict(name=name, error=exc))
+        return json.loads(output)
+
+    @staticmethod
+    def tag_image(source, target):
+        return runner.run(['docker', 'tag', source, target])
+
+    @staticmethod
+    def push_image(name, capture_output=False):
+        '''
+        Returns the exit code, the pushed bytes and the digest of the pushed
+        manifest. The docker binary reports neither, so they are None.
+        With capture_output, the output of docker push is printed as a whole
+        when the push ends, so the outputs of concurrent pushes don't interleave.
+        '''
+        if not capture_output:
+            return dict(returncode=runner.run(['docker', 'push', name]), size=None, digest=None)
+
+        lines = []
+        with tracing.span('docker push', 'subprocess', command='docker push ' + name):
+            returncode = runner.Process(['docker', 'push', name], on_output=lines.append).wait()
+        with _output_lock:
+            stream = getattr(sys.stdout, 'buffer', sys.stdout)
+            stream.write(b''.join(lines))
+            stream.flush()
+        return dict(returncode=returncode, size=None, digest=None)
+
+    @staticmethod
+    def pull_image(name):
+        return runner.run(['docker', 'pull', name])
+
+    @staticmethod
+    def remove_image(name):
+        return runner.run(['docker', 'rmi', name])
+
+    @staticmethod
+    def remove_images(names):
+        '''
+        Removes every image with a single docker rmi, which goes on after failures.
+        Returns 0 if every image was removed.
+        '''
+        return runner.run(['docker', 'rmi'] + list(names))
+
+    @staticmethod
+    def list_volumes(label):
+        '''
+        Returns the name, labels and size of every volume with the label.
+        The docker binary doesn't report the size of volumes, so it is None.
+        '''
+        command = ['docker', 'volume', 'ls', '-q', '--filter', 'label=' + label]
+        with tracing.span('docker volume ls', 'subprocess', command=' '.join(command)):
+            names = subprocess.check_output(command).decode('utf-8').split()
+        if not names:
+            return []
+        with tracing.span('docker volume inspect', 'subprocess', volumes=len(names)):
+            output = subprocess.check_output(['docker', 'volume', 'inspect'] + names)
+        return [dict(name=info['Name'], labels=info.get('Labels') or {}, size=None) for info in json.loads(output.decode('utf-8'))]
+
+    @staticmethod
+    def remove_volume(name):
+        return runner.run(['docker', 'volume', 'rm', name])
+
+
+class EngineAPIBackend(object):
+    '''
+    Talks to the Docker Engine API over its unix socket. Every thread keeps
+    one persistent connection to the daemon.
+    '''
+    name = 'api'
+
+    def __init__(self, socket_path=DEFAULT_SOCKET_PATH):
+        self.socket_path = socket_path
+        self._local = threading.local()
+
+    @staticmethod
+    def is_available(socket_path):
+        try:
+            return socket_path is not None and stat.S_ISSOCK(os.stat(socket_path).st_mode)
+        except OSError:
+            return False
+
+    def list_images(self):
+        images = []
+        for info in self._request_json('GET', '/images/json'):
+            for repo_tag in info.get('RepoTags') or []:
+                if repo_tag == '<none>:<none>':
+                    continue
+                name, tag = _parse_repo_tag(repo_tag)
+                images.append(dict(name=name, tag=tag, id=info['Id'], digests=info.get('RepoDigests') or []))
+        return images
+
+    def inspect_image(self, name):
+        info = self._request_json('GET', '/images/%s/json' % _quote(name))
+        return dict(id=info['Id'], digests=info.get('RepoDigests') or [])
+
+    def tag_image(self, source, target):
+        repo, tag = _parse_repo_tag(target)
+        try:
+            self._request_json('POST', '/images/%s/tag' % _quote(source), dict(repo=repo, tag=tag))
+        except DockerError as exc:
+            logging.getLogger('skipper').error('Failed to tag %(source)s as %(target)s: %(error)s',
+                                               dict(source=source, target=target, error=exc))
+            return 1
+        return 0
+
+    def pull_image(self, name):
+        repo, tag = _parse_repo_tag(name)
+        headers = {'X-Registry-Auth': self._get_registry_auth(repo)}
+        try:
+            response = self._request('POST', '/images/create', dict(fromImage=repo, tag=tag), headers=headers)
+            for event in self._iter_events(response):
+                _log_event(name, event)
+        except DockerError as exc:
+            logging.getLogger('skipper').error('Failed to pull %(name)s: %(error)s', dict(name=name, error=exc))
+            return 1
+        return 0
+
+    def push_image(self, name, capture_output=False):  # pylint: disable=unused-argument
+        '''
+        Returns the exit code, the pushed bytes and the digest of the pushed manifest.
+        Progress is logged line by line, so concurrent pushes need no capture_output.
+        '''
+        repo, tag = _parse_repo_tag(name)
+        headers = {'X-Registry-Auth': self._get_registry_auth(repo)}
+        layers_size = {}
+        result = dict(returncode=0, size=0, digest=None)
+        try:
+            for event in self.push_image_events(repo, tag, headers):
+                progress = event.get('progressDetail') or {}
+                if event.get('status') == 'Pushing' and progress.get('total'):
+                    layers_size[event.get('id')] = progress['total']
+                result['digest'] = (event.get('aux') or {}).get('Digest', result['digest'])
+        except DockerError as exc:
+            logging.getLogger('skipper').error('Failed to push %(name)s: %(error)s', dict(name=name, error=exc))
+            result['returncode'] = 1
+        result['size'] = sum(layers_size.values())
+        return result
+
+    def push_image_events(self, repo, tag, headers):
+        '''
+        Yields the events of pushing repo:tag. The last event holds the digest
+        and the size of the pushed manifest under 'aux'.
+        '''
+        response = self._request('POST', '/images/%s/push' % _quote(repo), dict(tag=tag), headers=headers)
+        for event in self._iter_events(response):
+            _log_event(repo + ':' + tag, event)
+            yield event
+
+    def remove_image(self, name):
+        try:
+            for event in self._request_json('DELETE', '/images/%s' % _quote(name)):
+                logging.getLogger('skipper').debug('%(event)s', dict(event=event))
+        except DockerError as exc:
+            logging.getLogger('skipper').error('Failed to remove %(name)s: %(error)s', dict(name=name, error=exc))
+            return 1
+        return 0
+
+    def remove_images(self, names):
+        '''
+        Removes every image over the connection of this thread, going on after failures.
+        Returns 0 if every image was removed.
+        '''
+        return max([self.remove_image(name) for name in names] or [0])
+
+    def list_volumes(self, label):
+        '''
+        Returns the name, labels and size in bytes of every volume with the label.
+        Sizes come from the disk usage of the daemon, which walks every volume.
+        '''
+        volumes = []
+        for info in self._request_json('GET', '/system/df').get('Volumes') or []:
+            labels = info.get('Labels') or {}
+            if label in labels:
+                size = (info.get('UsageData') or {}).get('Size', -1)
+                volumes.append(dict(name=info['Name'], labels=labels, size=size if size >= 0 else None))
+        return volumes
+
+    def remove_volume(self, name):
+        try:
+            self._request_json('DELETE', '/volumes/%s' % _quote(name))
+        except DockerError as exc:
+            logging.getLogger('skipper').error('Failed to remove volume %(name)s: %(error)s', dict(name=name, error=exc))
+            return 1
+        return 0
+
+    @staticmethod
+    def _get_registry_auth(repo):
+        '''
+        Returns the X-Registry-Auth header of the registry of repo, resolved from the docker
+        client configuration as the docker binary does: through the credential helper of the
+        registry or the credentials store when one is configured, otherwise from the inline
+        credentials saved by docker login.
+        '''
+        registry = _get_registry(repo)
+        server = registry or DOCKER_HUB_AUTH_KEY
+        try:
+            with open(DOCKER_CONFIG_PATH) as config_file:
+                docker_config = json.load(config_file)
+        except (IOError, OSError, ValueError):
+            docker_config = {}
+
+        helper = (docker_config.get('credHelpers') or {}).get(registry or 'index.docker.io') or docker_config.get('credsStore')
+        if helper:
+            auth_config = _get_helper_credentials(helper, server)
+        else:
+            auth_config = _get_inline_credentials(docker_config.get('auths') or {}, server)
+        if auth_config:
+            auth_config['serveraddress'] = server
+        return base64.urlsafe_b64encode(json.dumps(auth_config).encode('utf-8')).decode('ascii')
+
+    def _request_json(self, method, path, query=None):
+        response = self._request(method, path, query)
+        body = response.read()
+        return json.loads(body.decode('utf-8')) if body else None
+
+    def _request(self, method, path, query=None, headers=None):
+        url = '/' + API_VERSION + path
+        if query:
+            url += '?' + urlencode(query)
+        headers = dict(headers or {})
+
+        with tracing.span(method + ' ' + path, 'docker'):
+            return self._request_response(method, url, headers)
+
+    def _request_response(self, method, url, headers):
+        try:
+            response = self._send(method, url, headers)
+        except (socket.error, httplib.HTTPException):
+            # The daemon may have closed our idle connection, retry once with a new one
+            self._close_connection()
+            response = self._send(method, url, headers)
+
+        if response.status >= 400:
+            message = response.read().decode('utf-8')
+            try:
+                message = json.loads(message).get('message', message)
+            except ValueError:
+                pass
+            raise DockerError('%(status)s: %(message)s' % dict(status=response.status, message=message))
+        return response
+
+    def _send(self, method, url, headers):
+        connection = self._get_connection()
+        connection.request(method, url, headers=headers)
+        return connection.getresponse()
+
+    @staticmethod
+    def _iter_events(response):
+        buf = b''
+        for chunk in iter(lambda: response.read(4096), b''):
+            buf += chunk
+            lines = buf.split(b'\n')
+            buf = lines.pop()
+            for line in lines:
+                event = EngineAPIBackend._parse_event(line)
+                if event is not None:
+                    yield event
+        event = EngineAPIBackend._parse_event(buf)
+        if event is not None:
+            yield event
+
+    @staticmethod
+    def _parse_event(line):
+        if not line.strip():
+            return None
+        event = json.loads(line.decode('utf-8'))
+        if 'error' in event:
+            raise DockerError(event['error'])
+        return event
+
+    def _get_connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = _UnixHTTPConnection(self.socket_path)
+            self._local.connection = connection
+        return connection
+
+    def _close_connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+
+def _get_inline_credentials(auths, server):
+    host = _get_auth_key_host(server)
+    for key in sorted(auths, key=lambda key: key != server):
+        auth = auths[key].get('auth')
+        if auth and _get_auth_key_host(key) == host:
+            username, _, password = base64.b64decode(auth).decode('utf-8').partition(':')
+            return dict(username=username, password=password)
+    return {}
+
+
+def _get_helper_credentials(helper, server):
+    command = ['docker-credential-' + helper, 'get']
+    try:
+        with tracing.span('docker-credential-' + helper, 'subprocess', command=' '.join(command)):
+            proc = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            output, _ = proc.communicate(server.encode('utf-8'))
+        if proc.returncode != 0:
+            return {}
+        credentials = json.loads(output.decode('utf-8'))
+    except (OSError, ValueError) as exc:
+        logging.getLogger('skipper').debug('Failed to get credentials of %(server)s from %(helper)s: %(error)s',
+                                           dict(server=server, helper=helper, error=exc))
+        return {}
+
+    if credentials.get('Username') == CREDENTIAL_HELPER_TOKEN_USERNAME:
+        return dict(identitytoken=credentials.get('Secret'))
+    return dict(username=credentials.get('Username'), password=credentials.get('Secret'))
+
+
+def _quote(name):
+    return quote(name, safe='/:@')
+
+
+class _UnixHTTPConnection(httplib.HTTPConnection):
+    def __init__(self, socket_path):
+        httplib.HTTPConnection.__init__(self, 'localhost')
+        self._socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self._socket_path)
+        self.sock = sock
@@ -0,0 +1,48 @@
+import json
+import os
+from skipper import files
+from skipper import registry_cache
+
+
+MAKE_DURATIONS_FILE = 'make-durations.json'
+SHARD_DURATIONS_FILE = 'shard-durations.json'
+
+
+def get_path(name):
+    '''
+    Returns the path of the durations file name in the cache directory of skipper
+    '''
+    return os.path.join(registry_cache.get_cache_dir(), name)
+
+
+def load(path):
+    '''
+    Returns the recorded durations in path, a dict of project to a dict of name to seconds
+    '''
+    try:
+        with open(path) as durations_file:
+            return json.load(durations_file)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def save(path, durations):
+    '''
+    Replace the recorded durations atomically, the last of concurrent skipper processes wins.
+    Returns False if they couldn't be saved.
+    '''
+    try:
+        files.write_atomically(path, json.dumps(durations))
+    except (IOError, OSError):
+        return False
+    return True
+
+
+def update(path, project, project_durations):
+    '''
+    Record the durations of a project, keeping the durations of other projects and the
+    names of the project which aren't in project_durations
+    '''
+    recorded = load(path)
+    recorded.setdefault(project, {}).update(project_durations)
+    return save(path, recorded)
@@ -0,0 +1,33 @@
+import errno
+import os
+import tempfile
+
+
+def makedirs(directory):
+    '''
+    Create directory and its parents, if it doesn't exist yet
+    '''
+    try:
+        os.makedirs(directory)
+    except OSError as exc:
+        if exc.errno != errno.EEXIST:
+            raise
+
+
+def write_atomically(path, content, mode=None):
+    '''
+    Replace the content of path with a rename, so readers see either the old or the
+    new content and the last of concurrent writers wins. Creates the directory of path.
+    '''
+    directory = os.path.dirname(path) or '.'
+    makedirs(directory)
+    temp_fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path) + '.')
+    try:
+        with os.fdopen(temp_fd, 'w') as temp_file:
+            temp_file.write(content)
+        if mode is not None:
+            os.chmod(temp_path, mode)
+        os.rename(temp_path, path)
+    except (IOError, OSError):
+        os.remove(temp_path)
+        raise
@@ -1,9 +1,261 @@
+import binascii
+import os
+import re
+import struct
 import subprocess
+import zlib
+from skipper import tracing
+
+
+HASH_PATTERN = re.compile(r'^[0-9a-f]{40}([0-9a-f]{24})?$')
+MAX_SYMREF_DEPTH = 5
+INDEX_SIGNATURE = b'DIRC'
+INDEX_TREE_SIGNATURE = b'TREE'
+INDEX_CHECKSUM_SIZE = 20
+INDEX_ENTRY_FORMAT = '>10I20sH'
+INDEX_EXTENDED_FLAG = 0x4000
+INDEX_ASSUME_VALID_FLAG = 0x8000
+INDEX_SKIP_WORKTREE_FLAG = 0x4000
+INDEX_NAME_MASK = 0xfff
+GITLINK_MODE = 0o160000
+
+_cache = {}   # pylint: disable=invalid-name
 
 
 def get_hash(short=False):
+    '''
+    Returns the commit id of HEAD. The full id is read from the .git directory
+    when possible, git rev-parse is only forked for layouts that are not handled
+    and for short ids. Results are cached for the lifetime of the process.
+    '''
+    key = (os.getcwd(), short)
+    if key not in _cache:
+        with tracing.span('git hash', 'git'):
+            git_hash = None if short else _read_head()
+            if git_hash is None:
+                git_hash = _rev_parse(short)
+        _cache[key] = git_hash
+    return _cache[key]
+
+
+def is_dirty():
+    '''
+    Returns whether tracked files have uncommitted changes, staged or not. Files whose size
+    or mtime differ from the ones recorded in the index were changed, and nothing was staged
+    when the tree the index records is the tree of HEAD. Untracked files are not detected.
+    Falls back to git diff-index when the index or the commit of HEAD can't be read, and when
+    files were changed in the second the index was written, which the mtime can't tell.
+    '''
+    with tracing.span('git dirty', 'git'):
+        git_dirs = _find_git_dirs()
+        index = _read_index(os.path.join(git_dirs[0], 'index')) if git_dirs is not None else None
+        if index is not None:
+            entries, tree_id, index_mtime = index
+            work_tree = os.path.dirname(git_dirs[2])
+            if any(_is_entry_modified(work_tree, entry) for entry in entries):
+                return True
+            # Entries as new as the index are racily clean, a change in the same second keeps their mtime
+            racy = any(mtime >= index_mtime for _, mtime, _ in entries)
+            if not racy and tree_id is not None and tree_id == _read_head_tree(git_dirs):
+                return False
+
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.call(['git', 'diff-index', '--quiet', 'HEAD', '--'], stdout=devnull, stderr=devnull) != 0
+
+
+def get_commit_times():
+    '''
+    Returns the commit time of every commit reachable from a ref, by commit id
+    '''
+    with tracing.span('git log', 'git'):
+        output = subprocess.check_output(['git', 'log', '--all', '--format=%H %ct'])
+    output = output.decode('utf-8') if isinstance(output, bytes) else output
+    return dict((commit, int(commit_time)) for commit, commit_time in (line.split() for line in output.splitlines()))
+
+
+def get_reachable_commits(ref):
+    '''
+    Returns the ids of the commits reachable from ref
+    '''
+    with tracing.span('git rev-list', 'git', ref=ref):
+        output = subprocess.check_output(['git', 'rev-list', ref, '--'])
+    output = output.decode('utf-8') if isinstance(output, bytes) else output
+    return set(output.split())
+
+
+def _rev_parse(short):
     git_command = ['git', 'rev-parse']
     if short:
         git_command += ['--short']
     git_command += ['HEAD']
-    return subprocess.check_output(git_command).strip()
+    output = subprocess.check_output(git_command).strip()
+    return output.decode('utf-8') if isinstance(output, bytes) else output
+
+
+def _read_head():
+    git_dirs = _find_git_dirs()
+    if git_dirs is None:
+        return None
+
+    git_dir, common_dir, _ = git_dirs
+    ref = 'HEAD'
+    for _ in range(MAX_SYMREF_DEPTH):
+        value = _read_ref(git_dir, common_dir, ref)
+        if value is None:
+            return None
+        if not value.startswith('ref: '):
+            return value if HASH_PATTERN.match(value) else None
+        ref = value[len('ref: '):].strip()
+    return None
+
+
+def _find_git_dirs():
+    '''
+    Returns the git directory of the working tree, the common directory holding
+    the shared refs of its worktrees, and the path of its .git entry.
+    '''
+    if 'GIT_DIR' in os.environ or 'GIT_COMMON_DIR' in os.environ:
+        return None
+
+    directory = os.getcwd()
+    while True:
+        dot_git = os.path.join(directory, '.git')
+        if os.path.isdir(dot_git):
+            git_dir = dot_git
+            break
+        if os.path.isfile(dot_git):
+            git_dir = _read_gitdir_file(dot_git)
+            if git_dir is None:
+                return None
+            break
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+
+    common_dir = git_dir
+    commondir_file = _read_file(os.path.join(git_dir, 'commondir'))
+    if commondir_file is not None:
+        common_dir = os.path.normpath(os.path.join(git_dir, commondir_file.strip()))
+    return git_dir, common_dir, dot_git
+
+
+def _read_gitdir_file(path):
+    content = _read_file(path)
+    if content is None or not content.startswith('gitdir: '):
+        return None
+    return os.path.normpath(os.path.join(os.path.dirname(path), content[len('gitdir: '):].strip()))
+
+
+def _read_ref(git_dir, common_dir, ref):
+    directories = [git_dir] if ref == 'HEAD' else [git_dir, common_dir]
+    for directory in directories:
+        value = _read_file(os.path.join(directory, ref))
+        if value is not None:
+            return value.strip()
+
+    packed_refs = _read_file(os.path.join(common_dir, 'packed-refs'))
+    for line in (packed_refs or '').splitlines():
+        if line.startswith('#') or line.startswith('^'):
+            continue
+        fields = line.split()
+        if len(fields) == 2 and fields[1] == ref:
+            return fields[0]
+    return None
+
+
+def _read_file(path):
+    try:
+        with open(path) as ref_file:
+            return ref_file.read()
+    except (IOError, OSError):
+        return None
+
+
+def _read_index(path):
+    '''
+    Returns the (path, mtime, size) entries of a version 2 or 3 index, the id of the tree
+    they make if the index records it, and the mtime of the index, or None
+    '''
+    try:
+        with open(path, 'rb') as index_file:
+            data = index_file.read()
+            index_mtime = int(os.fstat(index_file.fileno()).st_mtime)
+    except (IOError, OSError):
+        return None
+
+    if len(data) < 12 or data[:4] != INDEX_SIGNATURE:
+        return None
+    version, count = struct.unpack('>II', data[4:12])
+    if version not in (2, 3):
+        return None
+
+    entries = []
+    offset = 12
+    for _ in range(count):
+        entry, offset = _read_index_entry(data, offset)
+        if entry is not None:
+            entries.append(entry)
+
+    tree_id = None
+    while offset + 8 <= len(data) - INDEX_CHECKSUM_SIZE:
+        signature, size = data[offset:offset + 4], struct.unpack('>I', data[offset + 4:offset + 8])[0]
+        if signature == INDEX_TREE_SIGNATURE:
+            tree_id = _read_cache_tree_root(data[offset + 8:offset + 8 + size])
+        offset += 8 + size
+    return entries, tree_id, index_mtime
+
+
+def _read_index_entry(data, offset):
+    '''
+    Returns the (path, mtime, size) of the index entry at offset, or None if git doesn't
+    check the entry against the work tree, and the offset of the next entry
+    '''
+    entry_size = struct.calcsize(INDEX_ENTRY_FORMAT)
+    fields = struct.unpack(INDEX_ENTRY_FORMAT, data[offset:offset + entry_size])
+    mtime, mode, size, flags = fields[2], fields[6], fields[9], fields[11]
+    name_offset = offset + entry_size
+    skip = bool(flags & INDEX_ASSUME_VALID_FLAG) or mode == GITLINK_MODE
+    if flags & INDEX_EXTENDED_FLAG:
+        skip = skip or bool(struct.unpack('>H', data[name_offset:name_offset + 2])[0] & INDEX_SKIP_WORKTREE_FLAG)
+        name_offset += 2
+    name_end = data.index(b'\0', name_offset)
+    entry = None if skip else (data[name_offset:name_end].decode('utf-8'), mtime, size)
+    # Entries are padded with 1 to 8 NUL bytes to a multiple of 8 bytes
+    return entry, offset + ((name_end - offset + 8) & ~7)
+
+
+def _read_cache_tree_root(extension):
+    # The root has an empty path, and a negative entry count once a change under it was staged
+    header_end = extension.find(b'\n')
+    if not extension.startswith(b'\0') or header_end < 0 or int(extension[1:header_end].split()[0]) < 0:
+        return None
+    return binascii.hexlify(extension[header_end + 1:header_end + 21]).decode('ascii')
+
+
+def _read_head_tree(git_dirs):
+    '''
+    Returns the id of the tree of HEAD if its commit is a loose object, or None
+    '''
+    commit = _read_head()
+    if commit is None:
+        return None
+    try:
+        with open(os.path.join(git_dirs[1], 'objects', commit[:2], commit[2:]), 'rb') as object_file:
+            data = zlib.decompress(object_file.read())
+    except (IOError, OSError, zlib.error):
+        return None
+
+    header_end = data.find(b'\0')
+    if not data.startswith(b'commit ') or not data[header_end + 1:].startswith(b'tree '):
+        return None
+    return data[header_end + 1 + len(b'tree '):header_end + 1 + len(b'tree ') + 40].decode('ascii')
+
+
+def _is_entry_modified(work_tree, entry):
+    path, mtime, size = entry
+    try:
+        stat = os.lstat(os.path.join(work_tree, path))
+    except OSError:
+        return True
+    return int(stat.st_mtime) != mtime or stat.st_size & 0xffffffff != size
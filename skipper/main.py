@@ -1,23 +1,39 @@
 import sys
+import time
 import click
 from skipper import config
 from skipper import cli
+from skipper import metrics
+from skipper import tracing
 
 
 def main():
     # pylint: disable=unexpected-keyword-arg
     # pylint: disable=no-value-for-parameter
     # pylint: disable=assignment-from-no-return
+    start_time = time.time()
+    config.change_to_project_dir()
+    defaults = config.load_defaults()
+    config_time = time.time()
+
+    return_code = 1
     try:
         return_code = cli.cli(
             prog_name='skipper',
-            default_map=config.load_defaults(),
+            default_map=defaults,
             obj={},
             standalone_mode=False
         )
     except click.exceptions.ClickException as exc:
         exc.show()
         return_code = exc.exit_code
+    finally:
+        # Tracing and metrics are configured by the command line, after the configuration was loaded
+        tracing.add_span('load config', start_time, config_time)
+        tracing.add_span(' '.join(['skipper'] + sys.argv[1:]), start_time, time.time())
+        tracing.write()
+        metrics.observe_command(time.time() - start_time, return_code)
+        metrics.write()
 
     sys.exit(return_code)
 
@@ -0,0 +1,95 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+from skipper import durations
+from skipper import metrics
+from skipper import runner
+from skipper import tracing
+from skipper import utils
+
+
+PASSED = 'passed'
+FAILED = 'failed'
+
+
+def make_targets(targets, makefile, fqdn_image, environment, jobs,  # pylint: disable=too-many-arguments
+                 user_image=False, durations_path=None):
+    '''
+    Run every target in its own build container, at most `jobs` at a time. Targets are
+    started longest first, by the duration of their previous run, and targets which
+    never ran are started before all others. The output of every target is captured
+    and printed as a whole when the target ends, so outputs don't interleave.
+    Returns the exit code and a list of [target, status, exit code, seconds] rows.
+    '''
+    project = os.getcwd() + ':' + makefile
+    durations_path = durations_path or durations.get_path(durations.MAKE_DURATIONS_FILE)
+    targets = _order_targets(targets, durations.load(durations_path).get(project, {}))
+    nested_image, user_setup = runner.get_nested_image(fqdn_image, user_image)
+    output_lock = threading.Lock()
+
+    def _make(target):
+        return _make_target(target, makefile, nested_image, environment, user_setup, output_lock)
+
+    results = _map_in_order(_make, targets, jobs)
+    _save_durations(durations_path, project, results)
+    return (1 if any(status != PASSED for _, status, _, _ in results) else 0), results
+
+
+def _order_targets(targets, project_durations):
+    # Longest first, and targets which never ran before all others
+    return sorted(_unique(targets), key=lambda target: -project_durations.get(target, float('inf')))
+
+
+def _map_in_order(func, targets, jobs):
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(min(jobs, len(targets)))
+    try:
+        # A chunk size of 1 hands the targets to the workers one by one, in their order
+        return pool.map(func, targets, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _save_durations(durations_path, project, results):
+    passed = dict((target, seconds) for target, status, _, seconds in results if status == PASSED)
+    if not durations.update(durations_path, project, passed):
+        utils.logger.debug('Failed to save make durations to %(path)s', dict(path=durations_path))
+
+
+def _make_target(target, makefile, fqdn_image, environment, user_setup, output_lock):  # pylint: disable=too-many-arguments
+    output = tempfile.TemporaryFile()
+    try:
+        start_time = time.time()
+        proc = runner.start_nested(['make', '-f', makefile, target], fqdn_image, environment, user_setup, stdout=output)
+        returncode = proc.wait()
+        end_time = time.time()
+        status = PASSED if returncode == 0 else FAILED
+        tracing.add_span('make ' + target, start_time, end_time, 'make', status=status)
+        metrics.observe(metrics.RUN_DURATION, end_time - start_time, program='make', container='true', exit_code=str(returncode))
+
+        with output_lock:
+            log = utils.logger.info if status == PASSED else utils.logger.error
+            log('make %(target)s %(status)s in %(seconds).2f seconds:', dict(target=target, status=status, seconds=end_time - start_time))
+            output.seek(0)
+            _write_output(output)
+        return [target, status, returncode, round(end_time - start_time, 2)]
+    finally:
+        output.close()
+
+
+def _unique(targets):
+    unique_targets = []
+    for target in targets:
+        if target not in unique_targets:
+            unique_targets.append(target)
+    return unique_targets
+
+
+def _write_output(output):
+    stream = getattr(sys.stdout, 'buffer', sys.stdout)
+    for chunk in iter(lambda: output.read(64 * 1024), b''):
+        stream.write(chunk)
+    stream.flush()
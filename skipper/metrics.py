@@ -0,0 +1,217 @@
+import logging
+import os
+import re
+import threading
+from skipper import files
+
+
+METRICS_FILE = 'skipper.prom'
+LOCK_FILE = '.skipper.prom.lock'
+DURATION_BUCKETS = (0.1, 0.5, 1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+COMMAND_DURATION = 'skipper_command_duration_seconds'
+RUN_DURATION = 'skipper_run_duration_seconds'
+BUILD_DURATION = 'skipper_build_duration_seconds'
+PUSH_DURATION = 'skipper_push_duration_seconds'
+PUSHED_BYTES = 'skipper_pushed_bytes_total'
+REGISTRY_REQUEST_DURATION = 'skipper_registry_request_duration_seconds'
+
+HISTOGRAMS = {
+    COMMAND_DURATION: ('Duration of skipper commands', DURATION_BUCKETS),
+    RUN_DURATION: ('Duration of the commands run by skipper, in a container or on the host', DURATION_BUCKETS),
+    BUILD_DURATION: ('Duration of image builds', DURATION_BUCKETS),
+    PUSH_DURATION: ('Duration of image pushes', DURATION_BUCKETS),
+    REGISTRY_REQUEST_DURATION: ('Latency of docker registry requests', LATENCY_BUCKETS),
+}
+COUNTERS = {
+    PUSHED_BYTES: 'Bytes pushed to the registry',
+}
+HISTOGRAM_SUFFIXES = ('_bucket', '_sum', '_count')
+SAMPLE_PATTERN = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})?\s+(\S+)$')
+LABEL_PATTERN = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+
+_collector = None   # pylint: disable=invalid-name
+
+
+def configure(directory, command=None):
+    '''
+    Collect metrics of this invocation of the given skipper command and add them to
+    the metrics file in directory, a node_exporter textfile collector directory.
+    None disables metrics.
+    '''
+    global _collector   # pylint: disable=global-statement,invalid-name
+    _collector = Collector(directory, command) if directory else None
+
+
+def is_enabled():
+    return _collector is not None
+
+
+def observe(name, value, **labels):
+    '''
+    Add a value to a histogram, does nothing while metrics are disabled
+    '''
+    if _collector is not None:
+        _collector.observe(name, value, labels)
+
+
+def inc(name, value=1, **labels):
+    '''
+    Increase a counter, does nothing while metrics are disabled
+    '''
+    if _collector is not None:
+        _collector.inc(name, value, labels)
+
+
+def observe_command(seconds, exit_code):
+    # Commands which return nothing exit with 0
+    exit_code = 0 if exit_code is None else exit_code
+    if _collector is not None and _collector.command is not None:
+        _collector.observe(COMMAND_DURATION, seconds, dict(command=_collector.command, exit_code=str(exit_code)))
+
+
+def get_program(command):
+    '''
+    Returns the program label of a command, the name of its executable without its directory
+    and arguments, which a command given as one string includes
+    '''
+    executable = command[0].split()[0] if command and command[0].strip() else ''
+    return os.path.basename(executable)
+
+
+def write():
+    if _collector is not None:
+        _collector.write()
+
+
+class Collector(object):
+    '''
+    Collects samples in memory. Every metric is cumulative, so writing adds the samples
+    to the ones already in the metrics file. The file is updated under an exclusive lock
+    and replaced atomically, so concurrent skipper processes don't lose samples and
+    node_exporter never reads a partial file.
+    '''
+    def __init__(self, directory, command):
+        self.directory = directory
+        self.command = command
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, value, labels):
+        key = _labels_key(labels)
+        for bucket in HISTOGRAMS[name][1]:
+            self._add(name + '_bucket', key + (('le', _format_value(bucket)),), 1 if value <= bucket else 0)
+        self._add(name + '_bucket', key + (('le', '+Inf'),), 1)
+        self._add(name + '_sum', key, value)
+        self._add(name + '_count', key, 1)
+
+    def inc(self, name, value, labels):
+        self._add(name, _labels_key(labels), value)
+
+    def write(self):
+        import fcntl
+        try:
+            files.makedirs(self.directory)
+            with open(os.path.join(self.directory, LOCK_FILE), 'w') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                path = os.path.join(self.directory, METRICS_FILE)
+                samples = _read_samples(path)
+                with self._lock:
+                    for key, value in self._samples.items():
+                        samples[key] = samples.get(key, 0) + value
+                    self._samples = {}
+                files.write_atomically(path, format_samples(samples), mode=0o644)
+        except (IOError, OSError) as exc:
+            logging.getLogger('skipper').warning('Failed to write metrics to %(directory)s: %(error)s',
+                                                 dict(directory=self.directory, error=exc))
+
+    def _add(self, sample_name, key, value):
+        with self._lock:
+            self._samples[(sample_name, key)] = self._samples.get((sample_name, key), 0) + value
+
+
+def format_samples(samples):
+    '''
+    Returns the samples, a dict of (sample name, labels) to value, in the Prometheus text format
+    '''
+    families = {}
+    for (sample_name, labels), value in samples.items():
+        families.setdefault(_get_family(sample_name), []).append((sample_name, labels, value))
+
+    lines = []
+    for family in sorted(families):
+        if family in HISTOGRAMS:
+            lines += ['# HELP %(name)s %(help)s' % dict(name=family, help=HISTOGRAMS[family][0]),
+                      '# TYPE %(name)s histogram' % dict(name=family)]
+        elif family in COUNTERS:
+            lines += ['# HELP %(name)s %(help)s' % dict(name=family, help=COUNTERS[family]),
+                      '# TYPE %(name)s counter' % dict(name=family)]
+        for sample_name, labels, value in sorted(families[family], key=_sample_order):
+            lines.append('%(name)s%(labels)s %(value)s' % dict(name=sample_name, labels=_format_labels(labels), value=_format_value(value)))
+    return '\n'.join(lines) + '\n' if lines else ''
+
+
+def parse_samples(text):
+    '''
+    Returns the samples of a text written by format_samples, as a dict of (sample name, labels) to value
+    '''
+    samples = {}
+    for line in text.splitlines():
+        match = SAMPLE_PATTERN.match(line.strip())
+        if line.startswith('#') or match is None:
+            continue
+        name, labels, value = match.groups()
+        labels = tuple((label, _unescape(label_value)) for label, label_value in LABEL_PATTERN.findall(labels or ''))
+        try:
+            samples[(name, labels)] = float(value)
+        except ValueError:
+            continue
+    return samples
+
+
+def _read_samples(path):
+    try:
+        with open(path) as metrics_file:
+            return parse_samples(metrics_file.read())
+    except (IOError, OSError):
+        return {}
+
+
+def _labels_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _get_family(sample_name):
+    for suffix in HISTOGRAM_SUFFIXES:
+        if sample_name.endswith(suffix) and sample_name[:-len(suffix)] in HISTOGRAMS:
+            return sample_name[:-len(suffix)]
+    return sample_name
+
+
+def _sample_order(sample):
+    # Series by labels, then the buckets of histograms by bound, their sum and their count
+    sample_name, labels, _ = sample
+    series = tuple(label for label in labels if label[0] != 'le')
+    rank = max([index for index, suffix in enumerate(HISTOGRAM_SUFFIXES) if sample_name.endswith(suffix)] or [0])
+    return series, rank, float(dict(labels).get('le', 0))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('%(name)s="%(value)s"' % dict(name=name, value=_escape(value)) for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if float(value) == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _unescape(value):
+    return re.sub(r'\\(.)', lambda match: '\n' if match.group(1) == 'n' else match.group(1), value)
@@ -0,0 +1,102 @@
+import time
+from skipper import docker
+from skipper import metrics
+from skipper import tracing
+from skipper import utils
+
+
+PUSHED = 'pushed'
+SKIPPED = 'up to date'
+FAILED = 'failed'
+
+
+def push_images(registry, targets, jobs, force=False):
+    '''
+    Push images concurrently, at most `jobs` at a time. targets is a list of
+    (image, tag, [remote tags]) tuples; image:tag is pushed under each of the
+    remote tags, each through its own tag, push and untag pipeline. Unless
+    forced, a remote tag whose manifest config is already the local image
+    is not pushed again.
+    Returns the exit code and a list of [image, status, bytes, seconds, MB/s] rows.
+    '''
+    pushes = [(image, tag, remote_tag) for image, tag, remote_tags in targets for remote_tag in remote_tags]
+    if not pushes:
+        return 0, []
+
+    # The output of concurrent pushes is captured per image, so it doesn't interleave
+    capture_output = jobs > 1 and len(pushes) > 1
+    pipelines = [(registry, image, tag, remote_tag, force, capture_output) for image, tag, remote_tag in pushes]
+
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(min(max(jobs, 1), len(pipelines)))
+    try:
+        results = pool.map(_push_image, pipelines)
+    finally:
+        pool.close()
+        pool.join()
+
+    ret = 1 if any(result[1] == FAILED for result in results) else 0
+    return ret, results
+
+
+def _push_image(pipeline):
+    registry, image, tag, remote_tag, force, capture_output = pipeline
+    image_name = image + ':' + tag
+    fqdn_image = utils.generate_fqdn_image(registry, image, remote_tag)
+    backend = docker.get_backend()
+    start_time = time.time()
+
+    if not force and _is_pushed(registry, image, image_name, remote_tag):
+        utils.logger.info("%(image)s is already in the registry, skipping", dict(image=fqdn_image))
+        return _result(image, fqdn_image, SKIPPED, 0, start_time)
+
+    utils.logger.debug("Adding tag %(tag)s", dict(tag=fqdn_image))
+    if backend.tag_image(image_name, fqdn_image) != 0:
+        utils.logger.error('Failed to tag image %(image)s as %(tag)s', dict(image=image_name, tag=fqdn_image))
+        return _result(image, fqdn_image, FAILED, None, start_time)
+
+    utils.logger.info("Pushing %(image)s", dict(image=fqdn_image))
+    push_result = backend.push_image(fqdn_image, capture_output)
+    status = PUSHED if push_result['returncode'] == 0 else FAILED
+    if status == FAILED:
+        utils.logger.error('Failed to push image %(image)s', dict(image=fqdn_image))
+
+    utils.logger.debug("Removing tag %(tag)s", dict(tag=fqdn_image))
+    if backend.remove_image(fqdn_image) != 0:
+        utils.logger.warning('Failed to remove tag %(tag)s', dict(tag=fqdn_image))
+    utils.invalidate_local_images()
+
+    return _result(image, fqdn_image, status, push_result['size'], start_time)
+
+
+def _is_pushed(registry, image, image_name, remote_tag):
+    import requests
+    from skipper import registry_client
+    try:
+        remote_image_id = utils.get_image_config_digest(registry, image, remote_tag)
+    except (registry_client.RegistryError, requests.RequestException) as exc:
+        # Without the remote image id the image is pushed, and docker push reports the actual error if any
+        utils.logger.warning('Failed to get the manifest of %(image)s:%(tag)s from the registry: %(error)s',
+                             dict(image=image, tag=remote_tag, error=exc))
+        return False
+    if remote_image_id is None:
+        return False
+
+    # The repo digests of the image are gone once its registry tag is removed, but its id is the config digest
+    try:
+        return docker.get_backend().inspect_image(image_name)['id'] == remote_image_id
+    except docker.DockerError:
+        return False
+
+
+def _result(image, fqdn_image, status, size, start_time):
+    end_time = time.time()
+    tracing.add_span('push ' + fqdn_image, start_time, end_time, 'push', status=status)
+    seconds = end_time - start_time
+    metrics.observe(metrics.PUSH_DURATION, seconds, image=image, status=status)
+    if size:
+        metrics.inc(metrics.PUSHED_BYTES, size, image=image)
+    throughput = None
+    if size is not None and seconds > 0:
+        throughput = round(size / seconds / 2 ** 20, 2)
+    return [fqdn_image, status, size, round(seconds, 2), throughput]
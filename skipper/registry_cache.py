@@ -0,0 +1,73 @@
+import hashlib
+import json
+import os
+import time
+from skipper import files
+
+
+# Entries are revalidated with the registry on every use by default, so a tag pushed
+# from another host is never hidden by the cache
+DEFAULT_TTL = 0
+
+_configured_cache = None   # pylint: disable=invalid-name
+
+
+def configure(cache):
+    '''
+    Set the metadata cache of the registry clients of the process, None disables caching
+    '''
+    global _configured_cache   # pylint: disable=global-statement,invalid-name
+    _configured_cache = cache
+
+
+def get_configured_cache():
+    return _configured_cache
+
+
+def get_cache_dir():
+    '''
+    Returns the cache directory of skipper, as set by XDG_CACHE_HOME and HOME when it is called
+    '''
+    return os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'skipper')
+
+
+class RegistryCache(object):
+    '''
+    Persistent cache of registry metadata, one JSON file per entry.
+    Entries are replaced atomically, so several skipper processes can share
+    the cache directory; the last writer wins.
+    '''
+    def __init__(self, directory=None, ttl=DEFAULT_TTL):
+        self.directory = directory or get_cache_dir()
+        self.ttl = ttl
+
+    def get(self, key):
+        '''
+        Returns the cached entry as a dict with 'value', 'etag' and 'fresh' keys, or None
+        '''
+        try:
+            with open(self._path(key)) as entry_file:
+                entry = json.load(entry_file)
+        except (IOError, OSError, ValueError):
+            return None
+
+        if entry.get('key') != key:
+            return None
+        entry['fresh'] = time.time() - entry['time'] < self.ttl
+        return entry
+
+    def put(self, key, value, etag=None):
+        entry = dict(key=key, value=value, etag=etag, time=time.time())
+        try:
+            files.write_atomically(self._path(key), json.dumps(entry))
+        except (IOError, OSError):
+            pass
+
+    def invalidate(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha256(key.encode('utf-8')).hexdigest() + '.json')
@@ -0,0 +1,382 @@
+import json
+import re
+import threading
+import time
+import requests
+from requests import adapters
+from requests import compat
+from skipper import metrics
+from skipper import registry_cache
+from skipper import tracing
+
+
+REGISTRY_BASE_URL = 'https://%(registry)s/v2/'
+IMAGE_TAGS_URL = REGISTRY_BASE_URL + '%(image)s/tags/list'
+MANIFEST_URL = REGISTRY_BASE_URL + '%(image)s/manifests/%(reference)s'
+MANIFEST_V2_MEDIA_TYPE = 'application/vnd.docker.distribution.manifest.v2+json'
+MANIFEST_MEDIA_TYPES = [
+    MANIFEST_V2_MEDIA_TYPE,
+    'application/vnd.docker.distribution.manifest.list.v2+json',
+    'application/vnd.oci.image.manifest.v1+json',
+    'application/vnd.oci.image.index.v1+json',
+]
+
+TAGS_PAGE_SIZE = 1000
+LINK_NEXT_PATTERN = re.compile(r'<([^>]+)>\s*;\s*rel="?next"?')
+
+MAX_CONCURRENT_REQUESTS = 8
+NOT_MODIFIED = 304
+NOT_FOUND = 404
+
+_clients = {}   # pylint: disable=invalid-name
+_clients_lock = threading.Lock()   # pylint: disable=invalid-name
+
+
+def get_client(registry):
+    '''
+    Returns the client of the given registry. Clients are shared by the whole
+    process, so every request to a registry reuses its pooled connections.
+    Clients use the metadata cache set by registry_cache.configure.
+    '''
+    cache = registry_cache.get_configured_cache()
+    with _clients_lock:
+        if registry not in _clients or _clients[registry].cache is not cache:
+            _clients[registry] = RegistryClient(registry, cache=cache)
+        return _clients[registry]
+
+
+def _get_next_page_url(response):
+    match = LINK_NEXT_PATTERN.search(response.headers.get('Link', ''))
+    if match is None:
+        return None
+    return compat.urljoin(response.url, match.group(1))
+
+
+def _trace_response(response, *args, **kwargs):  # pylint: disable=unused-argument
+    end_time = time.time()
+    path = compat.urlparse(response.url).path
+    tracing.add_span(response.request.method + ' ' + path, end_time - response.elapsed.total_seconds(), end_time, 'registry',
+                     url=response.url, status=response.status_code)
+
+
+def _limited(func, limiter):
+    def _call(item):
+        limiter.wait()
+        return func(item)
+    return _call
+
+
+class RegistryError(Exception):
+    pass
+
+
+class RegistryClient(object):
+    def __init__(self, registry, max_concurrent_requests=MAX_CONCURRENT_REQUESTS, cache=None):
+        requests.packages.urllib3.disable_warnings()
+        self.registry = registry
+        self.cache = cache
+        self._max_concurrent_requests = max_concurrent_requests
+        self._session = requests.Session()
+        self._session.verify = False
+        adapter = adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrent_requests)
+        self._session.mount('https://', adapter)
+        if tracing.is_enabled():
+            self._session.hooks['response'].append(_trace_response)
+        if metrics.is_enabled():
+            self._session.hooks['response'].append(self._observe_response)
+
+    def _observe_response(self, response, *args, **kwargs):  # pylint: disable=unused-argument
+        metrics.observe(metrics.REGISTRY_REQUEST_DURATION, response.elapsed.total_seconds(), registry=self.registry,
+                        method=response.request.method, status=str(response.status_code))
+
+    def get_tags(self, image):
+        '''
+        Returns the tags of the image, or None if the registry doesn't know the image
+        '''
+        url = self._tags_url(image)
+        entry = self._get_cache_entry(url)
+        if entry is not None and entry['fresh']:
+            return entry['value']
+
+        response = self._session.get(url=url, headers=self._revalidation_headers(entry))
+        if entry is not None and response.status_code == NOT_MODIFIED:
+            self.cache.put(url, entry['value'], entry['etag'])
+            return entry['value']
+
+        tags = []
+        pages = 0
+        for page in self._iter_tags_pages(response):
+            tags += page
+            pages += 1
+        if pages == 0:
+            return None
+
+        # An ETag only describes its own page, so only single page listings can be revalidated
+        self._put_cache_entry(url, tags, response.headers.get('ETag') if pages == 1 else None)
+        return tags
+
+    def iter_tags(self, image):
+        '''
+        Yields the tags of the image as the registry pages arrive, without caching them.
+        Yields nothing if the registry doesn't know the image.
+        '''
+        response = self._session.get(url=self._tags_url(image), headers={})
+        for page in self._iter_tags_pages(response):
+            for tag in page:
+                yield tag
+
+    def _iter_tags_pages(self, response):
+        while True:
+            info = response.json()
+            if not response.ok:
+                if info['errors'][0]['code'] == 'NAME_UNKNOWN':
+                    return
+                raise RegistryError(info)
+
+            yield info.get('tags') or []
+
+            next_url = _get_next_page_url(response)
+            if next_url is None:
+                return
+            response = self._session.get(url=next_url, headers={})
+
+    def _tags_url(self, image):
+        return IMAGE_TAGS_URL % dict(registry=self.registry, image=image) + '?n=%d' % TAGS_PAGE_SIZE
+
+    def get_images_tags(self, images):
+        '''
+        Returns the tags of each of the images, fetched concurrently.
+        The result is ordered as the images.
+        '''
+        return self._map(self.get_tags, list(images))
+
+    def _map(self, func, items, jobs=None, limiter=None):
+        if limiter is not None:
+            func = _limited(func, limiter)
+        jobs = min(len(items), jobs or self._max_concurrent_requests)
+        if jobs <= 1:
+            return [func(item) for item in items]
+
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(jobs)
+        try:
+            return pool.map(func, items)
+        finally:
+            pool.close()
+            pool.join()
+
+    def image_exist(self, image, tag):
+        '''
+        Returns whether the registry has image:tag, asking for the headers of its manifest rather than
+        listing all the tags of the image
+        '''
+        url = MANIFEST_URL % dict(registry=self.registry, image=image, reference=tag)
+        response = self._session.head(url=url, headers={"Accept": ', '.join(MANIFEST_MEDIA_TYPES)})
+        if response.status_code == NOT_FOUND:
+            return False
+        if not response.ok:
+            raise RegistryError('%(registry)s answered %(status)d for %(image)s:%(tag)s'
+                                % dict(registry=self.registry, status=response.status_code, image=image, tag=tag))
+        return True
+
+    def get_image_digest(self, image, tag, use_cache=True):
+        '''
+        Returns the digest of the manifest of image:tag, or None if the registry doesn't have it.
+        Raises RegistryError if the registry fails to answer, e.g. when access is denied.
+        '''
+        url = MANIFEST_URL % dict(registry=self.registry, image=image, reference=tag)
+        entry = self._get_cache_entry(url) if use_cache else None
+        if entry is not None and entry['fresh']:
+            return entry['value']
+
+        headers = {"Accept": MANIFEST_V2_MEDIA_TYPE}
+        headers.update(self._revalidation_headers(entry))
+        response = self._session.get(url=url, headers=headers)
+        if entry is not None and response.status_code == NOT_MODIFIED:
+            self.cache.put(url, entry['value'], entry['etag'])
+            return entry['value']
+
+        if response.status_code == NOT_FOUND:
+            return None
+        if not response.ok:
+            raise RegistryError(response.content)
+        digest = response.headers.get('Docker-Content-Digest')
+        if digest is None:
+            raise RegistryError('%(registry)s returned no digest for %(image)s:%(tag)s' % dict(registry=self.registry, image=image, tag=tag))
+        self._put_cache_entry(url, digest, response.headers.get('ETag'))
+        return digest
+
+    def get_manifest(self, image, reference):
+        '''
+        Returns the raw manifest of image:reference and its media type, or None if the registry doesn't have it.
+        The manifest bytes are kept as is, so putting them under another tag keeps the same digest.
+        '''
+        url = MANIFEST_URL % dict(registry=self.registry, image=image, reference=reference)
+        response = self._session.get(url=url, headers={"Accept": ', '.join(MANIFEST_MEDIA_TYPES)})
+        if response.status_code == NOT_FOUND:
+            return None
+        if not response.ok:
+            raise RegistryError(response.content)
+        return response.content, response.headers.get('Content-Type', MANIFEST_V2_MEDIA_TYPE)
+
+    def get_image_config_digest(self, image, tag):
+        '''
+        Returns the digest of the config of image:tag, which docker uses as the image id, or None if the
+        registry doesn't have it or it is a manifest list, which has no config of its own.
+        '''
+        manifest = self.get_manifest(image, tag)
+        if manifest is None:
+            return None
+        try:
+            config = json.loads(manifest[0].decode('utf-8')).get('config') or {}
+        except ValueError:
+            raise RegistryError('%(registry)s returned an invalid manifest for %(image)s:%(tag)s'
+                                % dict(registry=self.registry, image=image, tag=tag))
+        return config.get('digest')
+
+    def put_manifest(self, image, reference, manifest, media_type):
+        url = MANIFEST_URL % dict(registry=self.registry, image=image, reference=reference)
+        response = self._session.put(url=url, data=manifest, headers={"Content-Type": media_type})
+        if not response.ok:
+            raise RegistryError(response.content)
+
+        if self.cache is not None:
+            self.cache.invalidate(self._tags_url(image))
+            self.cache.invalidate(url)
+
+    def promote_images(self, images, src_tag, dst_tags):
+        '''
+        Tags image:src_tag of each of the images with each of dst_tags by copying its manifest,
+        without pulling or pushing any layer. Manifests are fetched and put concurrently.
+        Returns an [image, tag, error] row per image and destination tag, error is None on success.
+        '''
+        images = list(images)
+        manifests = self._map(lambda image: self._get_promoted_manifest(image, src_tag), images)
+        return self._map(self._promote_image, [(image, dst_tag, manifest) for image, manifest in zip(images, manifests)
+                                               for dst_tag in dst_tags])
+
+    def _get_promoted_manifest(self, image, tag):
+        try:
+            manifest = self.get_manifest(image, tag)
+        except (RegistryError, requests.RequestException) as exc:
+            return None, str(exc)
+        if manifest is None:
+            return None, '%(image)s:%(tag)s was not found' % dict(image=image, tag=tag)
+        return manifest, None
+
+    def _promote_image(self, promotion):
+        image, tag, (manifest, error) = promotion
+        if error is None:
+            try:
+                self.put_manifest(image, tag, *manifest)
+            except (RegistryError, requests.RequestException) as exc:
+                error = str(exc)
+        return [image, tag, error]
+
+    def delete_images(self, references, keep_shared=False):
+        '''
+        Deletes image:tag of each of the (image, tag) references. Deleting a manifest deletes every tag
+        pointing to it, so the digest of each distinct reference is looked up once, concurrently, then
+        every manifest is deleted once, concurrently. With keep_shared, the tags of the images are listed
+        and a manifest which other tags point to isn't deleted.
+        Returns an [image, tag, error] row per reference, error is None on success.
+        '''
+        references = list(references)
+        unique_references = sorted(set(references))
+        digests = dict(zip(unique_references, self.get_digests(unique_references)))
+
+        manifests = {}
+        for (image, tag), (digest, error) in sorted(digests.items()):
+            if error is None:
+                manifests.setdefault((image, digest), []).append(tag)
+
+        errors = self._get_shared_manifests(manifests) if keep_shared else {}
+        deletions = [(image, digest, tags) for (image, digest), tags in sorted(manifests.items()) if (image, digest) not in errors]
+        errors.update(zip([(image, digest) for image, digest, _ in deletions], self.delete_manifests(deletions)))
+
+        rows = []
+        for image, tag in references:
+            digest, error = digests[(image, tag)]
+            rows.append([image, tag, error if error is not None else errors[(image, digest)]])
+        return rows
+
+    def _get_shared_manifests(self, manifests):
+        '''
+        Returns a dict of the (image, digest) of the manifests which other tags point to, or may point to
+        when their digest can't be looked up, to an error naming the first such tag
+        '''
+        deleted = set((image, tag) for (image, _), tags in manifests.items() for tag in tags)
+        images = sorted(set(image for image, _ in manifests))
+        others = [(image, tag) for image, tags in zip(images, self.get_images_tags(images)) for tag in tags or []
+                  if (image, tag) not in deleted]
+        shared = {}
+        for (image, tag), (digest, error) in zip(others, self.get_digests(others)):
+            if error is not None:
+                for key in manifests:
+                    if key[0] == image:
+                        shared.setdefault(key, 'unknown manifest of %(tag)s' % dict(tag=tag))
+            elif (image, digest) in manifests:
+                shared.setdefault((image, digest), 'same manifest as %(tag)s' % dict(tag=tag))
+        return shared
+
+    def get_digests(self, references, jobs=None, limiter=None):
+        '''
+        Returns the digest and error of image:tag of each of the (image, tag) references, looked up
+        concurrently without the cache. The error is None when the digest is found.
+        '''
+        return self._map(self._get_digest, list(references), jobs, limiter)
+
+    def _get_digest(self, reference):
+        image, tag = reference
+        try:
+            digest = self.get_image_digest(image, tag, use_cache=False)
+        except (RegistryError, requests.RequestException) as exc:
+            return None, str(exc)
+        if digest is None:
+            return None, '%(image)s:%(tag)s was not found' % dict(image=image, tag=tag)
+        return digest, None
+
+    def delete_manifests(self, deletions, jobs=None, limiter=None):
+        '''
+        Deletes the manifest of each of the (image, digest, tags) deletions concurrently.
+        Returns the error of each deletion, None on success.
+        '''
+        return self._map(self._delete_manifest, list(deletions), jobs, limiter)
+
+    def _delete_manifest(self, deletion):
+        try:
+            self.delete_manifest(*deletion)
+        except (RegistryError, requests.RequestException) as exc:
+            return str(exc)
+        return None
+
+    def delete_manifest(self, image, digest, tags=()):
+        '''
+        Delete the manifest with the given digest, which deletes every tag pointing to it.
+        tags are the known tags of the manifest, whose cached digests are invalidated.
+        '''
+        url = MANIFEST_URL % dict(registry=self.registry, image=image, reference=digest)
+        response = self._session.delete(url=url)
+        if not response.ok:
+            raise RegistryError(response.content)
+
+        if self.cache is not None:
+            self.cache.invalidate(self._tags_url(image))
+            for tag in tags:
+                self.cache.invalidate(MANIFEST_URL % dict(registry=self.registry, image=image, reference=tag))
+
+    def _get_cache_entry(self, url):
+        if self.cache is None:
+            return None
+        return self.cache.get(url)
+
+    def _put_cache_entry(self, url, value, etag):
+        # An entry without an ETag can't be revalidated, so it is only of use while it is fresh
+        if self.cache is not None and (etag is not None or self.cache.ttl):
+            self.cache.put(url, value, etag)
+
+    @staticmethod
+    def _revalidation_headers(entry):
+        if entry is None or not entry.get('etag'):
+            return {}
+        return {'If-None-Match': entry['etag']}
@@ -0,0 +1,175 @@
+import fnmatch
+import re
+import threading
+import time
+from skipper import docker
+from skipper import git
+from skipper import utils
+
+
+COMMIT_TAG_PATTERN = re.compile(r'^([0-9a-f]{40})(?:-dirty)?$')
+LOCAL = 'local'
+REMOTE = 'registry'
+WOULD_DELETE = 'would delete'
+DELETED = 'deleted'
+FAILED = 'failed'
+KEPT = 'kept'
+
+
+class RetentionPolicy(object):
+    '''
+    Decides which tags of an image to keep: the tags of the last `keep_last` commits,
+    the tags of commits reachable from the given branches and the tags matching one of
+    the given fnmatch patterns. Commit tags are commit ids, optionally marked dirty, ordered
+    by commit time, with the tags of unknown commits last. Tags which aren't commit ids,
+    like latest or release tags, are always kept unless one of `delete_patterns` matches them.
+    '''
+    def __init__(self, keep_last, branches=(), patterns=(), delete_patterns=()):
+        self.keep_last = keep_last
+        self.branches = list(branches)
+        self.patterns = list(patterns)
+        self.delete_patterns = list(delete_patterns)
+        self._commit_times = None
+        self._branch_commits = None
+
+    def get_kept_tags(self, tags):
+        '''
+        Returns a dict of the tags to keep to the reason for keeping them
+        '''
+        kept = {}
+        for tag in tags:
+            reason = self._get_keep_reason(tag)
+            if reason is not None:
+                kept[tag] = reason
+        commit_tags = [tag for tag in tags if COMMIT_TAG_PATTERN.match(tag)]
+        for tag in self.order(commit_tags)[:self.keep_last]:
+            kept.setdefault(tag, 'last %(count)d' % dict(count=self.keep_last))
+        return kept
+
+    def order(self, tags):
+        '''
+        Returns the tags from the newest to the oldest
+        '''
+        commit_times = self._get_commit_times()
+
+        def _key(tag):
+            match = COMMIT_TAG_PATTERN.match(tag)
+            commit_time = commit_times.get(match.group(1), 0) if match else -1
+            return -commit_time, tag
+        return sorted(tags, key=_key)
+
+    def _get_keep_reason(self, tag):
+        for pattern in self.patterns:
+            if fnmatch.fnmatchcase(tag, pattern):
+                return 'matches %(pattern)s' % dict(pattern=pattern)
+
+        match = COMMIT_TAG_PATTERN.match(tag)
+        if match is None:
+            if any(fnmatch.fnmatchcase(tag, pattern) for pattern in self.delete_patterns):
+                return None
+            return 'not a commit'
+        for branch, commits in self._get_branch_commits():
+            if match.group(1) in commits:
+                return 'on %(branch)s' % dict(branch=branch)
+        return None
+
+    def _get_commit_times(self):
+        if self._commit_times is None:
+            self._commit_times = git.get_commit_times() if self.keep_last else {}
+        return self._commit_times
+
+    def _get_branch_commits(self):
+        if self._branch_commits is None:
+            self._branch_commits = [(branch, git.get_reachable_commits(branch)) for branch in self.branches]
+        return self._branch_commits
+
+
+class RateLimiter(object):
+    '''
+    Spaces the returns of wait() by 1/rate seconds, across threads. A rate of 0 doesn't limit.
+    '''
+    def __init__(self, rate):
+        self._interval = 1.0 / rate if rate else 0
+        self._next_time = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self._interval:
+            return
+        with self._lock:
+            now = time.time()
+            start_time = max(now, self._next_time)
+            self._next_time = start_time + self._interval
+        if start_time > now:
+            time.sleep(start_time - now)
+
+
+def collect_local_images(images, policy, dry_run=False):
+    '''
+    Delete the local tags of the images which the policy doesn't keep.
+    Returns a list of [image, tag, location, status, details] rows of the tags that aren't kept.
+    '''
+    local_images = utils.get_local_images()
+    rows = []
+    for image in images:
+        tags = local_images.get(image, [])
+        kept = policy.get_kept_tags(tags)
+        _log_summary(LOCAL, image, tags, kept)
+        for tag in sorted(set(tags) - set(kept)):
+            if dry_run:
+                rows.append([image, tag, LOCAL, WOULD_DELETE, None])
+            elif docker.get_backend().remove_image(image + ':' + tag) == 0:
+                rows.append([image, tag, LOCAL, DELETED, None])
+            else:
+                rows.append([image, tag, LOCAL, FAILED, None])
+    utils.invalidate_local_images()
+    return rows
+
+
+def collect_remote_images(registry, images, policy, jobs, rate=0, dry_run=False):  # pylint: disable=too-many-arguments,too-many-locals
+    '''
+    Delete the tags of the images in the registry which the policy doesn't keep.
+    The registry deletes manifests, with every tag pointing to them, so a tag is only
+    deleted when no kept tag has the same manifest, and none is deleted while the manifest
+    of a kept tag can't be resolved. Digests are resolved and manifests deleted concurrently,
+    `jobs` requests at a time and at most `rate` requests per second.
+    Returns a list of [image, tag, location, status, details] rows of the tags that aren't kept.
+    '''
+    limiter = RateLimiter(rate)
+    images_tags = [(image, tags or []) for image, tags in zip(images, utils.get_images_tags(registry, images))]
+    references = [(image, tag) for image, tags in images_tags for tag in tags]
+    digests = dict(zip(references, utils.get_digests_from_registry(registry, references, jobs, limiter)))
+
+    rows = []
+    manifests = {}
+    for image, tags in images_tags:
+        kept = policy.get_kept_tags(tags)
+        _log_summary(REMOTE, image, tags, kept)
+        kept_digests = dict((digests[(image, tag)][0], tag) for tag in kept if digests[(image, tag)][0] is not None)
+        unknown_kept = sorted(tag for tag in kept if digests[(image, tag)][1] is not None)
+        for tag in sorted(set(tags) - set(kept)):
+            digest, error = digests[(image, tag)]
+            if error is not None:
+                rows.append([image, tag, REMOTE, FAILED, error])
+            elif unknown_kept:
+                # The tag may share the manifest of a kept tag
+                rows.append([image, tag, REMOTE, FAILED, 'unknown manifest of %(tag)s' % dict(tag=unknown_kept[0])])
+            elif digest in kept_digests:
+                rows.append([image, tag, REMOTE, KEPT, 'same manifest as %(tag)s' % dict(tag=kept_digests[digest])])
+            else:
+                manifests.setdefault((image, digest), []).append(tag)
+
+    deletions = [(image, digest, manifests[(image, digest)]) for image, digest in sorted(manifests)]
+    if dry_run:
+        errors = [None] * len(deletions)
+    else:
+        errors = utils.delete_manifests_from_registry(registry, deletions, jobs, limiter)
+    for (image, _, tags), error in zip(deletions, errors):
+        status = WOULD_DELETE if dry_run else (DELETED if error is None else FAILED)
+        rows += [[image, tag, REMOTE, status, error] for tag in tags]
+    return sorted(rows)
+
+
+def _log_summary(location, image, tags, kept):
+    utils.logger.info('%(image)s (%(location)s): keeping %(kept)d of %(total)d tags',
+                      dict(image=image, location=location, kept=len(kept), total=len(tags)))
@@ -1,62 +1,448 @@
+import contextlib
+import fcntl
 import grp
 import getpass
+import hashlib
+import json
 import logging
 import os
 import subprocess
+import threading
+import time
+from skipper import cache_volumes
+from skipper import metrics
+from skipper import registry_cache
+from skipper import tracing
 
 
-def run(command, fqdn_image=None, environment=None, interactive=False):
+ENTRYPOINT_PATH = '/opt/skipper/skipper-entrypoint.sh'
+SESSION_SCRIPT_PATH = '/opt/skipper/skipper-session.sh'
+SESSION_NAME_PREFIX = 'skipper-session-'
+SESSION_LABEL = 'skipper.session'
+DEFAULT_SESSION_IDLE_TIMEOUT = 1800
+KILL_GRACE_PERIOD = 10
+USER_IMAGE_REPOSITORY = 'skipper-user'
+USER_IMAGE_LABEL = 'skipper.user-image'
+USER_IMAGE_DOCKERFILE = """FROM %(image)s
+RUN getent passwd %(user)s > /dev/null || useradd -u %(user_id)s --non-unique -M %(user)s; \\
+    groupadd -g %(docker_gid)s --non-unique docker; \\
+    usermod -G root,docker %(user)s
+LABEL %(label)s=%(image)s
+"""
+# New cache volumes take the owner of their directory in the image, as the entrypoint doesn't run
+USER_IMAGE_CACHES_DOCKERFILE = """RUN %(mkdir)s
+RUN %(chown)s
+"""
+
+
+def run(command, fqdn_image=None, environment=None, interactive=False, session_idle_timeout=None,  # pylint: disable=too-many-arguments
+        user_image=False, workdir=None):
+    '''
+    Run the command, in a build container of fqdn_image if given. Nested commands start in workdir,
+    the current directory by default, which has to be in the project.
+    '''
+    start_time = time.time()
+    returncode = _run_command(command, fqdn_image, environment, interactive, session_idle_timeout, user_image, workdir)
+    metrics.observe(metrics.RUN_DURATION, time.time() - start_time, program=metrics.get_program(command),
+                    container=str(fqdn_image is not None).lower(), exit_code=str(returncode))
+    return returncode
+
+
+def _run_command(command, fqdn_image, environment, interactive, session_idle_timeout, user_image, workdir):  # pylint: disable=too-many-arguments
     if fqdn_image is not None:
-        return _run_nested(fqdn_image, environment, command, interactive)
+        if session_idle_timeout is not None:
+            return _run_in_session(fqdn_image, environment, command, interactive, session_idle_timeout, workdir)
+        nested_image, user_setup = get_nested_image(fqdn_image, user_image)
+        return _run_nested(nested_image, environment, command, interactive, user_setup, workdir)
     else:
         return _run(command)
 
 
-def _run(cmd):
+def get_nested_image(fqdn_image, user_image=False):
+    '''
+    Returns the image to run nested commands in, the cached user image of fqdn_image
+    when user_image is set and it can be built, and whether the containers of that
+    image have to set up the user.
+    '''
+    if user_image:
+        derived_image = _get_user_image(fqdn_image)
+        if derived_image is not None:
+            return derived_image, False
+    return fqdn_image, True
+
+
+def start_nested(command, fqdn_image, environment=None, user_setup=True, workdir=None, **kwargs):  # pylint: disable=too-many-arguments
+    '''
+    Starts the command in a new container of fqdn_image without a terminal, so its output
+    can be captured. kwargs are passed to Process. Returns the Process of docker run.
+    '''
+    return Process(_get_nested_command(fqdn_image, environment, command, False, user_setup, tty=False, workdir=workdir), **kwargs)
+
+
+def start(cmd, stdin=None, stdout=None):
     logger = logging.getLogger('skipper')
     logger.debug(' '.join(cmd))
-    proc = subprocess.Popen(cmd)
-    proc.wait()
-    return proc.returncode
+    kwargs = {}
+    if stdin is not None:
+        kwargs['stdin'] = stdin
+    if stdout is not None:
+        kwargs.update(stdout=stdout, stderr=subprocess.STDOUT)
+    return subprocess.Popen(cmd, **kwargs)
 
 
-def _run_nested(fqdn_image, environment, command, interactive):
-    cwd = os.getcwd()
-    workspace = os.path.dirname(cwd)
-    project = os.path.basename(cwd)
+class Process(object):
+    '''
+    A child process which doesn't block its caller, so one thread can start, monitor,
+    time and cancel any number of them.
+    With on_output, the output and errors of the child are read by a thread and passed
+    to on_output line by line, every line whole and as bytes; otherwise they go to stdout,
+    the terminal by default. on_exit is called with the process once it exited and its
+    output was read. After timeout seconds the process is cancelled.
+    Without any of them no thread is started, so waiting costs as much as Popen.wait().
+    '''
+    def __init__(self, cmd, stdin=None, stdout=None, on_output=None, on_exit=None, timeout=None):  # pylint: disable=too-many-arguments
+        self.cmd = cmd
+        self.timed_out = False
+        self.cancelled = False
+        self.start_time = time.time()
+        self.end_time = None
+        self._threads = _ProcessThreads(on_output, on_exit)
+        self._proc = start(cmd, stdin=stdin, stdout=subprocess.PIPE if on_output is not None else stdout)
+        if timeout is not None:
+            self._threads.start_timer(timeout, self._expire)
+        if on_output is not None or on_exit is not None:
+            self._threads.start_monitor(self._wait_in_background)
+
+    @property
+    def pid(self):
+        return self._proc.pid
+
+    @property
+    def stdin(self):
+        return self._proc.stdin
+
+    @property
+    def returncode(self):
+        '''
+        The exit code of the process, None while it runs
+        '''
+        return self._proc.returncode if self._threads.done.is_set() else None
+
+    @property
+    def duration(self):
+        return (self.end_time or time.time()) - self.start_time
+
+    def poll(self):
+        if self._threads.monitor is None and self._proc.poll() is not None:
+            self._finish()
+        return self.returncode
+
+    def wait(self, timeout=None):
+        '''
+        Returns the exit code of the process, or None if it still runs after timeout seconds
+        '''
+        if self._threads.monitor is None and timeout is None:
+            self._proc.wait()
+            self._finish()
+        else:
+            with self._threads.lock:
+                if self._threads.monitor is None:
+                    self._threads.start_monitor(self._wait_in_background)
+            self._threads.done.wait(timeout)
+        return self.returncode
+
+    def cancel(self):
+        '''
+        Terminate the process, and kill it if it still runs KILL_GRACE_PERIOD seconds later
+        '''
+        self.cancelled = True
+        if self._proc.poll() is None:
+            _signal(self._proc.terminate)
+            _start_timer(KILL_GRACE_PERIOD, lambda: self._proc.poll() is None and _signal(self._proc.kill))
+
+    def _expire(self):
+        self.timed_out = True
+        logging.getLogger('skipper').error('%(command)s timed out', dict(command=' '.join(self.cmd)))
+        self.cancel()
+
+    def _wait_in_background(self):
+        if self._threads.on_output is not None:
+            for line in iter(self._proc.stdout.readline, b''):
+                self._threads.on_output(line if line.endswith(b'\n') else line + b'\n')
+            self._proc.stdout.close()
+        self._proc.wait()
+        self._finish()
+
+    def _finish(self):
+        with self._threads.lock:
+            if self._threads.done.is_set():
+                return
+            self.end_time = time.time()
+            if self._threads.timer is not None:
+                self._threads.timer.cancel()
+            self._threads.done.set()
+        if self._threads.on_exit is not None:
+            self._threads.on_exit(self)
 
+
+class _ProcessThreads(object):
+    '''
+    The threads of a Process, the callbacks they call, and the event set once the process
+    exited and its output was read. The lock guards starting the monitor and finishing.
+    '''
+    def __init__(self, on_output, on_exit):
+        self.on_output = on_output
+        self.on_exit = on_exit
+        self.done = threading.Event()
+        self.lock = threading.Lock()
+        self.monitor = None
+        self.timer = None
+
+    def start_monitor(self, target):
+        self.monitor = threading.Thread(target=target)
+        self.monitor.daemon = True
+        self.monitor.start()
+
+    def start_timer(self, seconds, func):
+        self.timer = _start_timer(seconds, func)
+
+
+def _start_timer(seconds, func):
+    timer = threading.Timer(seconds, func)
+    timer.daemon = True
+    timer.start()
+    return timer
+
+
+def _signal(send_signal):
+    try:
+        send_signal()
+    except OSError:
+        # The process already exited
+        pass
+    return True
+
+
+def _run(cmd):
+    with tracing.span(' '.join(cmd[:2]), 'subprocess', command=' '.join(cmd)):
+        return Process(cmd).wait()
+
+
+def _run_nested(fqdn_image, environment, command, interactive, user_setup=True, workdir=None):  # pylint: disable=too-many-arguments
+    return _run(_get_nested_command(fqdn_image, environment, command, interactive, user_setup, workdir=workdir))
+
+
+def _get_nested_command(fqdn_image, environment, command, interactive,  # pylint: disable=too-many-arguments
+                        user_setup=True, tty=True, workdir=None):
     docker_cmd = ['docker', 'run']
     if interactive:
         docker_cmd += ['-i']
 
+    if tty:
+        docker_cmd += ['-t']
+    docker_cmd += ['--rm']
+    docker_cmd += _get_nested_params(environment, user_setup, workdir)
+    if user_setup:
+        docker_cmd += ['--entrypoint', ENTRYPOINT_PATH]
+        docker_cmd += [fqdn_image]
+    else:
+        # The user keeps its own primary group, so the files it creates aren't owned by the docker group
+        docker_cmd += ['--user', '%(user_id)s:%(group_id)s' % dict(user_id=os.getuid(), group_id=os.getgid())]
+        docker_cmd += ['--group-add', str(grp.getgrnam('docker').gr_gid)]
+        docker_cmd += ['--entrypoint', '/bin/sh']
+        docker_cmd += [fqdn_image, '-c']
+    docker_cmd += [' '.join(command)]
+    return docker_cmd
+
+
+def _get_user_image(fqdn_image):
+    """
+    Returns an image derived from fqdn_image in which the current user is already
+    set up, building it if needed, or None if it couldn't be built.
+    Derived images are kept locally and keyed by the base image id, user, docker group and cache paths.
+    """
+    logger = logging.getLogger('skipper')
+    image_id = _inspect(['docker', 'image', 'inspect', '--format', '{{.Id}}', fqdn_image])
+    if image_id is None:
+        _run(['docker', 'pull', fqdn_image])
+        image_id = _inspect(['docker', 'image', 'inspect', '--format', '{{.Id}}', fqdn_image])
+        if image_id is None:
+            return None
+
+    params = dict(image=fqdn_image, user=getpass.getuser(), user_id=os.getuid(), docker_gid=grp.getgrnam('docker').gr_gid,
+                  label=USER_IMAGE_LABEL)
+    cache_paths = cache_volumes.get_paths()
+    key = json.dumps([image_id, params['user'], params['user_id'], params['docker_gid'], cache_paths])
+    user_image = USER_IMAGE_REPOSITORY + ':' + hashlib.sha1(key.encode('utf-8')).hexdigest()[:20]
+    if _inspect(['docker', 'image', 'inspect', '--format', '{{.Id}}', user_image]) is not None:
+        return user_image
+
+    logger.info('Building user image %(user_image)s from %(image)s', dict(user_image=user_image, image=fqdn_image))
+    docker_cmd = ['docker', 'build', '-q', '-t', user_image, '-']
+    logger.debug(' '.join(docker_cmd))
+    with open(os.devnull, 'w') as devnull, tracing.span('docker build', 'subprocess', command=' '.join(docker_cmd)):
+        proc = subprocess.Popen(docker_cmd, stdin=subprocess.PIPE, stdout=devnull)
+        proc.communicate(_get_user_image_dockerfile(params, cache_paths).encode('utf-8'))
+    if proc.returncode != 0:
+        logger.warning('Failed to build user image of %(image)s, setting up the user in the container', dict(image=fqdn_image))
+        return None
+    return user_image
+
+
+def _get_user_image_dockerfile(params, cache_paths):
+    dockerfile = USER_IMAGE_DOCKERFILE % params
+    if cache_paths:
+        dockerfile += USER_IMAGE_CACHES_DOCKERFILE % dict(mkdir=json.dumps(['mkdir', '-p'] + cache_paths),
+                                                          chown=json.dumps(['chown', str(params['user_id'])] + cache_paths))
+    return dockerfile
+
+
+def _run_in_session(fqdn_image, environment, command, interactive, idle_timeout, workdir=None):  # pylint: disable=too-many-arguments
+    """
+    Run the command with docker exec in a long-lived build container, which is
+    started on first use and exits after idle_timeout seconds without commands.
+    The container is recreated when the build container image changes.
+    """
+    name = _get_session_name(fqdn_image, environment)
+    ret = _ensure_session(name, fqdn_image, environment, idle_timeout)
+    if ret != 0:
+        return ret
+
+    docker_cmd = ['docker', 'exec']
+    if interactive:
+        docker_cmd += ['-i']
+
     docker_cmd += ['-t']
+    docker_cmd += ['-w', workdir or os.getcwd()]
+    docker_cmd += [name, SESSION_SCRIPT_PATH, 'exec', ' '.join(command)]
+
+    ret = _run(docker_cmd)
+    if ret != 0 and not _is_session_running(name):
+        # The session reached its idle timeout between the check and docker exec, so the command didn't run
+        logging.getLogger('skipper').info('Build container session %(name)s exited, restarting it', dict(name=name))
+        ret = _ensure_session(name, fqdn_image, environment, idle_timeout)
+        if ret != 0:
+            return ret
+        ret = _run(docker_cmd)
+    return ret
+
+
+def _ensure_session(name, fqdn_image, environment, idle_timeout):
+    """
+    Start the session, or replace it if its image changed. Concurrent skipper
+    invocations take a lock named after the session, so only one of them starts it.
+    """
+    with _session_lock(name):
+        if _is_session_up_to_date(name, fqdn_image):
+            return 0
+        with open(os.devnull, 'w') as devnull, tracing.span('docker rm', 'subprocess', command='docker rm -f ' + name):
+            subprocess.call(['docker', 'rm', '-f', name], stdout=devnull, stderr=devnull)
+        return _start_session(name, fqdn_image, environment, idle_timeout)
+
+
+@contextlib.contextmanager
+def _session_lock(name):
+    lock_dir = os.path.join(registry_cache.get_cache_dir(), 'sessions')
+    if not os.path.isdir(lock_dir):
+        try:
+            os.makedirs(lock_dir)
+        except OSError:
+            # Created by a concurrent invocation
+            pass
+    with open(os.path.join(lock_dir, name + '.lock'), 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _start_session(name, fqdn_image, environment, idle_timeout):
+    logger = logging.getLogger('skipper')
+    logger.info('Starting build container session %(name)s', dict(name=name))
+    docker_cmd = ['docker', 'run']
+    docker_cmd += ['-d']
     docker_cmd += ['--rm']
-    docker_cmd += ['--net', 'host']
+    docker_cmd += ['--name', name]
+    docker_cmd += ['--label', '%(label)s=%(image)s' % dict(label=SESSION_LABEL, image=fqdn_image)]
+    docker_cmd += _get_nested_params(environment)
+    docker_cmd += ['-v', '%(path)s:%(path)s:Z' % dict(path=SESSION_SCRIPT_PATH)]
+    docker_cmd += ['--entrypoint', SESSION_SCRIPT_PATH]
+    docker_cmd += [fqdn_image]
+    docker_cmd += ['start', str(idle_timeout)]
+
+    logger.debug(' '.join(docker_cmd))
+    with open(os.devnull, 'w') as devnull, tracing.span('docker run', 'subprocess', command=' '.join(docker_cmd)):
+        return subprocess.call(docker_cmd, stdout=devnull)
 
-    environment = environment or []
-    for env in environment:
-        docker_cmd += ['-e', env]
 
-    user = getpass.getuser()
-    user_id = os.getuid()
-    docker_cmd += ['-e', 'SKIPPER_USERNAME=%(user)s' % dict(user=user)]
-    docker_cmd += ['-e', 'SKIPPER_UID=%(user_id)s' % dict(user_id=user_id)]
+def _is_session_running(name):
+    return _inspect(['docker', 'container', 'inspect', '--format', '{{.State.Running}}', name]) == 'true'
 
-    docker_gid = grp.getgrnam('docker').gr_gid
-    docker_cmd += ['-e', 'SKIPPER_DOCKER_GID=%(docker_gid)s' % dict(docker_gid=docker_gid)]
+
+def _is_session_up_to_date(name, fqdn_image):
+    session = _inspect(['docker', 'container', 'inspect', '--format', '{{.State.Running}} {{.Image}}', name])
+    if session is None:
+        return False
+
+    running, image_id = session.split()
+    if running != 'true':
+        return False
+    current_image_id = _inspect(['docker', 'image', 'inspect', '--format', '{{.Id}}', fqdn_image])
+    return current_image_id is None or current_image_id == image_id
+
+
+def _get_session_name(fqdn_image, environment):
+    # The tag is left out, so a new build container tag replaces the session instead of adding one.
+    # Mounts can't be added to a running container, so changed caches start a new session.
+    repository = fqdn_image.rsplit(':', 1)[0] if ':' in fqdn_image.rsplit('/', 1)[-1] else fqdn_image
+    key = json.dumps([os.getcwd(), repository, environment or [], cache_volumes.get_mount_params()])
+    return SESSION_NAME_PREFIX + hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]
+
+
+def _inspect(cmd):
+    try:
+        with open(os.devnull, 'w') as devnull, tracing.span(' '.join(cmd[:3]), 'subprocess', command=' '.join(cmd)):
+            output = subprocess.check_output(cmd, stderr=devnull)
+    except subprocess.CalledProcessError:
+        return None
+    return output.decode('utf-8').strip()
+
+
+def _get_nested_params(environment, user_setup=True, workdir=None):
+    cwd = os.getcwd()
+    workspace = os.path.dirname(cwd)
+    project = os.path.basename(cwd)
+
+    params = ['--net', 'host']
+
+    environment = environment or []
+    for env in environment:
+        params += ['-e', env]
 
     volumes = [
         '%(workspace)s:%(workspace)s:rw,Z' % dict(workspace=workspace),
-        '/var/lib/osmosis:/var/lib/osmosis:rw,Z' % dict(workspace=workspace),
+        '/var/lib/osmosis:/var/lib/osmosis:rw,Z',
         '/var/run/docker.sock:/var/run/docker.sock:Z',
-        '/opt/skipper/skipper-entrypoint.sh:/opt/skipper/skipper-entrypoint.sh:Z',
     ]
-    for volume in volumes:
-        docker_cmd += ['-v', volume]
+    if user_setup:
+        user = getpass.getuser()
+        user_id = os.getuid()
+        params += ['-e', 'SKIPPER_USERNAME=%(user)s' % dict(user=user)]
+        params += ['-e', 'SKIPPER_UID=%(user_id)s' % dict(user_id=user_id)]
 
-    docker_cmd += ['-w', '%(workdir)s' % dict(workdir=os.path.join(workspace, project))]
-    docker_cmd += ['--entrypoint', '/opt/skipper/skipper-entrypoint.sh']
-    docker_cmd += [fqdn_image]
-    docker_cmd += [' '.join(command)]
+        docker_gid = grp.getgrnam('docker').gr_gid
+        params += ['-e', 'SKIPPER_DOCKER_GID=%(docker_gid)s' % dict(docker_gid=docker_gid)]
+        volumes += ['%(path)s:%(path)s:Z' % dict(path=ENTRYPOINT_PATH)]
+
+        # New cache volumes belong to root, the entrypoint hands them to the user
+        cache_paths = cache_volumes.get_paths()
+        if cache_paths:
+            params += ['-e', '%(name)s=%(paths)s' % dict(name=cache_volumes.PATHS_VARIABLE, paths=':'.join(cache_paths))]
+
+    for volume in volumes:
+        params += ['-v', volume]
+    params += cache_volumes.get_mount_params()
 
-    return _run(docker_cmd)
+    params += ['-w', '%(workdir)s' % dict(workdir=workdir or os.path.join(workspace, project))]
+    return params
@@ -0,0 +1,126 @@
+import glob
+import heapq
+import os
+import sys
+import threading
+from skipper import durations
+from skipper import metrics
+from skipper import runner
+from skipper import tracing
+from skipper import utils
+
+
+SHARD_INDEX_VARIABLE = 'SKIPPER_SHARD_INDEX'
+SHARD_COUNT_VARIABLE = 'SKIPPER_SHARD_COUNT'
+
+
+def run_shards(command, fqdn_image, environment, shards,  # pylint: disable=too-many-arguments,too-many-locals
+               user_image=False, file_patterns=(), durations_path=None, workdir=None):
+    '''
+    Run the command in `shards` build containers at once, telling every container its shard
+    with the SKIPPER_SHARD_INDEX and SKIPPER_SHARD_COUNT environment variables. The output of
+    every shard is printed line by line, prefixed by the shard index.
+    With file patterns, the matching files are split between the shards, balanced by their
+    recorded durations or by their sizes, and added to the command of their shard; shards
+    without files aren't started. The command runs in workdir, the current directory by
+    default, and the patterns are relative to it.
+    Returns the worst exit code of the shards.
+    '''
+    project = (workdir or os.getcwd()) + ':' + ' '.join(command)
+    durations_path = durations_path or durations.get_path(durations.SHARD_DURATIONS_FILE)
+    shard_files = [None] * shards
+    weights = {}
+    if file_patterns:
+        paths = _expand_patterns(file_patterns, workdir)
+        if not paths:
+            utils.logger.error('No files match %(patterns)s', dict(patterns=', '.join(file_patterns)))
+            return 1
+        weights = get_file_weights(paths, durations.load(durations_path).get(project, {}))
+        shard_files = split_files(weights, shards)
+
+    nested_image, user_setup = runner.get_nested_image(fqdn_image, user_image)
+    output_lock = threading.Lock()
+    running = []
+    for index, files in enumerate(shard_files):
+        if files is not None and not files:
+            continue
+        shard_environment = list(environment or []) + ['%(name)s=%(index)d' % dict(name=SHARD_INDEX_VARIABLE, index=index),
+                                                       '%(name)s=%(count)d' % dict(name=SHARD_COUNT_VARIABLE, count=shards)]
+        on_output = _get_output_printer('[shard %(index)d] ' % dict(index=index), output_lock)
+        proc = runner.start_nested(list(command) + (files or []), nested_image, shard_environment, user_setup, workdir=workdir,
+                                   on_output=on_output)
+        running.append((index, files, proc))
+
+    returncodes = []
+    recorded = {}
+    for index, files, proc in running:
+        returncode = proc.wait()
+        returncodes.append(returncode)
+        tracing.add_span('shard %(index)d' % dict(index=index), proc.start_time, proc.end_time, 'shard', exit_code=returncode)
+        metrics.observe(metrics.RUN_DURATION, proc.duration, program=metrics.get_program(command), container='true',
+                        exit_code=str(returncode))
+        if returncode != 0:
+            utils.logger.error('Shard %(index)d failed with exit code %(code)d', dict(index=index, code=returncode))
+        if files:
+            total_weight = sum(weights[path] for path in files) or 1
+            recorded.update((path, proc.duration * weights[path] / total_weight) for path in files)
+
+    if recorded and not durations.update(durations_path, project, recorded):
+        utils.logger.debug('Failed to save shard durations to %(path)s', dict(path=durations_path))
+    return worst_exit_code(returncodes)
+
+
+def worst_exit_code(returncodes):
+    '''
+    Returns the exit code which is the farthest from success, 0 if there is none
+    '''
+    return max(returncodes or [0], key=lambda returncode: (returncode != 0, abs(returncode)))
+
+
+def get_file_weights(paths, recorded_durations):
+    '''
+    Returns a dict of every path to its expected duration. Files without a recorded duration
+    are estimated by their size, at the seconds per byte of the files with one; without any
+    recorded duration the weights are the sizes.
+    '''
+    sizes = dict((path, os.path.getsize(path)) for path in paths)
+    recorded = [path for path in paths if path in recorded_durations]
+    recorded_size = sum(sizes[path] for path in recorded)
+    seconds_per_byte = sum(recorded_durations[path] for path in recorded) / float(recorded_size) if recorded_size else 1.0
+    return dict((path, recorded_durations[path] if path in recorded_durations else sizes[path] * seconds_per_byte) for path in paths)
+
+
+def split_files(weights, shards):
+    '''
+    Split the files between the shards, giving the heaviest remaining file to the lightest
+    shard. Returns a list of the sorted files of every shard.
+    '''
+    heap = [(0, index) for index in range(shards)]
+    shard_files = [[] for _ in range(shards)]
+    for path in sorted(weights, key=lambda path: (-weights[path], path)):
+        weight, index = heapq.heappop(heap)
+        shard_files[index].append(path)
+        heapq.heappush(heap, (weight + weights[path], index))
+    return [sorted(files) for files in shard_files]
+
+
+def _expand_patterns(patterns, directory=None):
+    # Files of another directory are passed by their absolute paths, which are the same in the build container
+    paths = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(os.path.join(directory, pattern) if directory else pattern)):
+            if os.path.isfile(path) and path not in paths:
+                paths.append(path)
+    return paths
+
+
+def _get_output_printer(prefix, output_lock):
+    # Lines arrive whole, so lines of different shards never mix
+    prefix = prefix.encode('utf-8')
+
+    def _print_line(line):
+        stream = getattr(sys.stdout, 'buffer', sys.stdout)
+        with output_lock:
+            stream.write(prefix + line)
+            stream.flush()
+    return _print_line
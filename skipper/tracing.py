@@ -0,0 +1,104 @@
+import json
+import logging
+import os
+import threading
+import time
+
+
+_tracer = None   # pylint: disable=invalid-name
+
+
+def configure(path):
+    '''
+    Record spans and write them to path as Chrome trace events, None disables tracing
+    '''
+    global _tracer   # pylint: disable=global-statement,invalid-name
+    _tracer = Tracer(path) if path else None
+
+
+def is_enabled():
+    return _tracer is not None
+
+
+def span(name, category='skipper', **args):
+    '''
+    Returns a context manager recording a span around its block. While tracing is
+    disabled it returns a shared context manager which does nothing.
+    '''
+    if _tracer is None:
+        return _NULL_SPAN
+    return _Span(_tracer, name, category, args)
+
+
+def add_span(name, start_time, end_time, category='skipper', **args):
+    '''
+    Record a span that already ended, with times as returned by time.time()
+    '''
+    if _tracer is not None:
+        _tracer.add(name, category, start_time, end_time, args)
+
+
+def write():
+    if _tracer is not None:
+        _tracer.write()
+
+
+class Tracer(object):
+    '''
+    Collects complete ('X') trace events of every thread, in the format of
+    chrome://tracing and Perfetto, which nest the spans of a thread by their times.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self._events = []
+        self._threads = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, category, start_time, end_time, args):  # pylint: disable=too-many-arguments
+        thread = threading.current_thread()
+        event = dict(name=name, cat=category, ph='X', pid=os.getpid(), tid=thread.ident,
+                     ts=int(start_time * 1000000), dur=int((end_time - start_time) * 1000000), args=args)
+        with self._lock:
+            self._events.append(event)
+            self._threads[thread.ident] = thread.name
+
+    def write(self):
+        with self._lock:
+            events = [dict(name='thread_name', ph='M', pid=os.getpid(), tid=tid, args=dict(name=name))
+                      for tid, name in self._threads.items()]
+            events += sorted(self._events, key=lambda event: (event['ts'], -event['dur']))
+        try:
+            with open(self.path, 'w') as trace_file:
+                json.dump(dict(traceEvents=events, displayTimeUnit='ms'), trace_file)
+        except (IOError, OSError) as exc:
+            logging.getLogger('skipper').warning('Failed to write trace to %(path)s: %(error)s', dict(path=self.path, error=exc))
+
+
+class _Span(object):
+    def __init__(self, tracer, name, category, args):
+        self._tracer = tracer
+        self._name = name
+        self._category = category
+        self._args = args
+        self._start_time = None
+
+    def __enter__(self):
+        self._start_time = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self._args['error'] = exc_type.__name__
+        self._tracer.add(self._name, self._category, self._start_time, time.time(), self._args)
+        return False
+
+
+class _NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
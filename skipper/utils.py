@@ -1,14 +1,13 @@
+import fnmatch
 import glob
-import json
 import logging
-import subprocess
-import requests
+import threading
+from skipper import docker
 
-REGISTRY_BASE_URL = 'https://%(registry)s/v2/'
-IMAGE_TAGS_URL = REGISTRY_BASE_URL + '%(image)s/tags/list'
-MANIFEST_URL = REGISTRY_BASE_URL + '%(image)s/manifests/%(reference)s'
 
 logger = None   # pylint: disable=invalid-name
+_local_images = None   # pylint: disable=invalid-name
+_local_images_lock = threading.Lock()   # pylint: disable=invalid-name
 
 
 def configure_logging(name, level):
@@ -31,86 +30,152 @@ def get_images_from_dockerfiles():
     return images
 
 
+def get_local_images():
+    '''
+    Returns a dict of every local repository to the list of its tags.
+    Docker is queried once, and the result is shared by the rest of the invocation
+    until an image is built, tagged, pulled or deleted, see invalidate_local_images.
+    '''
+    global _local_images   # pylint: disable=global-statement,invalid-name
+    with _local_images_lock:
+        if _local_images is None:
+            local_images = {}
+            for info in docker.get_backend().list_images():
+                if info['name'] != '<none>':
+                    local_images.setdefault(info['name'], []).append(info['tag'])
+            _local_images = local_images
+        return _local_images
+
+
+def invalidate_local_images():
+    '''
+    Drop the listing of the local images, called after every change to them
+    '''
+    global _local_images   # pylint: disable=global-statement,invalid-name
+    with _local_images_lock:
+        _local_images = None
+
+
 def local_image_exist(image, tag):
-    name = image + ':' + tag
-    command = [
-        'docker',
-        'images',
-        '--format', '{{.ID}}',
-        name
-    ]
-    output = subprocess.check_output(command)
-    return output != ''
+    return tag in get_local_images().get(image, [])
 
 
 def remote_image_exist(registry, image, tag):
-    requests.packages.urllib3.disable_warnings()
-    url = IMAGE_TAGS_URL % dict(registry=registry, image=image)
-    response = requests.get(url=url, verify=False)
-    info = response.json()
-    return tag in info['tags']
+    return _get_registry_client(registry).image_exist(image, tag)
 
 
 def get_local_images_info(images):
-    command = [
-        'docker',
-        'images',
-        '--format', '{"name": "{{.Repository}}", "tag": "{{.Tag}}"}',
-    ]
+    local_images = get_local_images()
     images_info = []
     for image in images:
-        output = subprocess.check_output(command + [image])
-        if output == '':
-            continue
-        image_info = [json.loads(record) for record in output.splitlines()]
-        images_info += [['none', info['name'], info['tag']] for info in image_info]
-
+        images_info += [['none', image, tag] for tag in local_images.get(image, [])]
     return images_info
 
 
 def get_remote_images_info(images, registry):
     images_info = []
-    for image in images:
-        images_info += get_remote_image_info(image, registry)
+    images_tags = _get_registry_client(registry).get_images_tags(images)
+    for image, tags in zip(images, images_tags):
+        images_info += [[registry, image, tag] for tag in tags or []]
     return images_info
 
 
 def get_remote_image_info(image, registry):
-    requests.packages.urllib3.disable_warnings()
-    image_info = []
-    url = IMAGE_TAGS_URL % dict(registry=registry, image=image)
-    response = requests.get(url=url, verify=False)
-    info = response.json()
-    if response.ok:
-        image_info += [[registry, image, tag] for tag in info['tags']]
-    else:
-        if info['errors'][0]['code'] == 'NAME_UNKNOWN':
-            pass
-        else:
-            raise Exception(info)
+    return get_remote_images_info([image], registry)
+
+
+def iter_remote_images_info(images, registry):
+    client = _get_registry_client(registry)
+    for image in images:
+        for tag in client.iter_tags(image):
+            yield [registry, image, tag]
+
+
+def get_image_config_digest(registry, image, tag):
+    return _get_registry_client(registry).get_image_config_digest(image, tag)
+
+
+def delete_images_from_registry(registry, references, keep_shared=False):
+    '''
+    Deletes image:tag of each of the (image, tag) references from the registry, tags may be globs.
+    With keep_shared, manifests which other tags point to aren't deleted.
+    Returns an [image, tag, error] row per deleted reference, error is None on success.
+    '''
+    client = _get_registry_client(registry)
+    references = list(references)
+    pattern_images = sorted(set(image for image, tag in references if is_tag_pattern(tag)))
+    images_tags = dict(zip(pattern_images, client.get_images_tags(pattern_images)))
+    return client.delete_images(expand_tag_patterns(references, images_tags), keep_shared)
+
+
+def get_digests_from_registry(registry, references, jobs=None, limiter=None):
+    return _get_registry_client(registry).get_digests(references, jobs, limiter)
+
+
+def delete_manifests_from_registry(registry, deletions, jobs=None, limiter=None):
+    return _get_registry_client(registry).delete_manifests(deletions, jobs, limiter)
 
-    return image_info
 
+def get_images_tags(registry, images):
+    return _get_registry_client(registry).get_images_tags(images)
 
-def get_image_digest(registry, image, tag):
-    requests.packages.urllib3.disable_warnings()
-    url = MANIFEST_URL % dict(registry=registry, image=image, reference=tag)
-    headers = {"Accept": "application/vnd.docker.distribution.manifest.v2+json"}
-    response = requests.get(url=url, headers=headers, verify=False)
-    return response.headers['Docker-Content-Digest']
 
+def promote_images(registry, images, src_tag, dst_tags):
+    return _get_registry_client(registry).promote_images(images, src_tag, dst_tags)
 
-def delete_image_from_registry(registry, image, tag):
-    digest = get_image_digest(registry, image, tag)
-    url = MANIFEST_URL % dict(registry=registry, image=image, reference=digest)
-    response = requests.delete(url=url, verify=False)
-    if not response.ok:
-        raise Exception(response.content)
 
+def _get_registry_client(registry):
+    # requests is slow to import, so it is only imported by commands that talk to the registry
+    from skipper import registry_client
+    return registry_client.get_client(registry)
 
-def delete_local_image(image, tag):
-    name = image + ':' + tag
-    subprocess.check_call(['docker', 'rmi', name])
+
+def delete_local_images(references):
+    '''
+    Deletes image:tag of each of the (image, tag) references from local docker, tags may be globs.
+    Every image is removed by a single docker call, which doesn't tell which removal failed,
+    so the local images are listed again after a failure.
+    Returns an [image, tag, error] row per deleted reference, error is None on success.
+    '''
+    local_images = get_local_images()
+    references = expand_tag_patterns(references, local_images)
+    found = [(image, tag) for image, tag in references if tag in local_images.get(image, [])]
+    invalidate_local_images()
+    remaining = {}
+    if found and docker.get_backend().remove_images([image + ':' + tag for image, tag in found]) != 0:
+        remaining = get_local_images()
+
+    rows = []
+    for image, tag in references:
+        error = None
+        if tag not in local_images.get(image, []):
+            error = '%(image)s:%(tag)s was not found' % dict(image=image, tag=tag)
+        elif tag in remaining.get(image, []):
+            error = 'Failed to delete %(image)s:%(tag)s' % dict(image=image, tag=tag)
+        rows.append([image, tag, error])
+    return rows
+
+
+def is_tag_pattern(tag):
+    return any(char in tag for char in '*?[')
+
+
+def expand_tag_patterns(references, images_tags):
+    '''
+    Returns the (image, tag) references, without duplicates, with every tag glob replaced by the
+    matching tags in images_tags, a dict of image to its tags. A glob matching nothing is kept as is.
+    '''
+    expanded = []
+    seen = set()
+    for image, tag in references:
+        matches = []
+        if is_tag_pattern(tag):
+            matches = [(image, candidate) for candidate in sorted(images_tags.get(image) or []) if fnmatch.fnmatchcase(candidate, tag)]
+        for reference in matches or [(image, tag)]:
+            if reference not in seen:
+                seen.add(reference)
+                expanded.append(reference)
+    return expanded
 
 
 def generate_fqdn_image(registry, image, tag='latest'):
@@ -122,9 +187,51 @@ def generate_fqdn_image(registry, image, tag='latest'):
     return fqdn_image
 
 
+def get_dockerfile_base_images(dockerfile):
+    base_images = []
+    with open(dockerfile) as dockerfile_file:
+        for line in dockerfile_file:
+            tokens = line.split()
+            if len(tokens) < 2 or tokens[0].upper() != 'FROM':
+                continue
+            tokens = [token for token in tokens[1:] if not token.startswith('--')]
+            if tokens:
+                base_images.append(tokens[0])
+    return base_images
+
+
+def get_image_dependencies(image, images):
+    dependencies = set()
+    for base_image in get_dockerfile_base_images(image_to_dockerfile(image)):
+        name = _image_reference_to_name(base_image)
+        if name in images and name != image:
+            dependencies.add(name)
+    return dependencies
+
+
+def _image_reference_to_name(reference):
+    name = reference.split('@')[0].split('/')[-1]
+    return name.split(':')[0]
+
+
 def image_to_dockerfile(image):
     return 'Dockerfile.' + image
 
 
 def dockerfile_to_image(dockerfile):
     return dockerfile.replace('Dockerfile.', '')
+
+
+def format_size(size):
+    '''
+    Returns a size in bytes for humans, in decimal units like docker, or None for an unknown size
+    '''
+    if size is None:
+        return None
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1000:
+            break
+        size /= 1000.0
+    else:
+        unit = 'TB'
+    return '%(size).1f %(unit)s' % dict(size=size, unit=unit) if unit != 'B' else '%(size)d B' % dict(size=size)
@@ -0,0 +1,106 @@
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+from skipper import build_cache
+from skipper import docker
+
+
+REGISTRY = 'registry.io:5000'
+IMAGE = 'app'
+CACHE_TAG = 'cache-0123456789abcdef0123'
+
+
+class TestBuildCache(unittest.TestCase):
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._workdir = tempfile.mkdtemp()
+        os.chdir(self._workdir)
+        self._write('Dockerfile.base', 'FROM centos:7\nCOPY ["requirements.txt", "/tmp/"]\n')
+        self._write('Dockerfile.app', 'FROM base\nCOPY --chown=root src \\\n    /app/src\nCOPY --from=builder /out /out\n')
+        self._write('requirements.txt', 'requests\n')
+        self._write('src/main.py', 'print(1)\n')
+        self._write('README.md', 'readme\n')
+        build_cache.utils.logger = mock.Mock()
+        docker.configure_backend('cli')
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        shutil.rmtree(self._workdir)
+
+    def test_cache_tag_is_stable(self):
+        cache_tag = self._get_cache_tag()
+        self.assertTrue(cache_tag.startswith(build_cache.CACHE_TAG_PREFIX))
+        self.assertEqual(len(cache_tag), len(build_cache.CACHE_TAG_PREFIX) + build_cache.CACHE_TAG_LENGTH)
+        self.assertEqual(cache_tag, self._get_cache_tag())
+
+    def test_cache_tag_ignores_files_not_in_image(self):
+        cache_tag = self._get_cache_tag()
+        self._write('README.md', 'changed\n')
+        self.assertEqual(cache_tag, self._get_cache_tag())
+
+    def test_cache_tag_changes_with_copied_files(self):
+        cache_tag = self._get_cache_tag()
+        self._write('src/main.py', 'print(2)\n')
+        self.assertNotEqual(cache_tag, self._get_cache_tag())
+
+    def test_cache_tag_changes_with_base_image(self):
+        cache_tag = self._get_cache_tag()
+        self._write('requirements.txt', 'requests\nclick\n')
+        self.assertNotEqual(cache_tag, self._get_cache_tag())
+
+    def test_cache_tag_changes_with_build_args(self):
+        self.assertNotEqual(self._get_cache_tag(), build_cache.get_cache_tag(IMAGE, ['app', 'base'], ['VERSION=1']))
+
+    @mock.patch('skipper.utils.local_image_exist', autospec=True, return_value=True)
+    def test_find_local_cached_image(self, *args):
+        self.assertEqual(build_cache.find_cached_image(REGISTRY, IMAGE, CACHE_TAG), IMAGE + ':' + CACHE_TAG)
+
+    @mock.patch('skipper.runner.run', autospec=True, return_value=0)
+    @mock.patch('skipper.utils.remote_image_exist', autospec=True, return_value=True)
+    @mock.patch('skipper.utils.local_image_exist', autospec=True, return_value=False)
+    def test_find_remote_cached_image(self, local_image_exist_mock, remote_image_exist_mock, runner_run_mock):
+        fqdn_image = REGISTRY + '/' + IMAGE + ':' + CACHE_TAG
+        self.assertEqual(build_cache.find_cached_image(REGISTRY, IMAGE, CACHE_TAG), fqdn_image)
+        remote_image_exist_mock.assert_called_once_with(REGISTRY, IMAGE, CACHE_TAG)
+        runner_run_mock.assert_called_once_with(['docker', 'pull', fqdn_image])
+
+    @mock.patch('skipper.runner.run', autospec=True, return_value=0)
+    @mock.patch('skipper.docker.CLIBackend.list_images', autospec=True)
+    def test_tag_image_invalidates_local_images(self, list_images_mock, runner_run_mock):
+        list_images_mock.side_effect = [[dict(name=IMAGE, tag=CACHE_TAG)], [dict(name=IMAGE, tag=CACHE_TAG), dict(name=IMAGE, tag='1234567')]]
+        build_cache.utils.invalidate_local_images()
+        self.assertFalse(build_cache.utils.local_image_exist(IMAGE, '1234567'))
+        build_cache.tag_image(IMAGE + ':' + CACHE_TAG, IMAGE + ':1234567')
+        self.assertTrue(build_cache.utils.local_image_exist(IMAGE, '1234567'))
+        runner_run_mock.assert_called_once_with(['docker', 'tag', IMAGE + ':' + CACHE_TAG, IMAGE + ':1234567'])
+
+    @mock.patch('skipper.utils.remote_image_exist', autospec=True)
+    @mock.patch('skipper.utils.local_image_exist', autospec=True, return_value=False)
+    def test_find_cached_image_without_registry(self, local_image_exist_mock, remote_image_exist_mock):
+        self.assertIsNone(build_cache.find_cached_image(None, IMAGE, CACHE_TAG))
+        self.assertFalse(remote_image_exist_mock.called)
+
+    @mock.patch('skipper.docker.CLIBackend.inspect_image', autospec=True)
+    def test_is_cache_tag_of(self, inspect_image_mock):
+        images = {IMAGE + ':1234567': 'sha256:aaa', IMAGE + ':' + CACHE_TAG: 'sha256:aaa', IMAGE + ':cache-other': 'sha256:bbb'}
+
+        def _inspect_image(name):
+            if name not in images:
+                raise docker.DockerError('No such image: ' + name)
+            return dict(id=images[name], digests=[])
+        inspect_image_mock.side_effect = _inspect_image
+        self.assertTrue(build_cache.is_cache_tag_of(IMAGE, '1234567', CACHE_TAG))
+        self.assertFalse(build_cache.is_cache_tag_of(IMAGE, '1234567', 'cache-other'))
+        self.assertFalse(build_cache.is_cache_tag_of(IMAGE, '1234567', 'cache-missing'))
+
+    def _get_cache_tag(self):
+        return build_cache.get_cache_tag(IMAGE, ['app', 'base'])
+
+    @staticmethod
+    def _write(path, content):
+        if os.path.dirname(path) and not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as output:
+            output.write(content)
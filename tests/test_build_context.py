@@ -0,0 +1,118 @@
+import io
+import mock
+import os
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import unittest
+from skipper import build_context
+
+
+DOCKERFILE = 'Dockerfile.app'
+COMMAND = ['docker', 'build', '-f', DOCKERFILE, '-t', 'app:1234567']
+
+
+class TestDockerignoreMatcher(unittest.TestCase):
+    def test_match_patterns(self):
+        matcher = build_context.DockerignoreMatcher(['*.pyc', '/build', 'docs/*.md', '**/tmp'])
+        self.assertTrue(matcher.matches('main.pyc'))
+        self.assertFalse(matcher.matches('src/main.pyc'))
+        self.assertTrue(matcher.matches('build'))
+        self.assertTrue(matcher.matches('build/out/app'))
+        self.assertTrue(matcher.matches('docs/index.md'))
+        self.assertFalse(matcher.matches('docs/api/index.md'))
+        self.assertTrue(matcher.matches('tmp'))
+        self.assertTrue(matcher.matches('src/deep/tmp/file'))
+        self.assertFalse(matcher.matches('src/main.py'))
+
+    def test_last_matching_pattern_wins(self):
+        matcher = build_context.DockerignoreMatcher(['*.md', '!README.md', 'README*'])
+        self.assertTrue(matcher.matches('CHANGES.md'))
+        self.assertTrue(matcher.matches('README.md'))
+        matcher = build_context.DockerignoreMatcher(['*.md', '!README.md'])
+        self.assertFalse(matcher.matches('README.md'))
+        self.assertTrue(matcher.has_exclusions)
+
+    def test_character_classes(self):
+        matcher = build_context.DockerignoreMatcher(['file[0-9]', 'log[!a]'])
+        self.assertTrue(matcher.matches('file1'))
+        self.assertFalse(matcher.matches('filea'))
+        self.assertTrue(matcher.matches('logb'))
+        self.assertFalse(matcher.matches('loga'))
+
+
+class TestBuildContext(unittest.TestCase):
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._workdir = tempfile.mkdtemp()
+        os.chdir(self._workdir)
+        self._write(DOCKERFILE, 'FROM centos:7\nCOPY requirements.txt /tmp/\nCOPY src /app/src\nCOPY --from=builder /out /out\n')
+        self._write('requirements.txt', 'requests\n')
+        self._write('src/main.py', 'print(1)\n')
+        self._write('src/main.pyc', 'compiled')
+        self._write('docs/README.md', 'readme\n')
+        self._write('.git/HEAD', 'ref: refs/heads/master\n')
+        self._write('.dockerignore', '# Not needed in images\n.git\n*.pyc\n**/*.pyc\n')
+        build_context.utils.logger = mock.Mock()
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        shutil.rmtree(self._workdir)
+
+    def test_context_applies_dockerignore(self):
+        paths = build_context.get_context_paths(DOCKERFILE)
+        self.assertEqual(sorted(paths), ['.dockerignore', DOCKERFILE, 'docs', 'docs/README.md', 'requirements.txt', 'src', 'src/main.py'])
+
+    def test_context_keeps_files_brought_back_by_exclusions(self):
+        self._write('.dockerignore', 'docs\n!docs/README.md\n')
+        self.assertIn('docs/README.md', build_context.get_context_paths(DOCKERFILE))
+
+    def test_context_narrowed_to_referenced_paths(self):
+        paths = build_context.get_context_paths(DOCKERFILE, narrow=True)
+        self.assertEqual(sorted(paths), ['.dockerignore', DOCKERFILE, 'requirements.txt', 'src', 'src/main.py'])
+
+    def test_context_always_includes_dockerfile(self):
+        self._write('.dockerignore', 'Dockerfile.*\n')
+        self.assertIn(DOCKERFILE, build_context.get_context_paths(DOCKERFILE))
+
+    def test_context_stats(self):
+        paths = build_context.get_context_paths(DOCKERFILE, narrow=True)
+        self.assertEqual(build_context.get_context_stats(paths), (4, sum(os.path.getsize(path) for path in paths if path != 'src')))
+
+    def test_write_context(self):
+        fileobj = io.BytesIO()
+        build_context.write_context(fileobj, ['requirements.txt', 'src', 'src/main.py'])
+        fileobj.seek(0)
+        with tarfile.open(fileobj=fileobj) as tar:
+            self.assertEqual(tar.getnames(), ['requirements.txt', 'src', 'src/main.py'])
+            self.assertTrue(tar.getmember('src').isdir())
+            self.assertEqual(tar.extractfile('src/main.py').read(), b'print(1)\n')
+
+    @mock.patch('skipper.runner.start', autospec=True)
+    def test_start_build_streams_context(self, runner_start_mock):
+        read_fd, write_fd = os.pipe()
+        runner_start_mock.return_value.stdin = os.fdopen(write_fd, 'wb')
+        build_context.start_build(COMMAND, DOCKERFILE, build_context.REFERENCED)
+        runner_start_mock.assert_called_once_with(COMMAND + ['-'], stdin=subprocess.PIPE)
+        with os.fdopen(read_fd, 'rb') as read_file:
+            fileobj = io.BytesIO(read_file.read())
+        with tarfile.open(fileobj=fileobj) as tar:
+            self.assertEqual(sorted(tar.getnames()), ['.dockerignore', DOCKERFILE, 'requirements.txt', 'src', 'src/main.py'])
+
+    @mock.patch('skipper.runner.start', autospec=True)
+    def test_start_build_with_docker_context(self, runner_start_mock):
+        build_context.start_build(COMMAND, DOCKERFILE)
+        runner_start_mock.assert_called_once_with(COMMAND + ['.'])
+
+    @mock.patch('skipper.runner.run', autospec=True, return_value=0)
+    def test_run_build_with_docker_context(self, runner_run_mock):
+        self.assertEqual(build_context.run_build(COMMAND, DOCKERFILE), 0)
+        runner_run_mock.assert_called_once_with(COMMAND + ['.'])
+
+    def _write(self, path, content):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with open(path, 'w') as target:
+            target.write(content)
@@ -0,0 +1,78 @@
+import mock
+import unittest
+from skipper import builder
+
+
+TAG = '1234567'
+
+DOCKERFILES = {
+    'Dockerfile.base': 'FROM centos:7\n',
+    'Dockerfile.app': 'FROM base\nRUN make\n',
+    'Dockerfile.tests': 'FROM --platform=linux/amd64 registry.io:5000/base:latest AS builder\nFROM app:1234567\n',
+}
+
+
+def _open_dockerfile(dockerfile, *args):
+    return mock.mock_open(read_data=DOCKERFILES[dockerfile])(dockerfile, *args)
+
+
+def _popen_mock(returncode):
+    proc = mock.Mock()
+    proc.wait.return_value = returncode
+    proc.poll.return_value = returncode
+    return proc
+
+
+class TestBuilder(unittest.TestCase):
+    def setUp(self):
+        builder.utils.logger = mock.Mock()
+
+    @mock.patch('skipper.utils.open', side_effect=_open_dockerfile, create=True)
+    @mock.patch('skipper.builder._validate_image', autospec=True, return_value=True)
+    @mock.patch('skipper.runner.start', autospec=True)
+    def test_build_images_in_dependency_order(self, runner_start_mock, *args):
+        runner_start_mock.side_effect = lambda command: _popen_mock(0)
+        ret, results = builder.build_images(['tests', 'app', 'base'], TAG, jobs=4)
+
+        self.assertEqual(ret, 0)
+        built_images = [call[0][0][5].split(':')[0] for call in runner_start_mock.call_args_list]
+        self.assertEqual(built_images, ['base', 'app', 'tests'])
+        self.assertEqual(runner_start_mock.call_args_list[0][0][0],
+                         ['docker', 'build', '-f', 'Dockerfile.base', '-t', 'base:1234567', '-t', 'base:latest', '.'])
+        self.assertEqual(runner_start_mock.call_args_list[2][0][0], ['docker', 'build', '-f', 'Dockerfile.tests', '-t', 'tests:1234567', '.'])
+        self.assertEqual([result[:2] for result in results], [['app', 'built'], ['base', 'built'], ['tests', 'built']])
+
+    @mock.patch('skipper.utils.open', side_effect=_open_dockerfile, create=True)
+    @mock.patch('skipper.builder._validate_image', autospec=True, return_value=True)
+    @mock.patch('skipper.runner.start', autospec=True)
+    def test_build_images_cancels_dependents_on_failure(self, runner_start_mock, *args):
+        runner_start_mock.side_effect = lambda command: _popen_mock(1)
+        ret, results = builder.build_images(['tests', 'app', 'base'], TAG, jobs=4)
+
+        self.assertEqual(ret, 1)
+        runner_start_mock.assert_called_once_with(['docker', 'build', '-f', 'Dockerfile.base', '-t', 'base:1234567', '-t', 'base:latest', '.'])
+        self.assertEqual([result[:2] for result in results], [['app', 'cancelled'], ['base', 'failed'], ['tests', 'cancelled']])
+
+    @mock.patch('skipper.runner.start', autospec=True)
+    def test_build_images_skips_non_project_images(self, runner_start_mock, *args):
+        ret, results = builder.build_images(['non-project-image'], TAG, jobs=2)
+        self.assertEqual(ret, 0)
+        self.assertEqual(results, [])
+        self.assertFalse(runner_start_mock.called)
+
+    @mock.patch('skipper.utils.open', side_effect=_open_dockerfile, create=True)
+    @mock.patch('skipper.builder._validate_image', autospec=True, return_value=True)
+    @mock.patch('skipper.build_cache.tag_image', autospec=True, return_value=0)
+    @mock.patch('skipper.build_cache.find_cached_image', autospec=True, side_effect=lambda registry, image, cache_tag: image + ':' + cache_tag)
+    @mock.patch('skipper.build_cache.get_cache_tag', autospec=True, return_value='cache-1234')
+    @mock.patch('skipper.utils.get_images_from_dockerfiles', autospec=True, return_value=['app', 'base'])
+    def test_build_images_tags_cached_bases_latest(self, get_images_mock, get_cache_tag_mock, find_cached_image_mock, tag_image_mock, *args):
+        ret, results = builder.build_images(['app', 'base'], TAG, jobs=2, use_build_cache=True)
+        self.assertEqual(ret, 0)
+        self.assertEqual([result[:2] for result in results], [['app', 'cached'], ['base', 'cached']])
+        self.assertEqual(sorted(call[0] for call in tag_image_mock.call_args_list),
+                         [('app:cache-1234', 'app:1234567'), ('base:1234567', 'base:latest'), ('base:cache-1234', 'base:1234567')])
+
+    def test_find_cycle(self):
+        self.assertEqual(builder._find_cycle({'a': set(['b']), 'b': set()}), [])
+        self.assertEqual(sorted(builder._find_cycle({'a': set(['b']), 'b': set(['a'])})), ['a', 'b'])
@@ -0,0 +1,71 @@
+import mock
+import unittest
+from skipper import cache_volumes
+
+
+PROJECT = '/home/adir/work/proj'
+IMAGE = 'build-container-image'
+CACHES = {'pip': '/cache/pip', 'ccache': '/cache/ccache'}
+
+
+def _volume(cache, project=PROJECT, size=None):
+    name = cache_volumes.get_volume_name(cache, project, IMAGE)
+    labels = {cache_volumes.CACHE_LABEL: cache, cache_volumes.PROJECT_LABEL: project, cache_volumes.IMAGE_LABEL: IMAGE}
+    return dict(name=name, labels=labels, size=size)
+
+
+@mock.patch('os.getcwd', autospec=True, return_value=PROJECT)
+class TestCacheVolumes(unittest.TestCase):
+    def setUp(self):
+        cache_volumes.configure(CACHES, IMAGE)
+        self.backend = mock.Mock()
+        self.backend.list_volumes.return_value = [_volume('pip', size=2500000), _volume('ccache'), _volume('pip', project='/other')]
+
+    def tearDown(self):
+        cache_volumes.configure({}, None)
+
+    def test_get_volume_name(self, *args):
+        name = cache_volumes.get_volume_name('go mod', PROJECT, IMAGE)
+        self.assertTrue(name.startswith('skipper-cache-go_mod-'))
+        self.assertNotEqual(name, cache_volumes.get_volume_name('go mod', PROJECT, 'other-image'))
+        self.assertNotEqual(name, cache_volumes.get_volume_name('go mod', '/other', IMAGE))
+
+    def test_get_mount_params(self, *args):
+        params = cache_volumes.get_mount_params()
+        self.assertEqual(params[0::2], ['--mount', '--mount'])
+        self.assertEqual(params[1], ','.join(['type=volume', 'src=' + cache_volumes.get_volume_name('ccache', PROJECT, IMAGE),
+                                              'dst=/cache/ccache', 'volume-label=skipper.cache=ccache',
+                                              'volume-label=skipper.cache.project=' + PROJECT,
+                                              'volume-label=skipper.cache.image=' + IMAGE]))
+        self.assertEqual(cache_volumes.get_paths(), ['/cache/ccache', '/cache/pip'])
+
+    def test_get_mount_params_quotes_commas(self, getcwd_mock):
+        getcwd_mock.return_value = '/work/a,b'
+        self.assertIn(',"volume-label=skipper.cache.project=/work/a,b",', cache_volumes.get_mount_params()[1])
+
+    def test_no_caches(self, *args):
+        cache_volumes.configure({}, IMAGE)
+        self.assertEqual(cache_volumes.get_mount_params(), [])
+        self.assertEqual(cache_volumes.get_paths(), [])
+
+    def test_list_volumes(self, *args):
+        rows = cache_volumes.list_volumes(self.backend)
+        self.assertEqual(rows, [[cache_volumes.get_volume_name('ccache', PROJECT, IMAGE), 'ccache', IMAGE, PROJECT, None],
+                                [cache_volumes.get_volume_name('pip', PROJECT, IMAGE), 'pip', IMAGE, PROJECT, 2500000]])
+        self.backend.list_volumes.assert_called_once_with(cache_volumes.CACHE_LABEL)
+        self.assertEqual(len(cache_volumes.list_volumes(self.backend, all_projects=True)), 3)
+
+    def test_prune(self, *args):
+        self.backend.remove_volume.side_effect = [0, 1]
+        rows = cache_volumes.prune(self.backend)
+        self.assertEqual([row[1:] for row in rows], [['ccache', PROJECT, cache_volumes.DELETED], ['pip', PROJECT, cache_volumes.FAILED]])
+
+    def test_prune_caches(self, *args):
+        self.backend.remove_volume.return_value = 0
+        rows = cache_volumes.prune(self.backend, ['pip'], all_projects=True)
+        self.assertEqual([row[1:] for row in rows], [['pip', PROJECT, cache_volumes.DELETED], ['pip', '/other', cache_volumes.DELETED]])
+
+    def test_prune_dry_run(self, *args):
+        rows = cache_volumes.prune(self.backend, dry_run=True)
+        self.assertEqual([row[3] for row in rows], [cache_volumes.WOULD_DELETE] * 2)
+        self.assertFalse(self.backend.remove_volume.called)
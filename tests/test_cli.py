@@ -1,10 +1,17 @@
+import json
 import mock
 import os
+import shutil
+import tempfile
 import unittest
 import click
+import requests
 from click import testing
 from skipper import cli
 from skipper import config
+from skipper import docker
+from skipper import registry_client
+from skipper import utils
 
 
 REGISTRY = 'registry.io:5000'
@@ -18,10 +25,16 @@ BUILD_CONTAINER_FQDN_IMAGE = REGISTRY + '/' + BUILD_CONTAINER_IMAGE + ':' + BUIL
 
 ENV = ["KEY1=VAL1", "KEY2=VAL2"]
 
+LOCAL_BUILD_CONTAINERS = (
+    '{"name": "build-container-image", "tag": "build-container-tag"}\n'
+    '{"name": "skipper-conf-build-container-image", "tag": "skipper-conf-build-container-tag"}\n'
+)
+
 SKIPPER_CONF_BUILD_CONTAINER_IMAGE = 'skipper-conf-build-container-image'
 SKIPPER_CONF_BUILD_CONTAINER_TAG = 'skipper-conf-build-container-tag'
 SKIPPER_CONF_BUILD_CONTAINER_FQDN_IMAGE = REGISTRY + '/' + SKIPPER_CONF_BUILD_CONTAINER_IMAGE + ':' + SKIPPER_CONF_BUILD_CONTAINER_TAG
 SKIPPER_CONF_MAKEFILE = 'Makefile.skipper'
+CONFIG_FILE = '/home/adir/work/proj/skipper.yaml'
 SKIPPER_CONF = {
     'registry': REGISTRY,
     'build-container-image': SKIPPER_CONF_BUILD_CONTAINER_IMAGE,
@@ -53,8 +66,42 @@ SKIPPER_CONF_WITH_ENV = {
 }
 
 
+class FakeDockerBackend(object):
+    '''
+    A docker daemon with a dict of local image names to their ids, which pushes them to a dict of pushed names to ids
+    '''
+    def __init__(self, images):
+        self.images = dict(images)
+        self.pushed = {}
+
+    def inspect_image(self, name):
+        # The daemon drops the repo digests of a repository with its last tag
+        return dict(id=self.images[name], digests=[])
+
+    def tag_image(self, source, target):
+        self.images[target] = self.images[source]
+        return 0
+
+    def push_image(self, name, capture_output=False):  # pylint: disable=unused-argument
+        self.pushed[name] = self.images[name]
+        return dict(returncode=0, size=None)
+
+    def remove_image(self, name):
+        del self.images[name]
+        return 0
+
+
 class TestCLI(unittest.TestCase):
     def setUp(self):
+        utils.invalidate_local_images()
+        engine_api_patcher = mock.patch('skipper.docker.EngineAPIBackend.is_available', return_value=False)
+        engine_api_patcher.start()
+        self.addCleanup(engine_api_patcher.stop)
+        cache_home = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_home)
+        xdg_patcher = mock.patch.dict(os.environ, XDG_CACHE_HOME=cache_home)
+        xdg_patcher.start()
+        self.addCleanup(xdg_patcher.stop)
         self._runner = testing.CliRunner()
         self.global_params = [
             '--registry', REGISTRY,
@@ -150,6 +197,23 @@ class TestCLI(unittest.TestCase):
         ]
         skipper_runner_run_mock.assert_has_calls(expected_commands)
 
+    @mock.patch('skipper.utils.get_image_dependencies', autospec=True,
+                side_effect=lambda image, images: set(['base']) if image == 'app' else set())
+    @mock.patch('skipper.git.get_hash', autospec=True, return_value='1234567')
+    @mock.patch('os.path.exists', autospec=True, return_value=True)
+    @mock.patch('skipper.runner.run', autospec=True, return_value=0)
+    def test_build_multiple_images_tags_bases_latest(self, skipper_runner_run_mock, *args):
+        self._invoke_cli(
+            global_params=self.global_params,
+            subcmd='build',
+            subcmd_params=['base', 'app']
+        )
+        expected_commands = [
+            mock.call(['docker', 'build', '-f', 'Dockerfile.base', '-t', 'base:1234567', '-t', 'base:latest', '.']),
+            mock.call(['docker', 'build', '-f', 'Dockerfile.app', '-t', 'app:1234567', '.']),
+        ]
+        skipper_runner_run_mock.assert_has_calls(expected_commands)
+
     @mock.patch('skipper.git.get_hash', autospec=True, return_value='1234567')
     @mock.patch('os.path.exists', autospec=True, return_value=True)
     @mock.patch('skipper.runner.run', autospec=True, return_value=1)
@@ -169,6 +233,20 @@ class TestCLI(unittest.TestCase):
         ]
         skipper_runner_run_mock.assert_called_once_with(expected_command)
 
+    @mock.patch('tabulate.tabulate', autospec=True)
+    @mock.patch('skipper.git.get_hash', autospec=True, return_value='1234567')
+    @mock.patch('os.path.exists', autospec=True, return_value=True)
+    @mock.patch('skipper.runner.run', autospec=True, side_effect=[0, 1])
+    def test_build_serial_summary(self, skipper_runner_run_mock, exists_mock, get_hash_mock, tabulate_mock):
+        result = self._invoke_cli(
+            global_params=self.global_params,
+            subcmd='build',
+            subcmd_params=['image1', 'image2', 'image3']
+        )
+        self.assertEqual(result.return_value, 1)
+        self.assertEqual([row[:2] for row in tabulate_mock.call_args[0][0]], [['image1', 'built'], ['image2', 'failed']])
+        self.assertEqual(tabulate_mock.call_args[1]['headers'], ['IMAGE', 'STATUS', 'SECONDS'])
+
     @mock.patch('skipper.utils.get_images_from_dockerfiles', autospec=True, return_value=['image1', 'image2'])
     @mock.patch('skipper.git.get_hash', autospec=True, return_value='1234567')
     @mock.patch('os.path.exists', autospec=True, return_value=True)
@@ -184,9 +262,59 @@ class TestCLI(unittest.TestCase):
         ]
         skipper_runner_run_mock.assert_has_calls(expected_commands)
 
-    @mock.patch('__builtin__.open', create=True)
+    @mock.patch('tabulate.tabulate', autospec=True)
+    @mock.patch('skipper.builder.build_images', autospec=True, return_value=(0, [['image1', 'built', 1.0]]))
+    @mock.patch('skipper.git.get_hash', autospec=True, return_value='1234567')
+    @mock.patch('skipper.runner.run', autospec=True)
+    def test_build_parallel(self, skipper_runner_run_mock, git_get_hash_mock, build_images_mock, tabulate_mock):
+        result = self._invoke_cli(
+            global_params=self.global_params,
+            subcmd='build',
+            subcmd_params=['-j', '4', 'image1', 'image2']
+        )
+        self.assertEqual(result.exit_code, 0)
+        build_images_mock.assert_called_once_with(('image1', 'image2'), '1234567', 4, REGISTRY, False, 'docker')
+        tabulate_mock.assert_called_once_with([['image1', 'built', 1.0]], headers=['IMAGE', 'STATUS', 'SECONDS'], tablefmt='grid')
+        self.assertFalse(skipper_runner_run_mock.called)
+
+    @mock.patch('skipper.build_cache.find_cached_image', autospec=True, return_value='my_image:cache-abc')
+    @mock.patch('skipper.build_cache.get_cache_tag', autospec=True, return_value='cache-abc')
+    @mock.patch('skipper.git.get_hash', autospec=True, return_value='1234567')
+    @mock.patch('os.path.exists', autospec=True, return_value=True)
+    @mock.patch('skipper.runner.run', autospec=True, return_value=0)
+    def test_build_with_cache_hit(self, skipper_runner_run_mock, *args):
+        self._invoke_cli(
+            global_params=self.global_params + ['--build-cache'],
+            subcmd='build',
+            subcmd_params=['my_image']
+        )
+        skipper_runner_run_mock.assert_called_once_with(['docker', 'tag', 'my_image:cache-abc', 'my_image:1234567'])
+
+    @mock.patch('skipper.build_cache.find_cached_image', autospec=True, return_value=None)
+    @mock.patch('skipper.build_cache.get_cache_tag', autospec=True, return_value='cache-abc')
+    @mock.patch('skipper.git.get_hash', autospec=True, return_value='1234567')
+    @mock.patch('os.path.exists', autospec=True, return_value=True)
+    @mock.patch('skipper.runner.run', autospec=True, return_value=0)
+    def test_build_with_cache_miss(self, skipper_runner_run_mock, *args):
+        self._invoke_cli(
+            global_params=self.global_params + ['--build-cache'],
+            subcmd='build',
+            subcmd_params=['my_image']
+        )
+        expected_command = [
+            'docker',
+            'build',
+            '-f', 'Dockerfile.my_image',
+            '-t', 'my_image:1234567',
+            '-t', 'my_image:cache-abc',
+            '.'
+        ]
+        skipper_runner_run_mock.assert_called_once_with(expected_command)
+
+    @mock.patch('skipper.config.find_config_file', autospec=True, return_value=CONFIG_FILE)
+    @mock.patch('skipper.config._stat', autospec=True, return_value=None)
+    @mock.patch('skipper.config._load_yaml', autospec=True, return_value=SKIPPER_CONF)
     @mock.patch('os.path.exists', autospec=True, return_value=True)
-    @mock.patch('yaml.load', autospec=True, return_value=SKIPPER_CONF)
     @mock.patch('skipper.git.get_hash', autospec=True, return_value='1234567')
     @mock.patch('skipper.runner.run', autospec=True, return_value=0)
     def test_build_with_defaults_from_config_file(self, skipper_runner_run_mock, *args):
@@ -205,8 +333,36 @@ class TestCLI(unittest.TestCase):
         ]
         skipper_runner_run_mock.assert_called_once_with(expected_command)
 
+    @mock.patch('skipper.git.is_dirty', autospec=True, return_value=True)
     @mock.patch('skipper.git.get_hash', autospec=True, return_value='1234567')
-    @mock.patch('skipper.runner.run', autospec=True)
+    @mock.patch('os.path.exists', autospec=True, return_value=True)
+    @mock.patch('skipper.runner.run', autospec=True, return_value=0)
+    def test_build_with_mark_dirty(self, skipper_runner_run_mock, *args):
+        self._invoke_cli(
+            global_params=['--mark-dirty'] + self.global_params,
+            subcmd='build',
+            subcmd_params=['image1']
+        )
+        expected_command = ['docker', 'build', '-f', 'Dockerfile.image1', '-t', 'image1:1234567-dirty', '.']
+        skipper_runner_run_mock.assert_called_once_with(expected_command)
+
+    @mock.patch('skipper.git.get_hash', autospec=True, return_value='1234567')
+    @mock.patch('os.path.exists', autospec=True, return_value=True)
+    @mock.patch('skipper.build_context.start_build', autospec=True)
+    def test_build_with_referenced_context(self, start_build_mock, *args):
+        start_build_mock.return_value.returncode = 0
+        result = self._invoke_cli(
+            global_params=['--build-context', 'referenced'] + self.global_params,
+            subcmd='build',
+            subcmd_params=['image1']
+        )
+        self.assertEqual(result.exit_code, 0)
+        expected_command = ['docker', 'build', '-f', 'Dockerfile.image1', '-t', 'image1:1234567']
+        start_build_mock.assert_called_once_with(expected_command, 'Dockerfile.image1', 'referenced')
+
+    @mock.patch('skipper.utils.get_image_config_digest', autospec=True, return_value=None)
+    @mock.patch('skipper.git.get_hash', autospec=True, return_value='1234567')
+    @mock.patch('skipper.runner.run', autospec=True, return_value=0)
     def test_push(self, skipper_runner_run_mock, *args):
         push_params = ['my_image']
         self._invoke_cli(
@@ -221,11 +377,172 @@ class TestCLI(unittest.TestCase):
         ]
         skipper_runner_run_mock.assert_has_calls(expected_commands)
 
-    @mock.patch('__builtin__.open', create=True)
-    @mock.patch('os.path.exists', autospec=True, return_value=True)
-    @mock.patch('yaml.load', autospec=True, return_value=SKIPPER_CONF)
+    @mock.patch('skipper.utils.get_image_config_digest', autospec=True, return_value=None)
+    @mock.patch('glob.glob', autospec=True, return_value=['Dockerfile.image1', 'Dockerfile.image2'])
+    @mock.patch('tabulate.tabulate', autospec=True)
+    @mock.patch('skipper.git.get_hash', autospec=True, return_value='1234567')
+    @mock.patch('skipper.runner.Process', autospec=True)
+    @mock.patch('skipper.runner.run', autospec=True, return_value=0)
+    def test_push_all_images(self, skipper_runner_run_mock, process_mock, git_get_hash_mock, tabulate_mock, *args):
+        process_mock.return_value.wait.return_value = 0
+        result = self._invoke_cli(
+            global_params=self.global_params,
+            subcmd='push',
+            subcmd_params=['-j', '2']
+        )
+        self.assertEqual(result.exit_code, 0)
+        for image in ('image1', 'image2'):
+            fqdn_image = 'registry.io:5000/%(image)s:1234567' % dict(image=image)
+            image_calls = [call for call in skipper_runner_run_mock.call_args_list if fqdn_image in call[0][0]]
+            self.assertEqual(image_calls, [
+                mock.call(['docker', 'tag', image + ':1234567', fqdn_image]),
+                mock.call(['docker', 'rmi', fqdn_image]),
+            ])
+            # Concurrent pushes are captured, so their output doesn't interleave
+            self.assertIn(mock.call(['docker', 'push', fqdn_image], on_output=mock.ANY), process_mock.call_args_list)
+        results = tabulate_mock.call_args[0][0]
+        self.assertEqual([row[:3] for row in results], [
+            ['registry.io:5000/image1:1234567', 'pushed', None],
+            ['registry.io:5000/image2:1234567', 'pushed', None],
+        ])
+
+    @mock.patch('skipper.utils.get_image_config_digest', autospec=True, return_value=None)
+    @mock.patch('tabulate.tabulate', autospec=True)
     @mock.patch('skipper.git.get_hash', autospec=True, return_value='1234567')
     @mock.patch('skipper.runner.run', autospec=True)
+    def test_push_with_error(self, skipper_runner_run_mock, git_get_hash_mock, tabulate_mock, *args):
+        skipper_runner_run_mock.side_effect = lambda command: 1 if command[1] == 'push' else 0
+        result = self._invoke_cli(
+            global_params=self.global_params,
+            subcmd='push',
+            subcmd_params=['image1']
+        )
+        self.assertEqual(result.return_value, 1)
+        skipper_runner_run_mock.assert_called_with(['docker', 'rmi', 'registry.io:5000/image1:1234567'])
+        self.assertEqual(tabulate_mock.call_args[0][0][0][:2], ['registry.io:5000/image1:1234567', 'failed'])
+
+    @mock.patch('skipper.utils.get_image_config_digest', autospec=True, return_value=None)
+    @mock.patch('tabulate.tabulate', autospec=True)
+    @mock.patch('skipper.git.get_hash', autospec=True, return_value='1234567')
+    @mock.patch('skipper.runner.run', autospec=True, return_value=1)
+    def test_push_without_local_image(self, skipper_runner_run_mock, *args):
+        result = self._invoke_cli(
+            global_params=self.global_params,
+            subcmd='push',
+            subcmd_params=['image1']
+        )
+        self.assertEqual(result.return_value, 1)
+        skipper_runner_run_mock.assert_called_once_with(['docker', 'tag', 'image1:1234567', 'registry.io:5000/image1:1234567'])
+
+    @mock.patch('tabulate.tabulate', autospec=True)
+    @mock.patch('skipper.docker.CLIBackend.inspect_image', autospec=True, return_value=dict(id='sha256:aaa', digests=[]))
+    @mock.patch('skipper.utils.get_image_config_digest', autospec=True, return_value='sha256:aaa')
+    @mock.patch('skipper.git.get_hash', autospec=True, return_value='1234567')
+    @mock.patch('skipper.runner.run', autospec=True, return_value=0)
+    def test_push_skips_pushed_image(self, skipper_runner_run_mock, git_get_hash_mock, get_image_config_digest_mock, inspect_image_mock,
+                                     tabulate_mock):
+        result = self._invoke_cli(
+            global_params=self.global_params,
+            subcmd='push',
+            subcmd_params=['image1']
+        )
+        self.assertEqual(result.return_value, 0)
+        get_image_config_digest_mock.assert_called_once_with(REGISTRY, 'image1', '1234567')
+        inspect_image_mock.assert_called_once_with('image1:1234567')
+        self.assertFalse(skipper_runner_run_mock.called)
+        self.assertEqual(tabulate_mock.call_args[0][0][0][:2], ['registry.io:5000/image1:1234567', 'up to date'])
+
+    @mock.patch('tabulate.tabulate', autospec=True)
+    @mock.patch('skipper.utils.get_image_config_digest', autospec=True)
+    @mock.patch('skipper.docker.get_backend', autospec=True)
+    @mock.patch('skipper.git.get_hash', autospec=True, return_value='1234567')
+    def test_push_twice_skips_pushed_image(self, git_get_hash_mock, get_backend_mock, get_image_config_digest_mock, tabulate_mock):
+        backend = FakeDockerBackend({'image1:1234567': 'sha256:aaa'})
+        get_backend_mock.return_value = backend
+        get_image_config_digest_mock.side_effect = lambda registry, image, tag: backend.pushed.get('%s/%s:%s' % (registry, image, tag))
+        for _ in range(2):
+            self._invoke_cli(
+                global_params=self.global_params,
+                subcmd='push',
+                subcmd_params=['image1']
+            )
+        self.assertEqual([call[0][0][0][1] for call in tabulate_mock.call_args_list], ['pushed', 'up to date'])
+        self.assertEqual(backend.images, {'image1:1234567': 'sha256:aaa'})
+        self.assertEqual(backend.pushed, {'registry.io:5000/image1:1234567': 'sha256:aaa'})
+
+    @mock.patch('tabulate.tabulate', autospec=True)
+    @mock.patch('skipper.utils.get_image_config_digest', autospec=True, return_value=None)
+    @mock.patch('skipper.build_cache.get_cache_tag', autospec=True, return_value='cache-abc')
+    @mock.patch('skipper.docker.get_backend', autospec=True)
+    @mock.patch('skipper.git.get_hash', autospec=True, return_value='1234567')
+    def test_push_with_build_cache(self, git_get_hash_mock, get_backend_mock, get_cache_tag_mock, get_image_config_digest_mock,
+                                   tabulate_mock):
+        backend = FakeDockerBackend({'image1:1234567': 'sha256:aaa', 'image1:cache-abc': 'sha256:aaa',
+                                     'image2:1234567': 'sha256:bbb', 'image2:cache-abc': 'sha256:ccc'})
+        get_backend_mock.return_value = backend
+        self._invoke_cli(
+            global_params=self.global_params + ['--build-cache'],
+            subcmd='push',
+            subcmd_params=['image1', 'image2']
+        )
+        # The cache tag of image2 was built from other sources than image2:1234567, so it isn't pushed
+        self.assertEqual(sorted(backend.pushed), ['registry.io:5000/image1:1234567', 'registry.io:5000/image1:cache-abc',
+                                                  'registry.io:5000/image2:1234567'])
+
+    @mock.patch('skipper.docker.CLIBackend.inspect_image', autospec=True, return_value=dict(id='sha256:aaa', digests=[]))
+    @mock.patch('skipper.utils.get_image_config_digest', autospec=True, return_value='sha256:eee')
+    @mock.patch('skipper.git.get_hash', autospec=True, return_value='1234567')
+    @mock.patch('skipper.runner.run', autospec=True, return_value=0)
+    def test_push_changed_image(self, skipper_runner_run_mock, *args):
+        self._invoke_cli(
+            global_params=self.global_params,
+            subcmd='push',
+            subcmd_params=['image1']
+        )
+        skipper_runner_run_mock.assert_any_call(['docker', 'push', 'registry.io:5000/image1:1234567'])
+
+    @mock.patch('skipper.utils.get_image_config_digest', autospec=True, side_effect=registry_client.RegistryError('UNAUTHORIZED'))
+    @mock.patch('skipper.git.get_hash', autospec=True, return_value='1234567')
+    @mock.patch('skipper.runner.run', autospec=True, return_value=0)
+    def test_push_when_registry_denies_digest(self, skipper_runner_run_mock, *args):
+        result = self._invoke_cli(
+            global_params=self.global_params,
+            subcmd='push',
+            subcmd_params=['image1']
+        )
+        self.assertEqual(result.exit_code, 0)
+        skipper_runner_run_mock.assert_any_call(['docker', 'push', 'registry.io:5000/image1:1234567'])
+
+    @mock.patch('skipper.utils.get_image_config_digest', autospec=True, side_effect=requests.ConnectionError('connection refused'))
+    @mock.patch('skipper.git.get_hash', autospec=True, return_value='1234567')
+    @mock.patch('skipper.runner.run', autospec=True, return_value=0)
+    def test_push_when_registry_is_unreachable(self, skipper_runner_run_mock, *args):
+        result = self._invoke_cli(
+            global_params=self.global_params,
+            subcmd='push',
+            subcmd_params=['image1']
+        )
+        self.assertEqual(result.exit_code, 0)
+        skipper_runner_run_mock.assert_any_call(['docker', 'push', 'registry.io:5000/image1:1234567'])
+
+    @mock.patch('skipper.utils.get_image_config_digest', autospec=True)
+    @mock.patch('skipper.git.get_hash', autospec=True, return_value='1234567')
+    @mock.patch('skipper.runner.run', autospec=True, return_value=0)
+    def test_push_with_force(self, skipper_runner_run_mock, git_get_hash_mock, get_image_config_digest_mock):
+        self._invoke_cli(
+            global_params=self.global_params,
+            subcmd='push',
+            subcmd_params=['--force', 'image1']
+        )
+        self.assertFalse(get_image_config_digest_mock.called)
+        skipper_runner_run_mock.assert_any_call(['docker', 'push', 'registry.io:5000/image1:1234567'])
+
+    @mock.patch('skipper.utils.get_image_config_digest', autospec=True, return_value=None)
+    @mock.patch('skipper.config.find_config_file', autospec=True, return_value=CONFIG_FILE)
+    @mock.patch('skipper.config._stat', autospec=True, return_value=None)
+    @mock.patch('skipper.config._load_yaml', autospec=True, return_value=SKIPPER_CONF)
+    @mock.patch('skipper.git.get_hash', autospec=True, return_value='1234567')
+    @mock.patch('skipper.runner.run', autospec=True, return_value=0)
     def test_push_with_defaults_from_config_file(self, skipper_runner_run_mock, *args):
         push_params = ['my_image']
         self._invoke_cli(
@@ -255,7 +572,6 @@ class TestCLI(unittest.TestCase):
             'docker',
             'images',
             '--format', '{"name": "{{.Repository}}", "tag": "{{.Tag}}"}',
-            'my_image'
         ]
         subprocess_check_output_mock.assert_called_once_with(expected_command)
         tabulate_mock.assert_called_once_with([['none', 'my_image', '1234567']], headers=['REGISTRY', 'IMAGE', 'TAG'], tablefmt='grid')
@@ -264,26 +580,25 @@ class TestCLI(unittest.TestCase):
     @mock.patch('tabulate.tabulate', autospec=True)
     @mock.patch('subprocess.check_output', autospec=True)
     def test_images_with_multiple_local_results(self, subprocess_check_output_mock, tabulate_mock, *args):
-        subprocess_check_output_mock.side_effect = [
-            '{"name": "image1", "tag": "aaaaaaa"}\n',
-            '{"name": "image2", "tag": "bbbbbbb"}\n{"name": "image2", "tag": "ccccccc"}\n',
-        ]
+        subprocess_check_output_mock.return_value = (
+            '{"name": "image2", "tag": "bbbbbbb"}\n'
+            '{"name": "other_image", "tag": "ddddddd"}\n'
+            '{"name": "image1", "tag": "aaaaaaa"}\n'
+            '{"name": "<none>", "tag": "<none>"}\n'
+            '{"name": "image2", "tag": "ccccccc"}\n'
+        )
         self._invoke_cli(
             global_params=self.global_params,
             subcmd='images',
             subcmd_params=[]
         )
 
-        command_prefix = [
+        expected_command = [
             'docker',
             'images',
             '--format', '{"name": "{{.Repository}}", "tag": "{{.Tag}}"}',
         ]
-        expected_check_output_calls = [
-            mock.call(command_prefix + ['image1']),
-            mock.call(command_prefix + ['image2']),
-        ]
-        subprocess_check_output_mock.assert_has_calls(expected_check_output_calls)
+        subprocess_check_output_mock.assert_called_once_with(expected_command)
         expected_table = [
             ['none', 'image1', 'aaaaaaa'],
             ['none', 'image2', 'bbbbbbb'],
@@ -293,7 +608,7 @@ class TestCLI(unittest.TestCase):
 
     @mock.patch('glob.glob', autospec=True, return_value=['Dockerfile.my_image'])
     @mock.patch('tabulate.tabulate', autospec=True)
-    @mock.patch('requests.get', autospec=True)
+    @mock.patch('requests.Session.get', autospec=True)
     @mock.patch('subprocess.check_output', autospec=True)
     def test_images_with_all_results(self, subprocess_check_output_mock, requests_get_mock, tabulate_mock, *args):
         subprocess_check_output_mock.return_value = '{"name": "my_image", "tag": "aaaaaaa"}'
@@ -301,6 +616,7 @@ class TestCLI(unittest.TestCase):
         requests_response_mock = None
         with mock.patch('requests.Response', autospec=True) as requests_response_class_mock:
             requests_response_mock = requests_response_class_mock.return_value
+            requests_response_mock.headers = {}
             requests_response_mock.json.return_value = {
                 'name': 'my_image',
                 'tags': ['latest', 'aaaaaaa', 'bbbbbbb']
@@ -317,15 +633,11 @@ class TestCLI(unittest.TestCase):
             'docker',
             'images',
             '--format', '{"name": "{{.Repository}}", "tag": "{{.Tag}}"}',
-            'my_image',
         ]
         subprocess_check_output_mock.assert_called_once_with(expected_command)
 
-        expected_url = 'https://%(registry)s/v2/my_image/tags/list' % dict(registry=REGISTRY)
-        requests_get_mock.assert_called_once_with(
-            url=expected_url,
-            verify=False
-        )
+        expected_url = 'https://%(registry)s/v2/my_image/tags/list?n=1000' % dict(registry=REGISTRY)
+        requests_get_mock.assert_called_once_with(mock.ANY, url=expected_url, headers={})
 
         expected_images_results = [
             ['none', 'my_image', 'aaaaaaa'],
@@ -337,12 +649,13 @@ class TestCLI(unittest.TestCase):
 
     @mock.patch('glob.glob', autospec=True, return_value=['Dockerfile.my_image'])
     @mock.patch('tabulate.tabulate', autospec=True)
-    @mock.patch('requests.get', autospec=True)
+    @mock.patch('requests.Session.get', autospec=True)
     @mock.patch('subprocess.check_output', autospec=True, return_value='')
     def test_images_with_remote_results_only(self, subprocess_check_output_mock, requests_get_mock, tabulate_mock, *args):
         requests_response_mock = None
         with mock.patch('requests.Response', autospec=True) as requests_response_class_mock:
             requests_response_mock = requests_response_class_mock.return_value
+            requests_response_mock.headers = {}
             requests_response_mock.json.return_value = {
                 'name': 'my_image',
                 'tags': ['latest', 'aaaaaaa', 'bbbbbbb']
@@ -359,15 +672,11 @@ class TestCLI(unittest.TestCase):
             'docker',
             'images',
             '--format', '{"name": "{{.Repository}}", "tag": "{{.Tag}}"}',
-            'my_image',
         ]
         subprocess_check_output_mock.assert_called_once_with(expected_command)
 
-        expected_url = 'https://%(registry)s/v2/my_image/tags/list' % dict(registry=REGISTRY)
-        requests_get_mock.assert_called_once_with(
-            url=expected_url,
-            verify=False
-        )
+        expected_url = 'https://%(registry)s/v2/my_image/tags/list?n=1000' % dict(registry=REGISTRY)
+        requests_get_mock.assert_called_once_with(mock.ANY, url=expected_url, headers={})
 
         expected_images_results = [
             ['registry.io:5000', 'my_image', 'latest'],
@@ -378,12 +687,13 @@ class TestCLI(unittest.TestCase):
 
     @mock.patch('glob.glob', autospec=True, return_value=['Dockerfile.my_image'])
     @mock.patch('tabulate.tabulate', autospec=True)
-    @mock.patch('requests.get', autospec=True)
+    @mock.patch('requests.Session.get', autospec=True)
     @mock.patch('subprocess.check_output', autospec=True, return_value='')
     def test_images_with_missing_remote_results(self, subprocess_check_output_mock, requests_get_mock, tabulate_mock, *args):
         requests_response_mock = None
         with mock.patch('requests.Response', autospec=True) as requests_response_class_mock:
             requests_response_mock = requests_response_class_mock.return_value
+            requests_response_mock.headers = {}
             requests_response_mock.ok = False
             requests_response_mock.json.return_value = {
                 u'errors': [{u'message': u'repository name not known to registry', u'code': u'NAME_UNKNOWN', u'detail': {u'name': u'my_image'}}]
@@ -400,22 +710,18 @@ class TestCLI(unittest.TestCase):
             'docker',
             'images',
             '--format', '{"name": "{{.Repository}}", "tag": "{{.Tag}}"}',
-            'my_image',
         ]
         subprocess_check_output_mock.assert_called_once_with(expected_command)
 
-        expected_url = 'https://%(registry)s/v2/my_image/tags/list' % dict(registry=REGISTRY)
-        requests_get_mock.assert_called_once_with(
-            url=expected_url,
-            verify=False
-        )
+        expected_url = 'https://%(registry)s/v2/my_image/tags/list?n=1000' % dict(registry=REGISTRY)
+        requests_get_mock.assert_called_once_with(mock.ANY, url=expected_url, headers={})
 
         expected_images_results = []
         tabulate_mock.assert_called_once_with(expected_images_results, headers=['REGISTRY', 'IMAGE', 'TAG'], tablefmt='grid')
 
     @mock.patch('glob.glob', autospec=True, return_value=['Dockerfile.my_image'])
     @mock.patch('tabulate.tabulate', autospec=True)
-    @mock.patch('requests.get', autospec=True)
+    @mock.patch('requests.Session.get', autospec=True)
     @mock.patch('subprocess.check_output', autospec=True)
     def test_images_with_local_result_and_missing_remote_results(self, subprocess_check_output_mock, requests_get_mock, tabulate_mock, *args):
         subprocess_check_output_mock.return_value = '{"name": "my_image", "tag": "aaaaaaa"}'
@@ -423,6 +729,7 @@ class TestCLI(unittest.TestCase):
         requests_response_mock = None
         with mock.patch('requests.Response', autospec=True) as requests_response_class_mock:
             requests_response_mock = requests_response_class_mock.return_value
+            requests_response_mock.headers = {}
             requests_response_mock.ok = False
             requests_response_mock.json.return_value = {
                 u'errors': [{u'message': u'repository name not known to registry', u'code': u'NAME_UNKNOWN', u'detail': {u'name': u'my_image'}}]
@@ -439,15 +746,11 @@ class TestCLI(unittest.TestCase):
             'docker',
             'images',
             '--format', '{"name": "{{.Repository}}", "tag": "{{.Tag}}"}',
-            'my_image',
         ]
         subprocess_check_output_mock.assert_called_once_with(expected_command)
 
-        expected_url = 'https://%(registry)s/v2/my_image/tags/list' % dict(registry=REGISTRY)
-        requests_get_mock.assert_called_once_with(
-            url=expected_url,
-            verify=False
-        )
+        expected_url = 'https://%(registry)s/v2/my_image/tags/list?n=1000' % dict(registry=REGISTRY)
+        requests_get_mock.assert_called_once_with(mock.ANY, url=expected_url, headers={})
 
         expected_images_results = [
             ['none', 'my_image', 'aaaaaaa'],
@@ -457,12 +760,13 @@ class TestCLI(unittest.TestCase):
 
     @mock.patch('glob.glob', autospec=True, return_value=['Dockerfile.my_image'])
     @mock.patch('tabulate.tabulate', autospec=True)
-    @mock.patch('requests.get', autospec=True)
+    @mock.patch('requests.Session.get', autospec=True)
     @mock.patch('subprocess.check_output', autospec=True, return_value='')
     def test_images_with_with_remote_error(self, subprocess_check_output_mock, requests_get_mock, tabulate_mock, *args):
         requests_response_mock = None
         with mock.patch('requests.Response', autospec=True) as requests_response_class_mock:
             requests_response_mock = requests_response_class_mock.return_value
+            requests_response_mock.headers = {}
             requests_response_mock.ok = False
             requests_response_mock.json.return_value = {
                 u'errors': [{u'message': u'repository name not known to registry', u'code': u'UNKNOWN_ERROR', u'detail': {u'name': u'my_image'}}]
@@ -479,15 +783,11 @@ class TestCLI(unittest.TestCase):
             'docker',
             'images',
             '--format', '{"name": "{{.Repository}}", "tag": "{{.Tag}}"}',
-            'my_image',
         ]
         subprocess_check_output_mock.assert_called_once_with(expected_command)
 
-        expected_url = 'https://%(registry)s/v2/my_image/tags/list' % dict(registry=REGISTRY)
-        requests_get_mock.assert_called_once_with(
-            url=expected_url,
-            verify=False
-        )
+        expected_url = 'https://%(registry)s/v2/my_image/tags/list?n=1000' % dict(registry=REGISTRY)
+        requests_get_mock.assert_called_once_with(mock.ANY, url=expected_url, headers={})
 
         self.assertIsInstance(result.exception, click.exceptions.ClickException)
 
@@ -505,15 +805,43 @@ class TestCLI(unittest.TestCase):
             'docker',
             'images',
             '--format', '{"name": "{{.Repository}}", "tag": "{{.Tag}}"}',
-            'my_image',
         ]
         subprocess_check_output_mock.assert_called_once_with(expected_command)
         tabulate_mock.assert_called_once_with([], headers=['REGISTRY', 'IMAGE', 'TAG'], tablefmt='grid')
 
+    @mock.patch('glob.glob', autospec=True, return_value=['Dockerfile.image1', 'Dockerfile.image2'])
+    @mock.patch('skipper.registry_client.RegistryClient.iter_tags', autospec=True)
+    @mock.patch('subprocess.check_output', autospec=True, return_value='{"name": "image1", "tag": "aaaaaaa"}\n')
+    def test_images_streaming_ndjson(self, subprocess_check_output_mock, iter_tags_mock, *args):
+        iter_tags_mock.side_effect = lambda client, image: iter([image + '-tag'])
+        result = self._invoke_cli(
+            global_params=self.global_params,
+            subcmd='images',
+            subcmd_params=['-r', '--format', 'ndjson']
+        )
+        self.assertEqual(result.exit_code, 0)
+        records = [json.loads(line) for line in self._get_output_lines(result)]
+        self.assertEqual(records, [
+            {'registry': 'none', 'image': 'image1', 'tag': 'aaaaaaa'},
+            {'registry': REGISTRY, 'image': 'image1', 'tag': 'image1-tag'},
+            {'registry': REGISTRY, 'image': 'image2', 'tag': 'image2-tag'},
+        ])
+
+    @mock.patch('glob.glob', autospec=True, return_value=['Dockerfile.image1'])
+    @mock.patch('subprocess.check_output', autospec=True, return_value='{"name": "image1", "tag": "aaaaaaa"}\n')
+    def test_images_streaming_plain(self, *args):
+        result = self._invoke_cli(
+            global_params=self.global_params,
+            subcmd='images',
+            subcmd_params=['--format', 'plain']
+        )
+        self.assertEqual(self._get_output_lines(result), ['none\timage1\taaaaaaa'])
+
     @mock.patch('glob.glob', autospec=True, return_value=['Dockerfile.my_image'])
-    @mock.patch('subprocess.check_call', autospec=True)
-    def test_rmi_local(self, subprocess_check_call_mock, *args):
-        self._invoke_cli(
+    @mock.patch('subprocess.check_output', autospec=True, return_value='{"name": "my_image", "tag": "1234567"}\n')
+    @mock.patch('skipper.runner.run', autospec=True, return_value=0)
+    def test_rmi_local(self, skipper_runner_run_mock, *args):
+        result = self._invoke_cli(
             global_params=self.global_params,
             subcmd='rmi',
             subcmd_params=['my_image', '1234567']
@@ -524,11 +852,167 @@ class TestCLI(unittest.TestCase):
             'rmi',
             'my_image:1234567'
         ]
-        subprocess_check_call_mock.assert_called_once_with(expected_command)
+        skipper_runner_run_mock.assert_called_once_with(expected_command)
+        self.assertIsNone(result.exception)
+        self.assertEqual(result.return_value, 0)
+
+    @mock.patch('glob.glob', autospec=True, return_value=['Dockerfile.my_image'])
+    @mock.patch('subprocess.check_output', autospec=True, return_value='{"name": "my_image", "tag": "1234567"}\n')
+    @mock.patch('tabulate.tabulate', autospec=True)
+    @mock.patch('skipper.runner.run', autospec=True, return_value=1)
+    def test_rmi_local_fail(self, skipper_runner_run_mock, tabulate_mock, *args):
+        result = self._invoke_cli(
+            global_params=self.global_params,
+            subcmd='rmi',
+            subcmd_params=['my_image', '1234567']
+        )
+        self.assertEqual(result.return_value, 1)
+        self.assertEqual(tabulate_mock.call_args[0][0], [['my_image', '1234567', 'Failed to delete my_image:1234567']])
+
+    @mock.patch('glob.glob', autospec=True, return_value=['Dockerfile.image1', 'Dockerfile.image2'])
+    @mock.patch('subprocess.check_output', autospec=True)
+    @mock.patch('tabulate.tabulate', autospec=True)
+    @mock.patch('skipper.runner.run', autospec=True, return_value=0)
+    def test_rmi_local_many(self, skipper_runner_run_mock, tabulate_mock, check_output_mock, *args):
+        check_output_mock.return_value = ('{"name": "image1", "tag": "pr-1"}\n{"name": "image1", "tag": "pr-2"}\n'
+                                          '{"name": "image1", "tag": "latest"}\n{"name": "image2", "tag": "pr-1"}\n')
+        result = self._invoke_cli(
+            global_params=self.global_params,
+            subcmd='rmi',
+            subcmd_params=['image1:pr-*', 'image2:pr-1', 'image2:pr-9']
+        )
+        self.assertEqual(result.return_value, 1)
+        skipper_runner_run_mock.assert_called_once_with(['docker', 'rmi', 'image1:pr-1', 'image1:pr-2', 'image2:pr-1'])
+        self.assertEqual(tabulate_mock.call_args[0][0], [['image1', 'pr-1', 'deleted'],
+                                                         ['image1', 'pr-2', 'deleted'],
+                                                         ['image2', 'pr-1', 'deleted'],
+                                                         ['image2', 'pr-9', 'image2:pr-9 was not found']])
+
+    @mock.patch('glob.glob', autospec=True, return_value=['Dockerfile.image1'])
+    @mock.patch('skipper.runner.run', autospec=True)
+    def test_rmi_invalid_reference(self, skipper_runner_run_mock, *args):
+        result = self._invoke_cli(
+            global_params=self.global_params,
+            subcmd='rmi',
+            subcmd_params=['image1']
+        )
+        self.assertIsInstance(result.exception, click.BadParameter)
+        self.assertFalse(skipper_runner_run_mock.called)
+
+    @mock.patch('glob.glob', autospec=True, return_value=['Dockerfile.image1', 'Dockerfile.image2'])
+    @mock.patch('tabulate.tabulate', autospec=True)
+    @mock.patch('skipper.utils.promote_images', autospec=True)
+    def test_promote(self, promote_images_mock, tabulate_mock, *args):
+        promote_images_mock.return_value = [['image1', 'latest', None], ['image2', 'latest', 'image2:1234567 was not found']]
+        result = self._invoke_cli(
+            global_params=self.global_params,
+            subcmd='promote',
+            subcmd_params=['image1,image2', TAG, 'latest']
+        )
+        self.assertEqual(result.return_value, 1)
+        promote_images_mock.assert_called_once_with(REGISTRY, ['image1', 'image2'], TAG, ('latest',))
+        self.assertEqual(tabulate_mock.call_args[0][0], [['image1', TAG, 'latest', 'promoted'],
+                                                         ['image2', TAG, 'latest', 'image2:1234567 was not found']])
 
     @mock.patch('glob.glob', autospec=True, return_value=['Dockerfile.' + IMAGE])
-    @mock.patch('requests.delete', autospec=True)
-    @mock.patch('requests.get', autospec=True)
+    @mock.patch('skipper.utils.promote_images', autospec=True)
+    def test_promote_not_project_image(self, promote_images_mock, *args):
+        result = self._invoke_cli(
+            global_params=self.global_params,
+            subcmd='promote',
+            subcmd_params=['other_image', TAG, 'latest']
+        )
+        self.assertNotEqual(result.exit_code, 0)
+        self.assertFalse(promote_images_mock.called)
+
+    @mock.patch('glob.glob', autospec=True, return_value=['Dockerfile.image1', 'Dockerfile.image2'])
+    @mock.patch('tabulate.tabulate', autospec=True)
+    @mock.patch('skipper.retention.collect_remote_images', autospec=True)
+    @mock.patch('skipper.retention.collect_local_images', autospec=True)
+    def test_gc(self, collect_local_images_mock, collect_remote_images_mock, tabulate_mock, *args):
+        collect_local_images_mock.return_value = [['image1', 'old', 'local', 'deleted', None]]
+        collect_remote_images_mock.return_value = [['image1', 'old', 'registry', 'failed', 'denied']]
+        result = self._invoke_cli(
+            global_params=self.global_params,
+            subcmd='gc',
+            subcmd_params=['-r', '--keep-last', '3', '--keep-branch', 'master', '--keep', 'latest', '--delete', 'cache-*', '--rate', '5']
+        )
+        self.assertEqual(result.return_value, 1)
+        policy = collect_local_images_mock.call_args[0][1]
+        self.assertEqual((policy.keep_last, policy.branches, policy.patterns, policy.delete_patterns),
+                         (3, ['master'], ['latest'], ['cache-*']))
+        collect_local_images_mock.assert_called_once_with(['image1', 'image2'], policy, False)
+        collect_remote_images_mock.assert_called_once_with(REGISTRY, ['image1', 'image2'], policy, 8, 5.0, False)
+        self.assertEqual(tabulate_mock.call_args[0][0], [['image1', 'old', 'local', 'deleted', None],
+                                                         ['image1', 'old', 'registry', 'failed', 'denied']])
+
+    @mock.patch('tabulate.tabulate', autospec=True)
+    @mock.patch('skipper.cache_volumes.list_volumes', autospec=True, return_value=[])
+    def test_caches_configured_from_defaults(self, *args):
+        self.addCleanup(cli.cache_volumes.configure, {}, None)
+        self._invoke_cli(
+            defaults={'caches': {'pip': '/cache/pip'}},
+            global_params=self.global_params,
+            subcmd='cache',
+            subcmd_params=['ls']
+        )
+        self.assertEqual(cli.cache_volumes.get_paths(), ['/cache/pip'])
+        self.assertEqual(cli.cache_volumes.get_mount_params()[1].split(',')[1],
+                         'src=' + cli.cache_volumes.get_volume_name('pip', os.getcwd(), BUILD_CONTAINER_IMAGE))
+
+    @mock.patch('tabulate.tabulate', autospec=True)
+    @mock.patch('skipper.cache_volumes.list_volumes', autospec=True)
+    def test_cache_ls(self, list_volumes_mock, tabulate_mock):
+        list_volumes_mock.return_value = [['skipper-cache-pip-1', 'pip', BUILD_CONTAINER_IMAGE, '/work/proj', 2500000],
+                                          ['skipper-cache-go-1', 'go', BUILD_CONTAINER_IMAGE, '/work/proj', None]]
+        self._invoke_cli(
+            global_params=self.global_params,
+            subcmd='cache',
+            subcmd_params=['ls', '--all']
+        )
+        list_volumes_mock.assert_called_once_with(mock.ANY, True)
+        self.assertEqual(tabulate_mock.call_args[0][0], [['skipper-cache-pip-1', 'pip', BUILD_CONTAINER_IMAGE, '/work/proj', '2.5 MB'],
+                                                         ['skipper-cache-go-1', 'go', BUILD_CONTAINER_IMAGE, '/work/proj', None]])
+
+    @mock.patch('tabulate.tabulate', autospec=True)
+    @mock.patch('skipper.cache_volumes.prune', autospec=True)
+    def test_cache_prune(self, prune_mock, *args):
+        prune_mock.return_value = [['skipper-cache-pip-1', 'pip', '/work/proj', 'deleted'],
+                                   ['skipper-cache-go-1', 'go', '/work/proj', 'failed']]
+        result = self._invoke_cli(
+            global_params=self.global_params,
+            subcmd='cache',
+            subcmd_params=['prune', 'pip', 'go']
+        )
+        self.assertEqual(result.return_value, 1)
+        prune_mock.assert_called_once_with(mock.ANY, ('pip', 'go'), False, False)
+
+    @mock.patch('skipper.cache_volumes.list_volumes', autospec=True, side_effect=docker.DockerError('500: no daemon'))
+    def test_cache_ls_fail(self, *args):
+        result = self._invoke_cli(
+            global_params=self.global_params,
+            subcmd='cache',
+            subcmd_params=['ls']
+        )
+        self.assertIsInstance(result.exception, click.exceptions.ClickException)
+
+    @mock.patch('glob.glob', autospec=True, return_value=['Dockerfile.image1', 'Dockerfile.image2'])
+    @mock.patch('tabulate.tabulate', autospec=True)
+    @mock.patch('skipper.retention.collect_remote_images', autospec=True)
+    @mock.patch('skipper.retention.collect_local_images', autospec=True, return_value=[])
+    def test_gc_local_dry_run(self, collect_local_images_mock, collect_remote_images_mock, *args):
+        result = self._invoke_cli(
+            global_params=self.global_params,
+            subcmd='gc',
+            subcmd_params=['-n', 'image2']
+        )
+        self.assertEqual(result.return_value, 0)
+        collect_local_images_mock.assert_called_once_with(('image2',), mock.ANY, True)
+        self.assertFalse(collect_remote_images_mock.called)
+
+    @mock.patch('glob.glob', autospec=True, return_value=['Dockerfile.' + IMAGE])
+    @mock.patch('requests.Session.delete', autospec=True)
+    @mock.patch('requests.Session.get', autospec=True)
     def test_rmi_remote(self, requests_get_mock, requests_delete_mock, *args):
         requests_get_mock.side_effect = [mock.Mock(headers={'Docker-Content-Digest': 'digest'})]
         requests_delete_mock.side_effect = [mock.Mock(ok=True)]
@@ -540,13 +1024,13 @@ class TestCLI(unittest.TestCase):
 
         url = 'https://%(registry)s/v2/%(image)s/manifests/%(reference)s' % dict(registry=REGISTRY, image=IMAGE, reference=TAG)
         headers = {"Accept": "application/vnd.docker.distribution.manifest.v2+json"}
-        requests_get_mock.assert_called_once_with(url=url, headers=headers, verify=False)
+        requests_get_mock.assert_called_once_with(mock.ANY, url=url, headers=headers)
         url = 'https://%(registry)s/v2/%(image)s/manifests/%(reference)s' % dict(registry=REGISTRY, image=IMAGE, reference='digest')
-        requests_delete_mock.assert_called_once_with(url=url, verify=False)
+        requests_delete_mock.assert_called_once_with(mock.ANY, url=url)
 
     @mock.patch('glob.glob', autospec=True, return_value=['Dockerfile.' + IMAGE])
-    @mock.patch('requests.delete', autospec=True)
-    @mock.patch('requests.get', autospec=True)
+    @mock.patch('requests.Session.delete', autospec=True)
+    @mock.patch('requests.Session.get', autospec=True)
     def test_rmi_remote_fail(self, requests_get_mock, requests_delete_mock, *args):
         requests_get_mock.side_effect = [mock.Mock(headers={'Docker-Content-Digest': 'digest'})]
         requests_delete_mock.side_effect = [mock.Mock(ok=False)]
@@ -555,13 +1039,25 @@ class TestCLI(unittest.TestCase):
             subcmd='rmi',
             subcmd_params=['-r', IMAGE, TAG]
         )
-        self.assertIsInstance(result.exception, Exception)
+        self.assertEqual(result.return_value, 1)
 
         url = 'https://%(registry)s/v2/%(image)s/manifests/%(reference)s' % dict(registry=REGISTRY, image=IMAGE, reference=TAG)
         headers = {"Accept": "application/vnd.docker.distribution.manifest.v2+json"}
-        requests_get_mock.assert_called_once_with(url=url, headers=headers, verify=False)
+        requests_get_mock.assert_called_once_with(mock.ANY, url=url, headers=headers)
         url = 'https://%(registry)s/v2/%(image)s/manifests/%(reference)s' % dict(registry=REGISTRY, image=IMAGE, reference='digest')
-        requests_delete_mock.assert_called_once_with(url=url, verify=False)
+        requests_delete_mock.assert_called_once_with(mock.ANY, url=url)
+
+    @mock.patch('glob.glob', autospec=True, return_value=['Dockerfile.' + IMAGE])
+    @mock.patch('tabulate.tabulate', autospec=True)
+    @mock.patch('skipper.utils.delete_images_from_registry', autospec=True, return_value=[[IMAGE, TAG, None]])
+    def test_rmi_remote_keep_shared(self, delete_images_mock, *args):
+        result = self._invoke_cli(
+            global_params=self.global_params,
+            subcmd='rmi',
+            subcmd_params=['-r', '--keep-shared', IMAGE, TAG]
+        )
+        self.assertEqual(result.return_value, 0)
+        delete_images_mock.assert_called_once_with(REGISTRY, [(IMAGE, TAG)], True)
 
     @mock.patch('glob.glob', autospec=True, return_value=['Dockerfile.' + IMAGE])
     def test_validate_project_image(self, *args):
@@ -572,7 +1068,31 @@ class TestCLI(unittest.TestCase):
         )
         self.assertIsInstance(result.exception, click.BadParameter)
 
-    @mock.patch('subprocess.check_output', autospec=True, return_value='1234567\n')
+    @mock.patch('subprocess.check_output', autospec=True, return_value=LOCAL_BUILD_CONTAINERS)
+    @mock.patch('skipper.runner.run', autospec=True)
+    @mock.patch('skipper.sharder.run_shards', autospec=True, return_value=2)
+    def test_run_shards(self, run_shards_mock, skipper_runner_run_mock, *args):
+        result = self._invoke_cli(
+            global_params=self.global_params,
+            subcmd='run',
+            subcmd_params=['--shards', '4', '--shard-files', 'tests/*.py', '--', 'pytest', '-q']
+        )
+        self.assertEqual(result.return_value, 2)
+        run_shards_mock.assert_called_once_with(['pytest', '-q'], 'build-container-image:build-container-tag', [], 4, False,
+                                                ('tests/*.py',), workdir=os.getcwd())
+        self.assertFalse(skipper_runner_run_mock.called)
+
+    @mock.patch('skipper.sharder.run_shards', autospec=True)
+    def test_run_shards_not_interactive(self, run_shards_mock, *args):
+        result = self._invoke_cli(
+            global_params=self.global_params,
+            subcmd='run',
+            subcmd_params=['-i', '--shards', '4', 'pytest']
+        )
+        self.assertIsInstance(result.exception, click.BadParameter)
+        self.assertFalse(run_shards_mock.called)
+
+    @mock.patch('subprocess.check_output', autospec=True, return_value=LOCAL_BUILD_CONTAINERS)
     @mock.patch('skipper.runner.run', autospec=True)
     def test_run_with_existing_local_build_container(self, skipper_runner_run_mock, *args):
         command = ['ls', '-l']
@@ -583,19 +1103,13 @@ class TestCLI(unittest.TestCase):
             subcmd_params=run_params
         )
         expected_image_name = 'build-container-image:build-container-tag'
-        skipper_runner_run_mock.assert_called_once_with(command, fqdn_image=expected_image_name, environment=[], interactive=False)
+        skipper_runner_run_mock.assert_called_once_with(command, fqdn_image=expected_image_name, environment=[], interactive=False,
+                                                        session_idle_timeout=None, user_image=False, workdir=os.getcwd())
 
     @mock.patch('subprocess.check_output', autospec=True, return_value='')
-    @mock.patch('requests.get', autospec=True)
+    @mock.patch('requests.Session.head', autospec=True, return_value=mock.Mock(ok=True, status_code=200))
     @mock.patch('skipper.runner.run', autospec=True)
-    def test_run_with_existing_remote_build_container(self, skipper_runner_run_mock, requests_get_mock, *args):
-        requests_response_class_mock = mock.MagicMock(spec='requests.Response')
-        requests_response_mock = requests_response_class_mock.return_value
-        requests_response_mock.json.return_value = {
-            'name': 'my_image',
-            'tags': ['latest', 'aaaaaaa', 'bbbbbbb', 'build-container-tag']
-        }
-        requests_get_mock.return_value = requests_response_mock
+    def test_run_with_existing_remote_build_container(self, skipper_runner_run_mock, requests_head_mock, *args):
 
         command = ['ls', '-l']
         run_params = command
@@ -605,20 +1119,13 @@ class TestCLI(unittest.TestCase):
             subcmd_params=run_params
         )
         expected_image_name = 'registry.io:5000/build-container-image:build-container-tag'
-        skipper_runner_run_mock.assert_called_once_with(command, fqdn_image=expected_image_name, environment=[], interactive=False)
+        skipper_runner_run_mock.assert_called_once_with(command, fqdn_image=expected_image_name, environment=[], interactive=False,
+                                                        session_idle_timeout=None, user_image=False, workdir=os.getcwd())
 
     @mock.patch('subprocess.check_output', autospec=True, return_value='')
-    @mock.patch('requests.get', autospec=True)
+    @mock.patch('requests.Session.head', autospec=True, return_value=mock.Mock(ok=False, status_code=404))
     @mock.patch('skipper.runner.run', autospec=True)
-    def test_run_with_non_existing_build_container(self, skipper_runner_run_mock, requests_get_mock, *args):
-        requests_response_class_mock = mock.MagicMock(spec='requests.Response')
-        requests_response_mock = requests_response_class_mock.return_value
-        requests_response_mock.json.return_value = {
-            'name': 'my_image',
-            'tags': ['latest', 'aaaaaaa', 'bbbbbbb']
-        }
-
-        requests_get_mock.return_value = requests_response_mock
+    def test_run_with_non_existing_build_container(self, skipper_runner_run_mock, requests_head_mock, *args):
         command = ['ls', '-l']
         run_params = command
         ret = self._invoke_cli(
@@ -628,10 +1135,10 @@ class TestCLI(unittest.TestCase):
         )
         self.assertIsInstance(ret.exception, click.exceptions.ClickException)
 
-    @mock.patch('__builtin__.open', create=True)
-    @mock.patch('os.path.exists', autospec=True, return_value=True)
-    @mock.patch('yaml.load', autospec=True, return_value=SKIPPER_CONF)
-    @mock.patch('subprocess.check_output', autospec=True, return_value='1234567\n')
+    @mock.patch('skipper.config.find_config_file', autospec=True, return_value=CONFIG_FILE)
+    @mock.patch('skipper.config._stat', autospec=True, return_value=None)
+    @mock.patch('skipper.config._load_yaml', autospec=True, return_value=SKIPPER_CONF)
+    @mock.patch('subprocess.check_output', autospec=True, return_value=LOCAL_BUILD_CONTAINERS)
     @mock.patch('skipper.runner.run', autospec=True)
     def test_run_with_defaults_from_config_file(self, skipper_runner_run_mock, *args):
         command = ['ls', '-l']
@@ -642,12 +1149,13 @@ class TestCLI(unittest.TestCase):
             subcmd_params=run_params
         )
         expected_fqdn_image = 'skipper-conf-build-container-image:skipper-conf-build-container-tag'
-        skipper_runner_run_mock.assert_called_once_with(command, fqdn_image=expected_fqdn_image, environment=[], interactive=False)
+        skipper_runner_run_mock.assert_called_once_with(command, fqdn_image=expected_fqdn_image, environment=[], interactive=False,
+                                                        session_idle_timeout=None, user_image=False, workdir=os.getcwd())
 
-    @mock.patch('__builtin__.open', create=True)
-    @mock.patch('os.path.exists', autospec=True, return_value=True)
-    @mock.patch('yaml.load', autospec=True, return_value=SKIPPER_CONF_WITH_ENV)
-    @mock.patch('subprocess.check_output', autospec=True, return_value='1234567\n')
+    @mock.patch('skipper.config.find_config_file', autospec=True, return_value=CONFIG_FILE)
+    @mock.patch('skipper.config._stat', autospec=True, return_value=None)
+    @mock.patch('skipper.config._load_yaml', autospec=True, return_value=SKIPPER_CONF_WITH_ENV)
+    @mock.patch('subprocess.check_output', autospec=True, return_value=LOCAL_BUILD_CONTAINERS)
     @mock.patch('skipper.runner.run', autospec=True)
     def test_run_with_defaults_and_env_from_config_file(self, skipper_runner_run_mock, *args):
         command = ['ls', '-l']
@@ -660,12 +1168,13 @@ class TestCLI(unittest.TestCase):
         )
         env = ["%s=%s" % (key, value) for key, value in CONFIG_ENV_EVALUATION.iteritems()]
         expected_fqdn_image = 'skipper-conf-build-container-image:skipper-conf-build-container-tag'
-        skipper_runner_run_mock.assert_called_once_with(command, fqdn_image=expected_fqdn_image, environment=env, interactive=False)
+        skipper_runner_run_mock.assert_called_once_with(command, fqdn_image=expected_fqdn_image, environment=env, interactive=False,
+                                                        session_idle_timeout=None, user_image=False, workdir=os.getcwd())
 
-    @mock.patch('__builtin__.open', create=True)
-    @mock.patch('os.path.exists', autospec=True, return_value=True)
-    @mock.patch('yaml.load', autospec=True, return_value=SKIPPER_CONF_WITH_ENV)
-    @mock.patch('subprocess.check_output', autospec=True, return_value='1234567\n')
+    @mock.patch('skipper.config.find_config_file', autospec=True, return_value=CONFIG_FILE)
+    @mock.patch('skipper.config._stat', autospec=True, return_value=None)
+    @mock.patch('skipper.config._load_yaml', autospec=True, return_value=SKIPPER_CONF_WITH_ENV)
+    @mock.patch('subprocess.check_output', autospec=True, return_value=LOCAL_BUILD_CONTAINERS)
     @mock.patch('skipper.runner.run', autospec=True)
     def test_run_with_env_overriding_config_file(self, skipper_runner_run_mock, *args):
         os.environ['VAL4'] = "val4-evaluation"
@@ -678,9 +1187,10 @@ class TestCLI(unittest.TestCase):
         )
         env = ["%s=%s" % (key, value) for key, value in CONFIG_ENV_EVALUATION.iteritems()] + ENV
         expected_fqdn_image = 'skipper-conf-build-container-image:skipper-conf-build-container-tag'
-        skipper_runner_run_mock.assert_called_once_with(command, fqdn_image=expected_fqdn_image, environment=env, interactive=False)
+        skipper_runner_run_mock.assert_called_once_with(command, fqdn_image=expected_fqdn_image, environment=env, interactive=False,
+                                                        session_idle_timeout=None, user_image=False, workdir=os.getcwd())
 
-    @mock.patch('subprocess.check_output', autospec=True, return_value='1234567\n')
+    @mock.patch('subprocess.check_output', autospec=True, return_value=LOCAL_BUILD_CONTAINERS)
     @mock.patch('skipper.runner.run', autospec=True)
     def test_run_with_env(self, skipper_runner_run_mock, *args):
         command = ['ls', '-l']
@@ -692,9 +1202,10 @@ class TestCLI(unittest.TestCase):
             subcmd_params=run_params
         )
         expected_fqdn_image = 'build-container-image:build-container-tag'
-        skipper_runner_run_mock.assert_called_once_with(command, fqdn_image=expected_fqdn_image, environment=ENV, interactive=False)
+        skipper_runner_run_mock.assert_called_once_with(command, fqdn_image=expected_fqdn_image, environment=ENV, interactive=False,
+                                                        session_idle_timeout=None, user_image=False, workdir=os.getcwd())
 
-    @mock.patch('subprocess.check_output', autospec=True, return_value='1234567\n')
+    @mock.patch('subprocess.check_output', autospec=True, return_value=LOCAL_BUILD_CONTAINERS)
     @mock.patch('skipper.runner.run', autospec=True)
     def test_run_non_interactive(self, skipper_runner_run_mock, *args):
         command = ['ls', '-l']
@@ -705,7 +1216,34 @@ class TestCLI(unittest.TestCase):
             subcmd_params=run_params
         )
         expected_fqdn_image = 'build-container-image:build-container-tag'
-        skipper_runner_run_mock.assert_called_once_with(command, fqdn_image=expected_fqdn_image, environment=[], interactive=True)
+        skipper_runner_run_mock.assert_called_once_with(command, fqdn_image=expected_fqdn_image, environment=[], interactive=True,
+                                                        session_idle_timeout=None, user_image=False, workdir=os.getcwd())
+
+    @mock.patch('subprocess.check_output', autospec=True, return_value=LOCAL_BUILD_CONTAINERS)
+    @mock.patch('skipper.runner.run', autospec=True)
+    def test_run_in_session(self, skipper_runner_run_mock, *args):
+        command = ['ls', '-l']
+        self._invoke_cli(
+            global_params=['--session', '--session-idle-timeout', '60'] + self.global_params,
+            subcmd='run',
+            subcmd_params=command
+        )
+        expected_fqdn_image = 'build-container-image:build-container-tag'
+        skipper_runner_run_mock.assert_called_once_with(command, fqdn_image=expected_fqdn_image, environment=[], interactive=False,
+                                                        session_idle_timeout=60, user_image=False, workdir=os.getcwd())
+
+    @mock.patch('subprocess.check_output', autospec=True, return_value=LOCAL_BUILD_CONTAINERS)
+    @mock.patch('skipper.runner.run', autospec=True)
+    def test_run_in_user_image(self, skipper_runner_run_mock, *args):
+        command = ['ls', '-l']
+        self._invoke_cli(
+            global_params=['--user-image'] + self.global_params,
+            subcmd='run',
+            subcmd_params=command
+        )
+        expected_fqdn_image = 'build-container-image:build-container-tag'
+        skipper_runner_run_mock.assert_called_once_with(command, fqdn_image=expected_fqdn_image, environment=[], interactive=False,
+                                                        session_idle_timeout=None, user_image=True, workdir=os.getcwd())
 
     @mock.patch('subprocess.check_output', autospec=True, return_value='')
     @mock.patch('skipper.runner.run', autospec=True)
@@ -720,11 +1258,12 @@ class TestCLI(unittest.TestCase):
         )
         expected_commands = [
             mock.call(['docker', 'build', '-t', 'build-container-image', '-f', 'Dockerfile.build-container-image', '.']),
-            mock.call(command, fqdn_image='build-container-image', environment=[], interactive=False),
+            mock.call(command, fqdn_image='build-container-image', environment=[], interactive=False, session_idle_timeout=None,
+                      user_image=False, workdir=os.getcwd()),
         ]
         skipper_runner_run_mock.assert_has_calls(expected_commands)
 
-    @mock.patch('subprocess.check_output', autospec=True, return_value='1234567\n')
+    @mock.patch('subprocess.check_output', autospec=True, return_value=LOCAL_BUILD_CONTAINERS)
     @mock.patch('skipper.runner.run', autospec=True)
     def test_make(self, skipper_runner_run_mock, *args):
         makefile = 'Makefile'
@@ -737,12 +1276,50 @@ class TestCLI(unittest.TestCase):
         )
         expected_command = ['make', '-f', makefile, target]
         expected_fqdn_image = 'build-container-image:build-container-tag'
-        skipper_runner_run_mock.assert_called_once_with(expected_command, fqdn_image=expected_fqdn_image, environment=[], interactive=False)
+        skipper_runner_run_mock.assert_called_once_with(expected_command, fqdn_image=expected_fqdn_image, environment=[], interactive=False,
+                                                        session_idle_timeout=None, user_image=False)
 
-    @mock.patch('__builtin__.open', create=True)
-    @mock.patch('os.path.exists', autospec=True, return_value=True)
-    @mock.patch('yaml.load', autospec=True, return_value=SKIPPER_CONF)
-    @mock.patch('subprocess.check_output', autospec=True, return_value='1234567\n')
+    @mock.patch('subprocess.check_output', autospec=True, return_value=LOCAL_BUILD_CONTAINERS)
+    @mock.patch('skipper.runner.run', autospec=True)
+    def test_make_multiple_targets(self, skipper_runner_run_mock, *args):
+        self._invoke_cli(
+            global_params=self.global_params,
+            subcmd='make',
+            subcmd_params=['lint', 'unit']
+        )
+        skipper_runner_run_mock.assert_called_once_with(['make', '-f', 'Makefile', 'lint', 'unit'],
+                                                        fqdn_image='build-container-image:build-container-tag', environment=[],
+                                                        interactive=False, session_idle_timeout=None, user_image=False)
+
+    @mock.patch('subprocess.check_output', autospec=True, return_value=LOCAL_BUILD_CONTAINERS)
+    @mock.patch('tabulate.tabulate', autospec=True)
+    @mock.patch('skipper.maker.make_targets', autospec=True)
+    def test_make_parallel(self, make_targets_mock, tabulate_mock, *args):
+        make_targets_mock.return_value = (1, [['lint', 'passed', 0, 1.5], ['unit', 'failed', 2, 3.0]])
+        result = self._invoke_cli(
+            global_params=self.global_params,
+            subcmd='make',
+            subcmd_params=['-P', '2', '-e', 'KEY=VAL', 'lint', 'unit']
+        )
+        self.assertEqual(result.return_value, 1)
+        make_targets_mock.assert_called_once_with(['lint', 'unit'], 'Makefile', 'build-container-image:build-container-tag',
+                                                  ['KEY=VAL'], 2, False)
+        self.assertEqual(tabulate_mock.call_args[0][0], [['lint', 'passed', 0, 1.5], ['unit', 'failed', 2, 3.0]])
+
+    @mock.patch('skipper.maker.make_targets', autospec=True)
+    def test_make_parallel_not_interactive(self, make_targets_mock, *args):
+        result = self._invoke_cli(
+            global_params=self.global_params,
+            subcmd='make',
+            subcmd_params=['-i', '-P', '2', 'lint', 'unit']
+        )
+        self.assertIsInstance(result.exception, click.BadParameter)
+        self.assertFalse(make_targets_mock.called)
+
+    @mock.patch('skipper.config.find_config_file', autospec=True, return_value=CONFIG_FILE)
+    @mock.patch('skipper.config._stat', autospec=True, return_value=None)
+    @mock.patch('skipper.config._load_yaml', autospec=True, return_value=SKIPPER_CONF)
+    @mock.patch('subprocess.check_output', autospec=True, return_value=LOCAL_BUILD_CONTAINERS)
     @mock.patch('skipper.runner.run', autospec=True)
     def test_make_with_defaults_from_config_file(self, skipper_runner_run_mock, *args):
         makefile = 'Makefile'
@@ -755,7 +1332,43 @@ class TestCLI(unittest.TestCase):
         )
         expected_command = ['make', '-f', makefile, target]
         expected_fqdn_image = 'skipper-conf-build-container-image:skipper-conf-build-container-tag'
-        skipper_runner_run_mock.assert_called_once_with(expected_command, fqdn_image=expected_fqdn_image, environment=[], interactive=False)
+        skipper_runner_run_mock.assert_called_once_with(expected_command, fqdn_image=expected_fqdn_image, environment=[], interactive=False,
+                                                        session_idle_timeout=None, user_image=False)
+
+    @mock.patch('subprocess.check_output', autospec=True, return_value=LOCAL_BUILD_CONTAINERS)
+    @mock.patch('skipper.runner.run', autospec=True)
+    def test_make_from_subdirectory(self, skipper_runner_run_mock, *args):
+        subdirectory = os.path.join(os.getcwd(), 'sub')
+        with mock.patch('skipper.config._invocation_dir', subdirectory):
+            self._invoke_cli(global_params=self.global_params, subcmd='make', subcmd_params=['-f', 'other/Makefile', 'all'])
+            self._invoke_cli(global_params=self.global_params, subcmd='make', subcmd_params=['all'])
+        # Make runs in the project directory, with the default Makefile of the project
+        self.assertEqual([call[0][0] for call in skipper_runner_run_mock.call_args_list],
+                         [['make', '-f', os.path.join(subdirectory, 'other', 'Makefile'), 'all'], ['make', '-f', 'Makefile', 'all']])
+
+    @mock.patch('skipper.tracing.configure', autospec=True)
+    @mock.patch('subprocess.check_output', autospec=True, return_value=LOCAL_BUILD_CONTAINERS)
+    @mock.patch('skipper.runner.run', autospec=True)
+    def test_run_from_subdirectory(self, skipper_runner_run_mock, check_output_mock, tracing_configure_mock):
+        subdirectory = os.path.join(os.getcwd(), 'sub')
+        with mock.patch('skipper.config._invocation_dir', subdirectory):
+            self._invoke_cli(global_params=self.global_params + ['--trace', 'trace.json'], subcmd='run', subcmd_params=['./script.sh'])
+        tracing_configure_mock.assert_called_once_with(os.path.join(subdirectory, 'trace.json'))
+        self.assertEqual(skipper_runner_run_mock.call_args[0][0], ['./script.sh'])
+        self.assertEqual(skipper_runner_run_mock.call_args[1]['workdir'], subdirectory)
+
+    @unittest.skipUnless(hasattr(click.Context, 'get_parameter_source'), 'requires click 8')
+    @mock.patch('skipper.tracing.configure', autospec=True)
+    @mock.patch('subprocess.check_output', autospec=True, return_value=LOCAL_BUILD_CONTAINERS)
+    @mock.patch('skipper.runner.run', autospec=True)
+    def test_typed_path_equal_to_default_from_subdirectory(self, skipper_runner_run_mock, check_output_mock, tracing_configure_mock):
+        subdirectory = os.path.join(os.getcwd(), 'sub')
+        with mock.patch('skipper.config._invocation_dir', subdirectory):
+            self._invoke_cli(defaults=dict(trace='trace.json'), global_params=self.global_params + ['--trace', 'trace.json'],
+                             subcmd='run', subcmd_params=['true'])
+            self._invoke_cli(defaults=dict(trace='trace.json'), global_params=self.global_params, subcmd='run', subcmd_params=['true'])
+        self.assertEqual(tracing_configure_mock.call_args_list, [mock.call(os.path.join(subdirectory, 'trace.json')),
+                                                                 mock.call('trace.json')])
 
     @mock.patch('subprocess.check_output', autospec=True, return_value='')
     @mock.patch('skipper.runner.run', autospec=True)
@@ -771,11 +1384,12 @@ class TestCLI(unittest.TestCase):
         )
         expected_commands = [
             mock.call(['docker', 'build', '-t', 'build-container-image', '-f', 'Dockerfile.build-container-image', '.']),
-            mock.call(['make'] + make_params, fqdn_image='build-container-image', environment=[], interactive=False),
+            mock.call(['make'] + make_params, fqdn_image='build-container-image', environment=[], interactive=False,
+                      session_idle_timeout=None, user_image=False),
         ]
         skipper_runner_run_mock.assert_has_calls(expected_commands)
 
-    @mock.patch('subprocess.check_output', autospec=True, return_value='1234567\n')
+    @mock.patch('subprocess.check_output', autospec=True, return_value=LOCAL_BUILD_CONTAINERS)
     @mock.patch('skipper.runner.run', autospec=True)
     def test_shell(self, skipper_runner_run_mock, *args):
         self._invoke_cli(
@@ -783,7 +1397,12 @@ class TestCLI(unittest.TestCase):
             subcmd='shell',
         )
         expected_fqdn_image = 'build-container-image:build-container-tag'
-        skipper_runner_run_mock.assert_called_once_with(['bash'], fqdn_image=expected_fqdn_image, environment=[], interactive=True)
+        skipper_runner_run_mock.assert_called_once_with(['bash'], fqdn_image=expected_fqdn_image, environment=[], interactive=True,
+                                                        session_idle_timeout=None, user_image=False, workdir=os.getcwd())
+
+    @staticmethod
+    def _get_output_lines(result):
+        return [line for line in result.output.splitlines() if line and not line.startswith('[skipper]')]
 
     def _invoke_cli(self, defaults=None, global_params=None, subcmd=None, subcmd_params=None):
         self.assertFalse(subcmd is None and subcmd_params is not None, 'No sub-command was provided!')
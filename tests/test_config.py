@@ -0,0 +1,97 @@
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+import yaml
+from skipper import config
+
+
+SKIPPER_CONF = '''registry: registry.io:5000
+build-container-image: $IMAGE_NAME
+session: true
+make:
+    makefile: Makefile.skipper
+env:
+    KEY1: ${VAL1}
+    KEY2: $$VAL2
+'''
+
+
+class TestConfig(unittest.TestCase):
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._workdir = tempfile.mkdtemp()
+        self._project_dir = os.path.join(self._workdir, 'project')
+        os.makedirs(os.path.join(self._project_dir, 'src', 'module'))
+        self._write_config(SKIPPER_CONF)
+        os.chdir(os.path.join(self._project_dir, 'src', 'module'))
+        self._environ_patch = mock.patch.dict(os.environ, {'IMAGE_NAME': 'build-image', 'VAL1': 'val1',
+                                                           'XDG_CACHE_HOME': os.path.join(self._workdir, 'cache')})
+        self._environ_patch.start()
+
+    def tearDown(self):
+        self._environ_patch.stop()
+        os.chdir(self._cwd)
+        shutil.rmtree(self._workdir)
+        config._invocation_dir = None
+
+    def test_find_config_file_in_parent_directory(self):
+        self.assertEqual(config.find_config_file(), os.path.join(self._project_dir, 'skipper.yaml'))
+        os.chdir(self._workdir)
+        self.assertIsNone(config.find_config_file())
+
+    def test_find_config_file_stops_at_project_with_dockerfiles(self):
+        open(os.path.join(self._project_dir, 'src', 'Dockerfile.module'), 'w').close()
+        self.assertIsNone(config.find_config_file())
+
+    def test_change_to_project_dir(self):
+        module_dir = os.path.realpath(os.getcwd())
+        config.change_to_project_dir()
+        self.assertEqual(os.path.realpath(os.getcwd()), os.path.realpath(self._project_dir))
+        self.assertEqual(os.path.realpath(config.get_invocation_dir()), module_dir)
+        self.assertEqual(os.path.realpath(config.resolve_path('out/trace.json')), os.path.join(module_dir, 'out', 'trace.json'))
+        self.assertEqual(config.resolve_path('/tmp/trace.json'), '/tmp/trace.json')
+
+    def test_resolve_path_in_project_dir(self):
+        os.chdir(self._project_dir)
+        config.change_to_project_dir()
+        self.assertEqual(config.resolve_path('trace.json'), 'trace.json')
+
+    def test_load_defaults(self):
+        self.assertEqual(config.load_defaults(), {
+            'registry': 'registry.io:5000',
+            'build_container_image': 'build-image',
+            'session': True,
+            'make': {'makefile': 'Makefile.skipper'},
+            'env': {'KEY1': 'val1', 'KEY2': '$VAL2'},
+        })
+
+    @mock.patch('yaml.load', autospec=True, side_effect=yaml.load)
+    def test_load_defaults_is_cached(self, yaml_load_mock):
+        defaults = config.load_defaults()
+        self.assertEqual(config.load_defaults(), defaults)
+        self.assertEqual(yaml_load_mock.call_count, 1)
+        self.assertTrue(os.listdir(os.path.join(self._workdir, 'cache', 'skipper', config.CACHE_SUBDIR)))
+
+    @mock.patch('yaml.load', autospec=True, side_effect=yaml.load)
+    def test_changed_environment_variable_invalidates_cache(self, yaml_load_mock):
+        config.load_defaults()
+        os.environ['VAL1'] = 'other-val1'
+        self.assertEqual(config.load_defaults()['env']['KEY1'], 'other-val1')
+        os.environ['UNRELATED'] = 'value'
+        config.load_defaults()
+        self.assertEqual(yaml_load_mock.call_count, 2)
+
+    def test_changed_file_invalidates_cache(self):
+        config.load_defaults()
+        self._write_config(SKIPPER_CONF.replace('registry.io:5000', 'other-registry.io'))
+        self.assertEqual(config.load_defaults()['registry'], 'other-registry.io')
+
+    def _write_config(self, content):
+        skipper_conf = os.path.join(self._project_dir, 'skipper.yaml')
+        mtime = os.stat(skipper_conf).st_mtime + 1 if os.path.exists(skipper_conf) else None
+        with open(skipper_conf, 'w') as confile:
+            confile.write(content)
+        if mtime is not None:
+            os.utime(skipper_conf, (mtime, mtime))
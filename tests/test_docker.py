@@ -0,0 +1,289 @@
+import base64
+import io
+import json
+import mock
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from skipper import docker
+
+try:
+    import socketserver
+    from http import server as http_server
+except ImportError:  # Python 2
+    import SocketServer as socketserver
+    import BaseHTTPServer as http_server
+
+
+IMAGES = [
+    {'Id': 'sha256:aaa', 'RepoTags': ['image1:latest', 'registry.io:5000/image1:1234567'], 'RepoDigests': ['image1@sha256:ddd']},
+    {'Id': 'sha256:bbb', 'RepoTags': ['<none>:<none>'], 'RepoDigests': None},
+]
+
+VOLUMES = [
+    {'Name': 'volume1', 'Labels': {'skipper.cache': 'pip'}, 'UsageData': {'Size': 2048, 'RefCount': 0}},
+    {'Name': 'volume2', 'Labels': {'skipper.cache': 'ccache'}, 'UsageData': {'Size': -1, 'RefCount': 1}},
+    {'Name': 'volume3', 'Labels': None, 'UsageData': {'Size': 10, 'RefCount': 0}},
+]
+
+
+class FakeEngineAPIHandler(http_server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        self._record()
+        if self.path == '/v1.24/images/json':
+            self._send_json(200, IMAGES)
+        elif self.path == '/v1.24/images/image1:latest/json':
+            self._send_json(200, IMAGES[0])
+        elif self.path == '/v1.24/system/df':
+            self._send_json(200, {'Volumes': VOLUMES})
+        else:
+            self._send_json(404, {'message': 'No such image'})
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        self._record()
+        if self.path.startswith('/v1.24/images/image1:latest/tag'):
+            self._send_json(201, None)
+        elif self.path.startswith('/v1.24/images/registry.io:5000/image1/push'):
+            self._send_stream([{'status': 'Pushing', 'id': 'layer1', 'progressDetail': {'current': 512, 'total': 1024}},
+                               {'status': 'Pushing', 'id': 'layer1', 'progressDetail': {'current': 1024, 'total': 1024}},
+                               {'status': 'Layer already exists', 'id': 'layer2', 'progressDetail': {}},
+                               {'aux': {'Tag': '1234567', 'Digest': 'sha256:eee', 'Size': 525}}])
+        elif self.path.startswith('/v1.24/images/registry.io:5000/broken/push'):
+            self._send_stream([{'status': 'Pushing', 'id': 'layer'}, {'error': 'denied: requested access to the resource is denied'}])
+        else:
+            self._send_json(404, {'message': 'No such image'})
+
+    def do_DELETE(self):  # pylint: disable=invalid-name
+        self._record()
+        if self.path == '/v1.24/images/image1:latest':
+            self._send_json(200, [{'Untagged': 'image1:latest'}])
+        elif self.path == '/v1.24/volumes/volume1':
+            self._send_json(204, None)
+        elif self.path.startswith('/v1.24/volumes/'):
+            self._send_json(409, {'message': 'volume is in use'})
+        else:
+            self._send_json(409, {'message': 'conflict: unable to remove repository reference'})
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+    def _record(self):
+        body = b''
+        if self.headers.get('Content-Length'):
+            body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.requests.append((self.command, self.path, dict(self.headers.items()), body))
+        self.server.connections.add(id(self.connection))
+
+    def _send_json(self, status, content):
+        body = json.dumps(content).encode('utf-8') if content is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_stream(self, events):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for event in events:
+            line = json.dumps(event).encode('utf-8') + b'\r\n'
+            self.wfile.write(('%x\r\n' % len(line)).encode('ascii') + line + b'\r\n')
+        self.wfile.write(b'0\r\n\r\n')
+
+
+class FakeEngineAPIServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path):
+        socketserver.UnixStreamServer.__init__(self, socket_path, FakeEngineAPIHandler)
+        self.requests = []
+        self.connections = set()
+
+
+class TestEngineAPIBackend(unittest.TestCase):
+    def setUp(self):
+        self._tempdir = tempfile.mkdtemp()
+        self._socket_path = os.path.join(self._tempdir, 'docker.sock')
+        self._server = FakeEngineAPIServer(self._socket_path)
+        self._server_thread = threading.Thread(target=self._server.serve_forever, args=(0.05,))
+        self._server_thread.daemon = True
+        self._server_thread.start()
+        self._backend = docker.configure_backend('auto', self._socket_path)
+
+    def tearDown(self):
+        self._server.shutdown()
+        self._server.server_close()
+        shutil.rmtree(self._tempdir)
+        docker.configure_backend('cli')
+
+    def test_auto_selects_engine_api_when_socket_exists(self):
+        self.assertEqual(self._backend.name, 'api')
+        self.assertEqual(docker.configure_backend('auto', os.path.join(self._tempdir, 'missing.sock')).name, 'cli')
+
+    def test_list_images(self):
+        self.assertEqual(self._backend.list_images(), [
+            dict(name='image1', tag='latest', id='sha256:aaa', digests=['image1@sha256:ddd']),
+            dict(name='registry.io:5000/image1', tag='1234567', id='sha256:aaa', digests=['image1@sha256:ddd']),
+        ])
+
+    def test_requests_share_one_connection(self):
+        self._backend.list_images()
+        self._backend.inspect_image('image1:latest')
+        self._backend.tag_image('image1:latest', 'registry.io:5000/image1:1234567')
+        self.assertEqual(len(self._server.requests), 3)
+        self.assertEqual(len(self._server.connections), 1)
+
+    def test_inspect_image(self):
+        self.assertEqual(self._backend.inspect_image('image1:latest'), dict(id='sha256:aaa', digests=['image1@sha256:ddd']))
+        self.assertRaises(docker.DockerError, self._backend.inspect_image, 'missing')
+
+    def test_tag_image(self):
+        self.assertEqual(self._backend.tag_image('image1:latest', 'registry.io:5000/image1:1234567'), 0)
+        self.assertEqual(self._server.requests[-1][1], '/v1.24/images/image1:latest/tag?repo=registry.io%3A5000%2Fimage1&tag=1234567')
+
+    @mock.patch('skipper.docker.DOCKER_CONFIG_PATH', '/nonexistent/config.json')
+    def test_push_image(self):
+        self.assertEqual(self._backend.push_image('registry.io:5000/image1:1234567'), dict(returncode=0, size=1024, digest='sha256:eee'))
+        self.assertIn('X-Registry-Auth', self._server.requests[-1][2])
+        self.assertEqual(self._backend.push_image('registry.io:5000/broken:1234567')['returncode'], 1)
+
+    @mock.patch('skipper.docker.DOCKER_CONFIG_PATH', '/nonexistent/config.json')
+    def test_push_image_events(self):
+        events = list(self._backend.push_image_events('registry.io:5000/image1', '1234567', {}))
+        self.assertEqual(events[-1]['aux'], {'Tag': '1234567', 'Digest': 'sha256:eee', 'Size': 525})
+
+    def test_remove_image(self):
+        self.assertEqual(self._backend.remove_image('image1:latest'), 0)
+        self.assertEqual(self._backend.remove_image('image2:latest'), 1)
+
+    def test_remove_images(self):
+        self.assertEqual(self._backend.remove_images(['image2:latest', 'image1:latest']), 1)
+        self.assertEqual([request[1] for request in self._server.requests], ['/v1.24/images/image2:latest', '/v1.24/images/image1:latest'])
+        self.assertEqual(len(self._server.connections), 1)
+        self.assertEqual(self._backend.remove_images(['image1:latest']), 0)
+
+    def test_list_volumes(self):
+        self.assertEqual(self._backend.list_volumes('skipper.cache'),
+                         [dict(name='volume1', labels={'skipper.cache': 'pip'}, size=2048),
+                          dict(name='volume2', labels={'skipper.cache': 'ccache'}, size=None)])
+
+    def test_remove_volume(self):
+        self.assertEqual(self._backend.remove_volume('volume1'), 0)
+        self.assertEqual(self._backend.remove_volume('volume2'), 1)
+        self.assertEqual(self._server.requests[-1][:2], ('DELETE', '/v1.24/volumes/volume2'))
+
+
+class TestCLIBackend(unittest.TestCase):
+    @mock.patch('subprocess.check_output', autospec=True, return_value='{"name": "image1", "tag": "latest"}\n')
+    def test_list_images(self, check_output_mock):
+        self.assertEqual(docker.CLIBackend().list_images(), [dict(name='image1', tag='latest')])
+        check_output_mock.assert_called_once_with(['docker', 'images', '--format', docker.LOCAL_IMAGES_FORMAT])
+
+    @mock.patch('skipper.runner.run', autospec=True, return_value=0)
+    def test_push_image(self, runner_run_mock):
+        self.assertEqual(docker.CLIBackend().push_image('registry.io:5000/image1:1234567'), dict(returncode=0, size=None, digest=None))
+        runner_run_mock.assert_called_once_with(['docker', 'push', 'registry.io:5000/image1:1234567'])
+
+    @mock.patch('sys.stdout', new_callable=io.BytesIO)
+    @mock.patch('skipper.runner.Process', autospec=True)
+    def test_push_image_capture_output(self, process_mock, stdout_mock):
+        def process(command, on_output):
+            on_output(b'The push refers to repository\n')
+            on_output(b'1234567: digest: sha256:eee\n')
+            return mock.Mock(**{'wait.return_value': 0})
+        process_mock.side_effect = process
+        result = docker.CLIBackend().push_image('registry.io:5000/image1:1234567', capture_output=True)
+        self.assertEqual(result, dict(returncode=0, size=None, digest=None))
+        self.assertEqual(process_mock.call_args[0][0], ['docker', 'push', 'registry.io:5000/image1:1234567'])
+        self.assertEqual(stdout_mock.getvalue(), b'The push refers to repository\n1234567: digest: sha256:eee\n')
+
+    @mock.patch('skipper.runner.run', autospec=True, return_value=1)
+    def test_remove_images(self, runner_run_mock):
+        self.assertEqual(docker.CLIBackend().remove_images(['image1:latest', 'image2:latest']), 1)
+        runner_run_mock.assert_called_once_with(['docker', 'rmi', 'image1:latest', 'image2:latest'])
+
+    @mock.patch('subprocess.check_output', autospec=True)
+    def test_list_volumes(self, check_output_mock):
+        check_output_mock.side_effect = [b'volume1\nvolume2\n',
+                                         b'[{"Name": "volume1", "Labels": {"skipper.cache": "pip"}}, {"Name": "volume2", "Labels": null}]']
+        self.assertEqual(docker.CLIBackend().list_volumes('skipper.cache'),
+                         [dict(name='volume1', labels={'skipper.cache': 'pip'}, size=None), dict(name='volume2', labels={}, size=None)])
+        check_output_mock.assert_has_calls([mock.call(['docker', 'volume', 'ls', '-q', '--filter', 'label=skipper.cache']),
+                                            mock.call(['docker', 'volume', 'inspect', 'volume1', 'volume2'])])
+
+    @mock.patch('subprocess.check_output', autospec=True, return_value=b'')
+    def test_list_no_volumes(self, check_output_mock):
+        self.assertEqual(docker.CLIBackend().list_volumes('skipper.cache'), [])
+        self.assertEqual(check_output_mock.call_count, 1)
+
+
+class TestRegistryAuth(unittest.TestCase):
+    def setUp(self):
+        self._tempdir = tempfile.mkdtemp()
+        self._config_path = os.path.join(self._tempdir, 'config.json')
+        patcher = mock.patch('skipper.docker.DOCKER_CONFIG_PATH', self._config_path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self._tempdir)
+
+    def test_inline_credentials(self):
+        auth = base64.b64encode(b'user:secret').decode('ascii')
+        self._write_config({'auths': {'https://registry.io:5000': {'auth': auth}}})
+        self.assertEqual(self._get_auth('registry.io:5000/image1'),
+                         dict(username='user', password='secret', serveraddress='registry.io:5000'))
+        self.assertEqual(self._get_auth('other.io/image1'), {})
+
+    def test_docker_hub_credentials(self):
+        auth = base64.b64encode(b'user:secret').decode('ascii')
+        self._write_config({'auths': {docker.DOCKER_HUB_AUTH_KEY: {'auth': auth}}})
+        self.assertEqual(self._get_auth('library/centos'),
+                         dict(username='user', password='secret', serveraddress=docker.DOCKER_HUB_AUTH_KEY))
+
+    @mock.patch('subprocess.Popen', autospec=False)
+    def test_credential_helper(self, popen_mock):
+        self._write_config({'credsStore': 'desktop', 'credHelpers': {'123.dkr.ecr.amazonaws.com': 'ecr-login'}, 'auths': {}})
+        popen_mock.return_value.returncode = 0
+        popen_mock.return_value.communicate.return_value = (b'{"Username": "AWS", "Secret": "token"}', b'')
+        self.assertEqual(self._get_auth('123.dkr.ecr.amazonaws.com/image1'),
+                         dict(username='AWS', password='token', serveraddress='123.dkr.ecr.amazonaws.com'))
+        self.assertEqual(popen_mock.call_args[0][0], ['docker-credential-ecr-login', 'get'])
+        popen_mock.return_value.communicate.assert_called_with(b'123.dkr.ecr.amazonaws.com')
+
+        popen_mock.return_value.communicate.return_value = (b'{"Username": "<token>", "Secret": "refresh"}', b'')
+        self.assertEqual(self._get_auth('registry.io:5000/image1'), dict(identitytoken='refresh', serveraddress='registry.io:5000'))
+        self.assertEqual(popen_mock.call_args[0][0], ['docker-credential-desktop', 'get'])
+
+    @mock.patch('subprocess.Popen', autospec=False, side_effect=OSError(2, 'No such file or directory'))
+    def test_missing_credential_helper(self, *args):
+        self._write_config({'credsStore': 'desktop'})
+        self.assertEqual(self._get_auth('registry.io:5000/image1'), {})
+
+    def test_parse_repo_tag(self):
+        self.assertEqual(docker._parse_repo_tag('registry.io:5000/image1:1234567'), ('registry.io:5000/image1', '1234567'))
+        self.assertEqual(docker._parse_repo_tag('registry.io:5000/image1'), ('registry.io:5000/image1', 'latest'))
+        self.assertEqual(docker._parse_repo_tag('registry.io:5000/image1@sha256:ddd'), ('registry.io:5000/image1', 'sha256:ddd'))
+
+    @mock.patch('logging.getLogger', autospec=True)
+    def test_log_event(self, get_logger_mock):
+        logger = get_logger_mock.return_value
+        docker._log_event('image1:latest', {'status': 'Pushing', 'id': 'layer1', 'progressDetail': {'current': 512, 'total': 1024}})
+        docker._log_event('image1:latest', {'status': 'Pushed', 'id': 'layer1', 'progressDetail': {}})
+        docker._log_event('image1:latest', {'aux': {'Digest': 'sha256:eee'}})
+        self.assertEqual(logger.debug.call_count, 1)
+        logger.info.assert_called_once_with('%(name)s %(id)s: %(status)s', dict(name='image1:latest', id='layer1', status='Pushed'))
+
+    def _write_config(self, content):
+        with open(self._config_path, 'w') as config_file:
+            json.dump(content, config_file)
+
+    @staticmethod
+    def _get_auth(repo):
+        return json.loads(base64.urlsafe_b64decode(docker.EngineAPIBackend._get_registry_auth(repo).encode('ascii')).decode('utf-8'))
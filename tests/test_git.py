@@ -1,3 +1,8 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import time
 import unittest
 import mock
 from skipper import git
@@ -5,17 +10,23 @@ from skipper import git
 
 GIT_HASH_FULL = '00efe974e3cf18c3493f110f5aeda04ff78b125f'
 GIT_HASH_SHORT = '00efe97'
+OTHER_GIT_HASH = '1b4ef0cb4d7a1e2f6dd6fcb1f3b9c1a8e2d6f7a9'
 
 
 class TestGit(unittest.TestCase):
+    def setUp(self):
+        git._cache.clear()
+
+    @mock.patch('skipper.git._read_head', autospec=True, return_value=None)
     @mock.patch('subprocess.check_output', return_value=GIT_HASH_FULL)
-    def test_get_hash_with_default_argument(self, check_output_mock):
+    def test_get_hash_with_default_argument(self, check_output_mock, *args):
         git_hash = git.get_hash()
         check_output_mock.assert_called_once_with(['git', 'rev-parse', 'HEAD'])
         self.assertEqual(git_hash, GIT_HASH_FULL)
 
+    @mock.patch('skipper.git._read_head', autospec=True, return_value=None)
     @mock.patch('subprocess.check_output', return_value=GIT_HASH_FULL)
-    def test_get_full_hash(self, check_output_mock):
+    def test_get_full_hash(self, check_output_mock, *args):
         git_hash = git.get_hash(short=False)
         check_output_mock.assert_called_once_with(['git', 'rev-parse', 'HEAD'])
         self.assertEqual(git_hash, GIT_HASH_FULL)
@@ -25,3 +36,127 @@ class TestGit(unittest.TestCase):
         git_hash = git.get_hash(short=True)
         check_output_mock.assert_called_once_with(['git', 'rev-parse', '--short', 'HEAD'])
         self.assertEqual(git_hash, GIT_HASH_SHORT)
+
+    @mock.patch('skipper.git._read_head', autospec=True, return_value=GIT_HASH_FULL)
+    @mock.patch('subprocess.check_output')
+    def test_get_hash_is_cached(self, check_output_mock, read_head_mock):
+        self.assertEqual(git.get_hash(), GIT_HASH_FULL)
+        self.assertEqual(git.get_hash(), GIT_HASH_FULL)
+        read_head_mock.assert_called_once_with()
+        self.assertFalse(check_output_mock.called)
+
+
+class TestGitRepository(unittest.TestCase):
+    def setUp(self):
+        git._cache.clear()
+        self._cwd = os.getcwd()
+        self._workdir = tempfile.mkdtemp()
+        self._git_dir = os.path.join(self._workdir, 'repo', '.git')
+        os.makedirs(os.path.join(self._git_dir, 'refs', 'heads'))
+        os.makedirs(os.path.join(self._workdir, 'repo', 'src'))
+        os.chdir(os.path.join(self._workdir, 'repo', 'src'))
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        shutil.rmtree(self._workdir)
+
+    def test_detached_head(self):
+        self._write(self._git_dir, 'HEAD', GIT_HASH_FULL + '\n')
+        self.assertEqual(git._read_head(), GIT_HASH_FULL)
+
+    def test_loose_ref(self):
+        self._write(self._git_dir, 'HEAD', 'ref: refs/heads/master\n')
+        self._write(self._git_dir, 'refs/heads/master', GIT_HASH_FULL + '\n')
+        self._write(self._git_dir, 'packed-refs', OTHER_GIT_HASH + ' refs/heads/master\n')
+        self.assertEqual(git._read_head(), GIT_HASH_FULL)
+
+    def test_packed_ref(self):
+        self._write(self._git_dir, 'HEAD', 'ref: refs/heads/master\n')
+        self._write(self._git_dir, 'packed-refs', '# pack-refs with: peeled fully-peeled sorted\n' +
+                    OTHER_GIT_HASH + ' refs/heads/feature\n' +
+                    GIT_HASH_FULL + ' refs/heads/master\n' +
+                    '^' + OTHER_GIT_HASH + '\n')
+        self.assertEqual(git._read_head(), GIT_HASH_FULL)
+
+    def test_worktree(self):
+        worktree_git_dir = os.path.join(self._git_dir, 'worktrees', 'other')
+        self._write(worktree_git_dir, 'HEAD', 'ref: refs/heads/feature\n')
+        self._write(worktree_git_dir, 'commondir', '../..\n')
+        self._write(self._git_dir, 'refs/heads/feature', OTHER_GIT_HASH + '\n')
+        os.makedirs(os.path.join(self._workdir, 'other'))
+        self._write(os.path.join(self._workdir, 'other'), '.git', 'gitdir: ../repo/.git/worktrees/other\n')
+        os.chdir(os.path.join(self._workdir, 'other'))
+        self.assertEqual(git._read_head(), OTHER_GIT_HASH)
+
+    @mock.patch('subprocess.check_output', return_value=GIT_HASH_FULL + '\n')
+    def test_unborn_branch_falls_back_to_rev_parse(self, check_output_mock):
+        self._write(self._git_dir, 'HEAD', 'ref: refs/heads/master\n')
+        self.assertEqual(git.get_hash(), GIT_HASH_FULL)
+        check_output_mock.assert_called_once_with(['git', 'rev-parse', 'HEAD'])
+
+    @staticmethod
+    def _write(directory, path, content):
+        path = os.path.join(directory, path)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as ref_file:
+            ref_file.write(content)
+
+
+def _is_git_installed():
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.call(['git', '--version'], stdout=devnull) == 0
+    except OSError:
+        return False
+
+
+@unittest.skipUnless(_is_git_installed(), 'git is not installed')
+class TestGitDirty(unittest.TestCase):
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._workdir = tempfile.mkdtemp()
+        os.chdir(self._workdir)
+        with open('tracked', 'w') as tracked:
+            tracked.write('content\n')
+        # Older than the index, so the file isn't racily clean
+        os.utime('tracked', (time.time() - 10, time.time() - 10))
+        commit = ['-c', 'user.name=skipper', '-c', 'user.email=skipper@localhost', 'commit', '-q', '-m', 'commit']
+        for command in (['init', '-q'], ['add', 'tracked'], commit):
+            subprocess.check_call(['git'] + command)
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        shutil.rmtree(self._workdir)
+
+    @mock.patch('subprocess.call', autospec=True)
+    def test_clean_tree(self, call_mock):
+        self.assertFalse(git.is_dirty())
+        self.assertFalse(call_mock.called)
+
+    def test_modified_file(self):
+        with open('tracked', 'a') as tracked:
+            tracked.write('more content\n')
+        self.assertTrue(git.is_dirty())
+
+    def test_deleted_file(self):
+        os.remove('tracked')
+        self.assertTrue(git.is_dirty())
+
+    def test_staged_file(self):
+        with open('tracked', 'a') as tracked:
+            tracked.write('more content\n')
+        os.utime('tracked', (time.time() - 5, time.time() - 5))
+        subprocess.check_call(['git', 'add', 'tracked'])
+        self.assertTrue(git.is_dirty())
+
+    def test_racily_clean_file(self):
+        # The index records the mtime of the file, and the file changes again within that second
+        mtime = time.time() + 5
+        os.utime('tracked', (mtime, mtime))
+        with open(os.devnull, 'w') as devnull:
+            subprocess.check_call(['git', 'update-index', '--refresh'], stdout=devnull)
+        with open('tracked', 'w') as tracked:
+            tracked.write('CONTENT\n')
+        os.utime('tracked', (mtime, mtime))
+        self.assertTrue(git.is_dirty())
@@ -0,0 +1,36 @@
+import json
+import os
+import subprocess
+import sys
+import time
+import unittest
+
+
+# Wall clock budgets depend on the load of the host, so they only run with SKIPPER_TIMING_TESTS=1
+TIMING_TESTS = os.environ.get('SKIPPER_TIMING_TESTS') == '1'
+IMPORT_TIME_BUDGET = float(os.environ.get('SKIPPER_IMPORT_TIME_BUDGET', 0.25))
+RUNS = 5
+LAZY_MODULES = ['multiprocessing.pool', 'requests', 'tabulate', 'yaml']
+
+
+def _best_run_time(code):
+    best = None
+    for _ in range(RUNS):
+        start_time = time.time()
+        subprocess.check_call([sys.executable, '-c', code])
+        elapsed = time.time() - start_time
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+class TestImportTime(unittest.TestCase):
+    def test_heavy_modules_are_imported_lazily(self):
+        code = 'import json, sys; import skipper.main; print(json.dumps([m for m in %r if m in sys.modules]))' % LAZY_MODULES
+        output = subprocess.check_output([sys.executable, '-c', code])
+        self.assertEqual(json.loads(output.decode('utf-8')), [])
+
+    @unittest.skipUnless(TIMING_TESTS, 'set SKIPPER_TIMING_TESTS=1 to check the import time budget')
+    def test_import_time_budget(self):
+        import_time = _best_run_time('import skipper.main') - _best_run_time('pass')
+        self.assertLess(import_time, IMPORT_TIME_BUDGET,
+                        'importing skipper took %.3fs, more than the %.3fs budget' % (import_time, IMPORT_TIME_BUDGET))
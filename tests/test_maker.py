@@ -0,0 +1,75 @@
+import io
+import json
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+from skipper import durations
+from skipper import maker
+
+
+MAKEFILE = 'Makefile'
+FQDN_IMAGE = 'build-container-image:build-container-tag'
+ENV = ['KEY1=VAL1']
+
+
+def _start_nested(command, fqdn_image, environment, user_setup, stdout):
+    target = command[-1]
+    stdout.write(('output of %(target)s\n' % dict(target=target)).encode('utf-8'))
+    proc = mock.Mock()
+    proc.wait.return_value = 2 if target == 'unit' else 0
+    return proc
+
+
+@mock.patch('skipper.runner.get_nested_image', autospec=True, return_value=(FQDN_IMAGE, True))
+@mock.patch('skipper.runner.start_nested', autospec=True, side_effect=_start_nested)
+class TestMaker(unittest.TestCase):
+    def setUp(self):
+        maker.utils.logger = mock.Mock()
+        self._workdir = tempfile.mkdtemp()
+        self._durations_path = os.path.join(self._workdir, 'cache', 'make-durations.json')
+        self._project = os.getcwd() + ':' + MAKEFILE
+
+    def tearDown(self):
+        shutil.rmtree(self._workdir)
+
+    def test_make_targets_longest_first(self, start_nested_mock, *args):
+        durations.save(self._durations_path, {self._project: {'lint': 5, 'unit': 60, 'docs': 1}, 'other': {'lint': 1}})
+        with mock.patch('sys.stdout', new=io.BytesIO()) as stdout:
+            ret, results = maker.make_targets(['lint', 'unit', 'integration', 'docs', 'lint'], MAKEFILE, FQDN_IMAGE, ENV, jobs=1,
+                                              durations_path=self._durations_path)
+
+        self.assertEqual(ret, 1)
+        self.assertEqual([command[0][0][-1] for command in start_nested_mock.call_args_list], ['integration', 'unit', 'lint', 'docs'])
+        self.assertEqual([result[:3] for result in results], [['integration', maker.PASSED, 0], ['unit', maker.FAILED, 2],
+                                                              ['lint', maker.PASSED, 0], ['docs', maker.PASSED, 0]])
+        start_nested_mock.assert_any_call(['make', '-f', MAKEFILE, 'lint'], FQDN_IMAGE, ENV, True, stdout=mock.ANY)
+        self.assertEqual(stdout.getvalue(), b'output of integration\noutput of unit\noutput of lint\noutput of docs\n')
+
+        recorded = durations.load(self._durations_path)
+        self.assertEqual(sorted(recorded[self._project]), ['docs', 'integration', 'lint', 'unit'])
+        self.assertEqual(recorded[self._project]['unit'], 60)
+        self.assertEqual(recorded['other'], {'lint': 1})
+
+    def test_make_targets_in_parallel(self, start_nested_mock, *args):
+        with mock.patch('sys.stdout', new=io.BytesIO()) as stdout:
+            ret, results = maker.make_targets(['lint', 'docs'], MAKEFILE, FQDN_IMAGE, ENV, jobs=2, durations_path=self._durations_path)
+
+        self.assertEqual(ret, 0)
+        self.assertEqual(sorted(result[0] for result in results), ['docs', 'lint'])
+        self.assertEqual(sorted(stdout.getvalue().splitlines()), [b'output of docs', b'output of lint'])
+
+    def test_durations_follow_cache_home(self, *args):
+        with mock.patch.dict(os.environ, {'XDG_CACHE_HOME': os.path.join(self._workdir, 'xdg')}):
+            maker.make_targets(['lint'], MAKEFILE, FQDN_IMAGE, ENV, jobs=1)
+        self.assertTrue(os.path.exists(os.path.join(self._workdir, 'xdg', 'skipper', durations.MAKE_DURATIONS_FILE)))
+
+    def test_unreadable_durations(self, *args):
+        os.makedirs(os.path.dirname(self._durations_path))
+        with open(self._durations_path, 'w') as durations_file:
+            durations_file.write('{')
+        self.assertEqual(durations.load(self._durations_path), {})
+        self.assertTrue(durations.update(self._durations_path, self._project, {'lint': 1}))
+        with open(self._durations_path) as durations_file:
+            self.assertEqual(json.load(durations_file), {self._project: {'lint': 1}})
@@ -0,0 +1,85 @@
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+from skipper import metrics
+from skipper import runner
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self._workdir = tempfile.mkdtemp()
+        self._path = os.path.join(self._workdir, metrics.METRICS_FILE)
+
+    def tearDown(self):
+        metrics.configure(None)
+        shutil.rmtree(self._workdir)
+
+    def test_disabled_metrics_write_nothing(self):
+        metrics.configure(None)
+        self.assertFalse(metrics.is_enabled())
+        metrics.observe(metrics.BUILD_DURATION, 1.0, image='app', status='built')
+        metrics.observe_command(1.0, 0)
+        metrics.write()
+        self.assertEqual(os.listdir(self._workdir), [])
+
+    def test_write_histogram(self):
+        metrics.configure(self._workdir, 'build')
+        metrics.observe(metrics.BUILD_DURATION, 3.0, image='app', status='built')
+        metrics.write()
+
+        samples = self._read_samples()
+        labels = (('image', 'app'), ('status', 'built'))
+        self.assertEqual(samples[(metrics.BUILD_DURATION + '_bucket', labels + (('le', '1'),))], 0)
+        self.assertEqual(samples[(metrics.BUILD_DURATION + '_bucket', labels + (('le', '5'),))], 1)
+        self.assertEqual(samples[(metrics.BUILD_DURATION + '_bucket', labels + (('le', '+Inf'),))], 1)
+        self.assertEqual(samples[(metrics.BUILD_DURATION + '_sum', labels)], 3.0)
+        self.assertEqual(samples[(metrics.BUILD_DURATION + '_count', labels)], 1)
+        with open(self._path) as metrics_file:
+            content = metrics_file.read()
+        self.assertIn('# TYPE skipper_build_duration_seconds histogram\n', content)
+        self.assertIn('skipper_build_duration_seconds_count{image="app",status="built"} 1\n', content)
+
+    def test_write_adds_to_existing_metrics(self):
+        for exit_code in (0, 0, 2):
+            metrics.configure(self._workdir, 'push')
+            metrics.observe_command(0.25, exit_code)
+            metrics.inc(metrics.PUSHED_BYTES, 1024, image='app')
+            metrics.write()
+
+        samples = self._read_samples()
+        self.assertEqual(samples[(metrics.COMMAND_DURATION + '_count', (('command', 'push'), ('exit_code', '0')))], 2)
+        self.assertEqual(samples[(metrics.COMMAND_DURATION + '_sum', (('command', 'push'), ('exit_code', '0')))], 0.5)
+        self.assertEqual(samples[(metrics.COMMAND_DURATION + '_count', (('command', 'push'), ('exit_code', '2')))], 1)
+        self.assertEqual(samples[(metrics.PUSHED_BYTES, (('image', 'app'),))], 3072)
+        self.assertEqual(sorted(os.listdir(self._workdir)), [metrics.LOCK_FILE, metrics.METRICS_FILE])
+
+    def test_command_without_exit_code_succeeded(self):
+        metrics.configure(self._workdir, 'images')
+        metrics.observe_command(0.1, None)
+        metrics.write()
+        self.assertEqual(self._read_samples()[(metrics.COMMAND_DURATION + '_count', (('command', 'images'), ('exit_code', '0')))], 1)
+
+    def test_escaped_labels_round_trip(self):
+        samples = {(metrics.PUSHED_BYTES, (('image', 'a"b\\c\nd'),)): 10}
+        self.assertEqual(metrics.parse_samples(metrics.format_samples(samples)), samples)
+
+    @mock.patch('subprocess.Popen', autospec=True)
+    def test_runner_observes_commands(self, popen_mock):
+        popen_mock.return_value.returncode = 2
+        metrics.configure(self._workdir, 'build')
+        runner.run(['/usr/bin/docker', 'build', '.'])
+        metrics.write()
+
+        labels = (('container', 'false'), ('exit_code', '2'), ('program', 'docker'))
+        self.assertEqual(self._read_samples()[(metrics.RUN_DURATION + '_count', labels)], 1)
+
+    def test_program_is_the_executable_name(self):
+        self.assertEqual(metrics.get_program(['/usr/bin/make', '-j4']), 'make')
+        self.assertEqual(metrics.get_program(['./scripts/test.sh --shard 3 tests/unit']), 'test.sh')
+        self.assertEqual(metrics.get_program([]), '')
+
+    def _read_samples(self):
+        with open(self._path) as metrics_file:
+            return metrics.parse_samples(metrics_file.read())
@@ -0,0 +1,362 @@
+import hashlib
+import json
+import mock
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import requests
+from requests import adapters
+from skipper import registry_cache
+from skipper import registry_client
+
+
+REGISTRY = 'registry.io:5000'
+TAGS_URL = 'https://%(registry)s/v2/image/tags/list?n=1000' % dict(registry=REGISTRY)
+MANIFEST_URL = 'https://%(registry)s/v2/image/manifests/latest' % dict(registry=REGISTRY)
+
+
+def _response(ok=True, json=None, headers=None):
+    response = mock.Mock(ok=ok, headers=headers or {})
+    response.json.return_value = json
+    return response
+
+
+def _tags_response(session, url, headers=None):
+    image = url.split('/v2/')[1].split('/tags/list')[0]
+    if image == 'unknown':
+        return _response(ok=False, json={'errors': [{'code': 'NAME_UNKNOWN'}]})
+    return _response(json={'name': image, 'tags': [image + '-1', image + '-2']})
+
+
+def _digest(manifest):
+    return 'sha256:' + hashlib.sha256(manifest).hexdigest()
+
+
+class FakeRegistryAdapter(adapters.BaseAdapter):
+    '''
+    An in-process registry serving the manifests and tags API from a dict of (image, reference): (manifest, media type)
+    '''
+    def __init__(self, manifests):
+        super(FakeRegistryAdapter, self).__init__()
+        self.manifests = manifests
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def send(self, request, **kwargs):  # pylint: disable=arguments-differ
+        with self._lock:
+            return self._send(request)
+
+    def _send(self, request):
+        self.requests.append((request.method, request.url))
+        path = request.path_url.split('?')[0][len('/v2/'):]
+        if '/manifests/' in path:
+            image, reference = path.split('/manifests/')
+            if request.method == 'PUT':
+                self.manifests[(image, reference)] = (request.body, request.headers['Content-Type'])
+                return self._response(request, 201, b'')
+            if request.method == 'DELETE':
+                tags = [key for key, (manifest, _) in self.manifests.items() if key[0] == image and _digest(manifest) == reference]
+                for key in tags:
+                    del self.manifests[key]
+                return self._response(request, 202 if tags else 404, b'')
+            if (image, reference) not in self.manifests:
+                return self._response(request, 404, json.dumps({'errors': [{'code': 'MANIFEST_UNKNOWN'}]}).encode('utf-8'))
+            manifest, media_type = self.manifests[(image, reference)]
+            return self._response(request, 200, manifest, {'Content-Type': media_type, 'Docker-Content-Digest': _digest(manifest)})
+
+        image = path.split('/tags/list')[0]
+        tags = sorted(tag for name, tag in self.manifests if name == image)
+        return self._response(request, 200, json.dumps({'name': image, 'tags': tags}).encode('utf-8'))
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def _response(request, status_code, content, headers=None):
+        response = requests.Response()
+        response.status_code = status_code
+        response._content = content
+        response.headers.update(headers or {})
+        response.url = request.url
+        response.request = request
+        return response
+
+
+class TestRegistryClient(unittest.TestCase):
+    def test_get_client_is_shared(self):
+        client = registry_client.get_client(REGISTRY)
+        self.assertIs(client, registry_client.get_client(REGISTRY))
+        self.assertIsNot(client, registry_client.get_client('other-registry.io'))
+
+    @mock.patch.dict(os.environ, XDG_CACHE_HOME='/tmp/cache-home')
+    def test_cache_dir_follows_xdg_cache_home(self):
+        self.assertEqual(registry_cache.RegistryCache().directory, '/tmp/cache-home/skipper')
+
+    def test_get_client_uses_configured_cache(self):
+        cache = registry_cache.RegistryCache(ttl=60)
+        registry_cache.configure(cache)
+        self.addCleanup(registry_cache.configure, None)
+        client = registry_client.get_client(REGISTRY)
+        self.assertIs(client.cache, cache)
+        registry_cache.configure(None)
+        self.assertIsNone(registry_client.get_client(REGISTRY).cache)
+
+    @mock.patch('requests.Session.get', autospec=True, side_effect=_tags_response)
+    def test_get_images_tags(self, session_get_mock):
+        client = registry_client.RegistryClient(REGISTRY, max_concurrent_requests=4)
+        images = ['image%d' % index for index in range(10)] + ['unknown']
+        images_tags = client.get_images_tags(images)
+
+        self.assertEqual(images_tags[:-1], [[image + '-1', image + '-2'] for image in images[:-1]])
+        self.assertIsNone(images_tags[-1])
+        self.assertEqual(session_get_mock.call_count, len(images))
+        self.assertEqual(set(call[0][0] for call in session_get_mock.call_args_list), set([client._session]))
+
+    @mock.patch('requests.Session.get', autospec=True)
+    def test_get_tags_with_error(self, session_get_mock):
+        session_get_mock.return_value = _response(ok=False, json={'errors': [{'code': 'UNAUTHORIZED'}]})
+        client = registry_client.RegistryClient(REGISTRY)
+        self.assertRaises(registry_client.RegistryError, client.get_tags, 'image')
+
+    @mock.patch('requests.Session.get', autospec=True)
+    @mock.patch('requests.Session.head', autospec=True)
+    def test_image_exist(self, session_head_mock, session_get_mock):
+        session_head_mock.side_effect = [mock.Mock(ok=True, status_code=200), mock.Mock(ok=False, status_code=registry_client.NOT_FOUND)]
+        client = registry_client.RegistryClient(REGISTRY)
+        self.assertTrue(client.image_exist('image', 'latest'))
+        self.assertFalse(client.image_exist('image', 'missing'))
+        session_head_mock.assert_any_call(mock.ANY, url=MANIFEST_URL, headers={'Accept': ', '.join(registry_client.MANIFEST_MEDIA_TYPES)})
+        self.assertFalse(session_get_mock.called)
+
+    @mock.patch('requests.Session.head', autospec=True, return_value=mock.Mock(ok=False, status_code=401))
+    def test_image_exist_with_error(self, *args):
+        client = registry_client.RegistryClient(REGISTRY)
+        self.assertRaises(registry_client.RegistryError, client.image_exist, 'image', 'latest')
+
+    @mock.patch('requests.Session.get', autospec=True)
+    def test_get_tags_follows_pagination(self, session_get_mock):
+        session_get_mock.side_effect = [
+            _response(json={'tags': ['a', 'b']}, headers={'Link': '</v2/image/tags/list?n=2&last=b>; rel="next"', 'ETag': '"1"'}),
+            _response(json={'tags': ['c']}),
+        ]
+        session_get_mock.side_effect[0].url = TAGS_URL
+        client = registry_client.RegistryClient(REGISTRY)
+        self.assertEqual(list(client.iter_tags('image')), ['a', 'b', 'c'])
+        session_get_mock.assert_called_with(mock.ANY, url='https://%(registry)s/v2/image/tags/list?n=2&last=b' % dict(registry=REGISTRY),
+                                            headers={})
+
+    def test_session_does_not_verify_certificates(self):
+        client = registry_client.RegistryClient(REGISTRY)
+        self.assertFalse(client._session.verify)
+
+
+class TestRegistryClientDelete(unittest.TestCase):
+    def setUp(self):
+        self._registry = FakeRegistryAdapter({('image1', '1234567'): (b'{"a": 1}', registry_client.MANIFEST_V2_MEDIA_TYPE),
+                                              ('image1', 'latest'): (b'{"a": 1}', registry_client.MANIFEST_V2_MEDIA_TYPE),
+                                              ('image1', 'old'): (b'{"b": 2}', registry_client.MANIFEST_V2_MEDIA_TYPE),
+                                              ('image2', 'latest'): (b'{"a": 1}', registry_client.MANIFEST_V2_MEDIA_TYPE)})
+        self._client = registry_client.RegistryClient(REGISTRY, max_concurrent_requests=4)
+        self._client._session.mount('https://', self._registry)
+
+    def test_delete_images(self):
+        results = self._client.delete_images([('image1', '1234567'), ('image1', 'latest'), ('image1', 'old'),
+                                              ('image2', 'latest'), ('image2', 'missing')])
+        self.assertEqual(results, [['image1', '1234567', None], ['image1', 'latest', None], ['image1', 'old', None],
+                                   ['image2', 'latest', None], ['image2', 'missing', 'image2:missing was not found']])
+        self.assertEqual(self._registry.manifests, {})
+        deletes = sorted(url for method, url in self._registry.requests if method == 'DELETE')
+        self.assertEqual(deletes, sorted('https://%(registry)s/v2/%(image)s/manifests/%(digest)s'
+                                         % dict(registry=REGISTRY, image=image, digest=_digest(manifest))
+                                         for image, manifest in [('image1', b'{"a": 1}'), ('image1', b'{"b": 2}'),
+                                                                 ('image2', b'{"a": 1}')]))
+
+    def test_delete_images_looks_up_each_reference_once(self):
+        results = self._client.delete_images([('image1', 'latest'), ('image1', 'latest')])
+        self.assertEqual(results, [['image1', 'latest', None], ['image1', 'latest', None]])
+        self.assertEqual([method for method, _ in self._registry.requests], ['GET', 'DELETE'])
+        self.assertEqual(sorted(self._registry.manifests), [('image1', 'old'), ('image2', 'latest')])
+
+    def test_delete_images_shares_errors_of_a_manifest(self):
+        with mock.patch.object(self._client, 'delete_manifest', side_effect=registry_client.RegistryError('denied')) as delete_mock:
+            results = self._client.delete_images([('image1', '1234567'), ('image1', 'latest')])
+        self.assertEqual(results, [['image1', '1234567', 'denied'], ['image1', 'latest', 'denied']])
+        delete_mock.assert_called_once_with('image1', _digest(b'{"a": 1}'), mock.ANY)
+
+    def test_delete_images_keeps_shared_manifests(self):
+        results = self._client.delete_images([('image1', 'latest'), ('image1', 'old')], keep_shared=True)
+        self.assertEqual(results, [['image1', 'latest', 'same manifest as 1234567'], ['image1', 'old', None]])
+        self.assertEqual(sorted(self._registry.manifests), [('image1', '1234567'), ('image1', 'latest'), ('image2', 'latest')])
+
+    def test_delete_manifests_waits_for_limiter(self):
+        limiter = mock.Mock()
+        digests = self._client.get_digests([('image1', 'old'), ('image2', 'latest')], jobs=1, limiter=limiter)
+        self.assertEqual(digests, [(_digest(b'{"b": 2}'), None), (_digest(b'{"a": 1}'), None)])
+        errors = self._client.delete_manifests([('image1', digests[0][0], ['old']), ('image1', 'sha256:missing', [])], limiter=limiter)
+        self.assertEqual(errors[0], None)
+        self.assertIsNotNone(errors[1])
+        self.assertEqual(limiter.wait.call_count, 4)
+
+
+class TestRegistryClientPromote(unittest.TestCase):
+    def setUp(self):
+        self._manifest = b'{"schemaVersion": 2,  "layers": []}'
+        self._registry = FakeRegistryAdapter({('image1', '1234567'): (self._manifest, registry_client.MANIFEST_V2_MEDIA_TYPE),
+                                              ('image2', '1234567'): (b'{}', 'application/vnd.oci.image.index.v1+json')})
+        self._client = registry_client.RegistryClient(REGISTRY)
+        self._client._session.mount('https://', self._registry)
+
+    def test_promote_images(self):
+        results = self._client.promote_images(['image1', 'image2'], '1234567', ['latest', 'stable'])
+        self.assertEqual(results, [['image1', 'latest', None], ['image1', 'stable', None],
+                                   ['image2', 'latest', None], ['image2', 'stable', None]])
+        self.assertEqual(self._registry.manifests[('image1', 'stable')], (self._manifest, registry_client.MANIFEST_V2_MEDIA_TYPE))
+        self.assertEqual(self._registry.manifests[('image2', 'latest')], (b'{}', 'application/vnd.oci.image.index.v1+json'))
+        self.assertEqual(sorted(method for method, _ in self._registry.requests), ['GET', 'GET', 'PUT', 'PUT', 'PUT', 'PUT'])
+        self.assertEqual(self._client.get_tags('image1'), ['1234567', 'latest', 'stable'])
+
+    def test_promote_missing_image(self):
+        results = self._client.promote_images(['image3'], '1234567', ['latest'])
+        self.assertEqual(results, [['image3', 'latest', 'image3:1234567 was not found']])
+        self.assertEqual([method for method, _ in self._registry.requests], ['GET'])
+
+    def test_promote_invalidates_cached_tags(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        client = registry_client.RegistryClient(REGISTRY, cache=registry_cache.RegistryCache(cache_dir, ttl=60))
+        client._session.mount('https://', self._registry)
+        self.assertEqual(client.get_tags('image1'), ['1234567'])
+        client.promote_images(['image1'], '1234567', ['latest'])
+        self.assertEqual(client.get_tags('image1'), ['1234567', 'latest'])
+
+
+class TestRegistryClientConfigDigest(unittest.TestCase):
+    def setUp(self):
+        self._registry = FakeRegistryAdapter({('image1', 'latest'): (b'{"config": {"digest": "sha256:aaa"}}',
+                                                                     registry_client.MANIFEST_V2_MEDIA_TYPE),
+                                              ('image2', 'latest'): (b'{"manifests": []}', 'application/vnd.oci.image.index.v1+json'),
+                                              ('image3', 'latest'): (b'<html>', registry_client.MANIFEST_V2_MEDIA_TYPE)})
+        self._client = registry_client.RegistryClient(REGISTRY)
+        self._client._session.mount('https://', self._registry)
+
+    def test_get_image_config_digest(self):
+        self.assertEqual(self._client.get_image_config_digest('image1', 'latest'), 'sha256:aaa')
+        self.assertIsNone(self._client.get_image_config_digest('image1', 'missing'))
+
+    def test_manifest_list_has_no_config_digest(self):
+        self.assertIsNone(self._client.get_image_config_digest('image2', 'latest'))
+
+    def test_invalid_manifest_raises(self):
+        self.assertRaises(registry_client.RegistryError, self._client.get_image_config_digest, 'image3', 'latest')
+
+
+class TestRegistryClientCache(unittest.TestCase):
+    def setUp(self):
+        self._cache_dir = tempfile.mkdtemp()
+        self._cache = registry_cache.RegistryCache(self._cache_dir, ttl=60)
+        self._client = registry_client.RegistryClient(REGISTRY, cache=self._cache)
+
+    def tearDown(self):
+        shutil.rmtree(self._cache_dir)
+
+    @mock.patch('requests.Session.get', autospec=True)
+    def test_fresh_tags_are_not_fetched(self, session_get_mock):
+        session_get_mock.return_value = _response(json={'tags': ['latest']}, headers={'ETag': '"etag"'})
+        self.assertEqual(self._client.get_tags('image'), ['latest'])
+        self.assertEqual(self._client.get_tags('image'), ['latest'])
+        session_get_mock.assert_called_once_with(mock.ANY, url=TAGS_URL, headers={})
+
+    @mock.patch('requests.Session.get', autospec=True)
+    def test_stale_tags_are_revalidated(self, session_get_mock):
+        self._cache.ttl = 0
+        session_get_mock.side_effect = [
+            _response(json={'tags': ['latest']}, headers={'ETag': '"etag"'}),
+            mock.Mock(status_code=registry_client.NOT_MODIFIED),
+        ]
+        self.assertEqual(self._client.get_tags('image'), ['latest'])
+        self.assertEqual(self._client.get_tags('image'), ['latest'])
+        session_get_mock.assert_called_with(mock.ANY, url=TAGS_URL, headers={'If-None-Match': '"etag"'})
+
+    @mock.patch('requests.Session.get', autospec=True)
+    def test_stale_tags_are_replaced(self, session_get_mock):
+        self._cache.ttl = 0
+        session_get_mock.side_effect = [
+            _response(json={'tags': ['latest']}, headers={'ETag': '"etag1"'}),
+            _response(json={'tags': ['latest', 'v2']}, headers={'ETag': '"etag2"'}),
+        ]
+        self.assertEqual(self._client.get_tags('image'), ['latest'])
+        self.assertEqual(self._client.get_tags('image'), ['latest', 'v2'])
+        self.assertEqual(self._cache.get(TAGS_URL)['etag'], '"etag2"')
+
+    @mock.patch('requests.Session.get', autospec=True)
+    def test_paginated_tags_are_not_revalidated(self, session_get_mock):
+        first_page = _response(json={'tags': ['a']}, headers={'Link': '<?n=1&last=a>; rel="next"', 'ETag': '"1"'})
+        first_page.url = TAGS_URL
+        session_get_mock.side_effect = [first_page, _response(json={'tags': ['b']})]
+        self.assertEqual(self._client.get_tags('image'), ['a', 'b'])
+        self.assertEqual(self._cache.get(TAGS_URL)['value'], ['a', 'b'])
+        self.assertIsNone(self._cache.get(TAGS_URL)['etag'])
+
+    @mock.patch('requests.Session.get', autospec=True)
+    def test_tags_without_etag_are_not_cached_without_ttl(self, session_get_mock):
+        self._cache.ttl = 0
+        session_get_mock.return_value = _response(json={'tags': ['latest']})
+        self.assertEqual(self._client.get_tags('image'), ['latest'])
+        self.assertIsNone(self._cache.get(TAGS_URL))
+
+    @mock.patch('requests.Session.get', autospec=True)
+    def test_missing_manifest_has_no_digest(self, session_get_mock):
+        session_get_mock.return_value = mock.Mock(ok=False, status_code=registry_client.NOT_FOUND, headers={})
+        self.assertIsNone(self._client.get_image_digest('image', 'latest'))
+        self.assertEqual(self._client.get_digests([('image', 'latest')]), [(None, 'image:latest was not found')])
+
+    @mock.patch('requests.Session.get', autospec=True)
+    def test_denied_manifest_raises(self, session_get_mock):
+        session_get_mock.return_value = mock.Mock(ok=False, status_code=401, headers={}, content=b'UNAUTHORIZED')
+        self.assertRaises(registry_client.RegistryError, self._client.get_image_digest, 'image', 'latest')
+        self.assertIsNone(self._cache.get(MANIFEST_URL))
+
+    @mock.patch('requests.Session.get', autospec=True)
+    def test_manifest_without_digest_raises(self, session_get_mock):
+        session_get_mock.return_value = _response(headers={})
+        self.assertRaises(registry_client.RegistryError, self._client.get_image_digest, 'image', 'latest')
+
+    @mock.patch('requests.Session.get', autospec=True)
+    def test_get_digests_ignore_cached_digest(self, session_get_mock):
+        self._cache.put(MANIFEST_URL, 'stale-digest')
+        session_get_mock.return_value = _response(headers={'Docker-Content-Digest': 'digest'})
+        self.assertEqual(self._client.get_digests([('image', 'latest')]), [('digest', None)])
+
+
+class TestRegistryCache(unittest.TestCase):
+    def setUp(self):
+        self._cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._cache_dir)
+
+    def test_put_and_get(self):
+        cache = registry_cache.RegistryCache(os.path.join(self._cache_dir, 'skipper'), ttl=60)
+        self.assertIsNone(cache.get('key'))
+        cache.put('key', ['value'], etag='"etag"')
+        entry = cache.get('key')
+        self.assertEqual((entry['value'], entry['etag'], entry['fresh']), (['value'], '"etag"', True))
+        self.assertEqual(os.listdir(cache.directory), [os.path.basename(cache._path('key'))])
+
+    def test_entries_are_revalidated_by_default(self):
+        cache = registry_cache.RegistryCache(self._cache_dir)
+        cache.put('key', 'value', etag='"etag"')
+        self.assertFalse(cache.get('key')['fresh'])
+
+    def test_expired_entry_is_not_fresh(self):
+        cache = registry_cache.RegistryCache(self._cache_dir, ttl=0)
+        cache.put('key', 'value')
+        self.assertFalse(cache.get('key')['fresh'])
+
+    def test_corrupted_entry_is_ignored(self):
+        cache = registry_cache.RegistryCache(self._cache_dir)
+        with open(cache._path('key'), 'w') as entry_file:
+            entry_file.write('{"key": "ke')
+        self.assertIsNone(cache.get('key'))
@@ -0,0 +1,129 @@
+import mock
+import unittest
+from skipper import retention
+
+
+REGISTRY = 'registry.io:5000'
+IMAGE = 'image'
+OLD = 'a' * 40
+NEW = 'b' * 40
+BRANCH = 'c' * 40
+COMMIT_TIMES = {OLD: 100, NEW: 300, BRANCH: 200}
+
+
+@mock.patch('skipper.git.get_reachable_commits', autospec=True, return_value=set([BRANCH]))
+@mock.patch('skipper.git.get_commit_times', autospec=True, return_value=COMMIT_TIMES)
+class TestRetentionPolicy(unittest.TestCase):
+    def test_order(self, *args):
+        policy = retention.RetentionPolicy(keep_last=1)
+        tags = ['latest', OLD, 'f' * 40, NEW + '-dirty', BRANCH]
+        self.assertEqual(policy.order(tags), [NEW + '-dirty', BRANCH, OLD, 'f' * 40, 'latest'])
+
+    def test_get_kept_tags(self, get_commit_times_mock, get_reachable_commits_mock):
+        policy = retention.RetentionPolicy(keep_last=1, branches=['master'], patterns=['cache-*'])
+        kept = policy.get_kept_tags([OLD, NEW, BRANCH, 'cache-1234', 'latest'])
+        self.assertEqual(kept, {NEW: 'last 1', BRANCH: 'on master', 'cache-1234': 'matches cache-*', 'latest': 'not a commit'})
+        get_commit_times_mock.assert_called_once_with()
+        get_reachable_commits_mock.assert_called_once_with('master')
+
+    def test_keep_last_counts_only_commit_tags(self, *args):
+        policy = retention.RetentionPolicy(keep_last=2)
+        kept = policy.get_kept_tags(['latest', 'v1.0', OLD, NEW, 'f' * 40])
+        self.assertEqual(kept, {'latest': 'not a commit', 'v1.0': 'not a commit', NEW: 'last 2', OLD: 'last 2'})
+
+    def test_delete_patterns(self, *args):
+        policy = retention.RetentionPolicy(keep_last=0, patterns=['cache-main'], delete_patterns=['cache-*', 'a*'])
+        kept = policy.get_kept_tags(['cache-1234', 'cache-main', 'latest', OLD])
+        self.assertEqual(kept, {'cache-main': 'matches cache-main', 'latest': 'not a commit'})
+
+    def test_keep_nothing(self, get_commit_times_mock, *args):
+        policy = retention.RetentionPolicy(keep_last=0)
+        self.assertEqual(policy.get_kept_tags([OLD, NEW]), {})
+        self.assertEqual(policy.get_kept_tags(['latest']), {'latest': 'not a commit'})
+        self.assertFalse(get_commit_times_mock.called)
+
+
+@mock.patch('skipper.git.get_reachable_commits', autospec=True, return_value=set())
+@mock.patch('skipper.git.get_commit_times', autospec=True, return_value=COMMIT_TIMES)
+class TestCollect(unittest.TestCase):
+    def setUp(self):
+        retention.utils.logger = mock.Mock()
+        self.policy = retention.RetentionPolicy(keep_last=1, patterns=['latest'])
+
+    @mock.patch('skipper.utils.invalidate_local_images', autospec=True)
+    @mock.patch('skipper.utils.get_local_images', autospec=True, return_value={IMAGE: [OLD, NEW, BRANCH, 'latest']})
+    @mock.patch('skipper.docker.get_backend', autospec=True)
+    def test_collect_local_images(self, get_backend_mock, *args):
+        get_backend_mock.return_value.remove_image.side_effect = [0, 1]
+        rows = retention.collect_local_images([IMAGE], self.policy)
+        self.assertEqual(rows, [[IMAGE, OLD, retention.LOCAL, retention.DELETED, None],
+                                [IMAGE, BRANCH, retention.LOCAL, retention.FAILED, None]])
+        get_backend_mock.return_value.remove_image.assert_has_calls([mock.call(IMAGE + ':' + OLD),
+                                                                     mock.call(IMAGE + ':' + BRANCH)])
+
+    @mock.patch('skipper.utils.invalidate_local_images', autospec=True)
+    @mock.patch('skipper.utils.get_local_images', autospec=True, return_value={IMAGE: [OLD, NEW]})
+    @mock.patch('skipper.docker.get_backend', autospec=True)
+    def test_collect_local_images_dry_run(self, get_backend_mock, *args):
+        rows = retention.collect_local_images([IMAGE, 'other'], self.policy, dry_run=True)
+        self.assertEqual(rows, [[IMAGE, OLD, retention.LOCAL, retention.WOULD_DELETE, None]])
+        self.assertFalse(get_backend_mock.return_value.remove_image.called)
+
+    @mock.patch('skipper.utils.delete_manifests_from_registry', autospec=True, return_value=['denied'])
+    @mock.patch('skipper.utils.get_digests_from_registry', autospec=True)
+    @mock.patch('skipper.utils.get_images_tags', autospec=True)
+    def test_collect_remote_images(self, get_images_tags_mock, get_digests_mock, delete_manifests_mock, *args):
+        get_images_tags_mock.return_value = [[OLD, NEW, BRANCH, 'latest', OLD + '-dirty'], None]
+        digests = {OLD: 'sha256:old', NEW: 'sha256:new', BRANCH: 'sha256:new', 'latest': 'sha256:latest', OLD + '-dirty': 'sha256:old'}
+        get_digests_mock.side_effect = lambda registry, references, jobs, limiter: [(digests[tag], None) for _, tag in references]
+
+        rows = retention.collect_remote_images(REGISTRY, [IMAGE, 'other'], self.policy, jobs=4, rate=5)
+        self.assertEqual(rows, [[IMAGE, OLD, retention.REMOTE, retention.FAILED, 'denied'],
+                                [IMAGE, OLD + '-dirty', retention.REMOTE, retention.FAILED, 'denied'],
+                                [IMAGE, BRANCH, retention.REMOTE, retention.KEPT, 'same manifest as ' + NEW]])
+        get_images_tags_mock.assert_called_once_with(REGISTRY, [IMAGE, 'other'])
+        limiter = get_digests_mock.call_args[0][3]
+        get_digests_mock.assert_called_once_with(REGISTRY, [(IMAGE, tag) for tag in get_images_tags_mock.return_value[0]], 4, limiter)
+        delete_manifests_mock.assert_called_once_with(REGISTRY, [(IMAGE, 'sha256:old', [OLD, OLD + '-dirty'])], 4, limiter)
+
+    @mock.patch('skipper.utils.delete_manifests_from_registry', autospec=True)
+    @mock.patch('skipper.utils.get_digests_from_registry', autospec=True)
+    @mock.patch('skipper.utils.get_images_tags', autospec=True, return_value=[[OLD, NEW, BRANCH], [OLD, NEW]])
+    def test_collect_remote_images_digest_errors(self, get_images_tags_mock, get_digests_mock, delete_manifests_mock, *args):
+        def _get_digests(registry, references, jobs, limiter):
+            return [(None, 'not found') if reference in [(IMAGE, OLD), ('other', NEW)] else ('sha256:' + reference[1], None)
+                    for reference in references]
+        get_digests_mock.side_effect = _get_digests
+        delete_manifests_mock.side_effect = lambda registry, deletions, jobs, limiter: [None] * len(deletions)
+
+        rows = retention.collect_remote_images(REGISTRY, [IMAGE, 'other'], self.policy, jobs=4)
+        self.assertEqual(rows, [[IMAGE, OLD, retention.REMOTE, retention.FAILED, 'not found'],
+                                [IMAGE, BRANCH, retention.REMOTE, retention.DELETED, None],
+                                ['other', OLD, retention.REMOTE, retention.FAILED, 'unknown manifest of ' + NEW]])
+        self.assertEqual(delete_manifests_mock.call_args[0][1], [(IMAGE, 'sha256:' + BRANCH, [BRANCH])])
+
+    @mock.patch('skipper.utils.delete_manifests_from_registry', autospec=True)
+    @mock.patch('skipper.utils.get_digests_from_registry', autospec=True)
+    @mock.patch('skipper.utils.get_images_tags', autospec=True, return_value=[[OLD, NEW]])
+    def test_collect_remote_images_dry_run(self, get_images_tags_mock, get_digests_mock, delete_manifests_mock, *args):
+        get_digests_mock.side_effect = lambda registry, references, jobs, limiter: [('sha256:' + tag, None) for _, tag in references]
+        rows = retention.collect_remote_images(REGISTRY, [IMAGE], self.policy, jobs=4, dry_run=True)
+        self.assertEqual(rows, [[IMAGE, OLD, retention.REMOTE, retention.WOULD_DELETE, None]])
+        self.assertFalse(delete_manifests_mock.called)
+
+
+class TestRateLimiter(unittest.TestCase):
+    @mock.patch('time.sleep', autospec=True)
+    @mock.patch('time.time', autospec=True, return_value=10.0)
+    def test_wait(self, time_mock, sleep_mock):
+        limiter = retention.RateLimiter(4)
+        for _ in range(3):
+            limiter.wait()
+        self.assertEqual(sleep_mock.call_args_list, [mock.call(0.25), mock.call(0.5)])
+
+    @mock.patch('time.sleep', autospec=True)
+    def test_unlimited(self, sleep_mock):
+        limiter = retention.RateLimiter(0)
+        for _ in range(3):
+            limiter.wait()
+        self.assertFalse(sleep_mock.called)
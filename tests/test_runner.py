@@ -1,6 +1,10 @@
 import mock
 import os
+import shutil
 import subprocess
+import sys
+import tempfile
+import threading
 import unittest
 from skipper import runner
 
@@ -68,6 +72,26 @@ class TestRunner(unittest.TestCase):
         ]
         popen_mock.assert_called_once_with(expected_nested_command)
 
+    @mock.patch('getpass.getuser', autospec=True, return_value='testuser')
+    @mock.patch('os.getcwd', autospec=True, return_value=PROJECT_DIR)
+    @mock.patch('os.getuid', autospec=True, return_value=USER_ID)
+    @mock.patch('grp.getgrnam', autospec=True)
+    @mock.patch('subprocess.Popen', autospec=False)
+    def test_run_nested_with_caches(self, popen_mock, grp_getgrnam_mock, *args):
+        grp_getgrnam_mock.return_value.gr_gid = 978
+        runner.cache_volumes.configure({'pip': '/cache/pip', 'ccache': '/cache/ccache'}, IMAGE)
+        try:
+            runner.run(['pwd'], FQDN_IMAGE)
+        finally:
+            runner.cache_volumes.configure({}, None)
+        nested_command = popen_mock.call_args[0][0]
+        self.assertIn('SKIPPER_CACHE_PATHS=/cache/ccache:/cache/pip', nested_command)
+        mounts = [nested_command[index + 1] for index, param in enumerate(nested_command) if param == '--mount']
+        self.assertEqual([mount.split(',')[1:3] for mount in mounts],
+                         [['src=' + runner.cache_volumes.get_volume_name('ccache', PROJECT_DIR, IMAGE), 'dst=/cache/ccache'],
+                          ['src=' + runner.cache_volumes.get_volume_name('pip', PROJECT_DIR, IMAGE), 'dst=/cache/pip']])
+        self.assertEqual(nested_command[-3:], ['/opt/skipper/skipper-entrypoint.sh', FQDN_IMAGE, 'pwd'])
+
     @mock.patch('getpass.getuser', autospec=True, return_value='testuser')
     @mock.patch('os.getcwd', autospec=True, return_value=PROJECT_DIR)
     @mock.patch('os.getuid', autospec=True)
@@ -196,3 +220,265 @@ class TestRunner(unittest.TestCase):
             ' '.join(command)
         ]
         popen_mock.assert_called_once_with(expected_nested_command)
+
+
+@mock.patch('getpass.getuser', autospec=True, return_value='testuser')
+@mock.patch('os.getcwd', autospec=True, return_value=PROJECT_DIR)
+@mock.patch('os.getuid', autospec=True, return_value=USER_ID)
+@mock.patch('grp.getgrnam', autospec=True)
+class TestRunnerSession(unittest.TestCase):
+    def setUp(self):
+        with mock.patch('os.getcwd', autospec=True, return_value=PROJECT_DIR):
+            self._session_name = runner._get_session_name(FQDN_IMAGE, ENV)
+        self._cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._cache_dir)
+        env_patcher = mock.patch.dict('os.environ', {'XDG_CACHE_HOME': self._cache_dir})
+        env_patcher.start()
+        self.addCleanup(env_patcher.stop)
+
+    @mock.patch('subprocess.call', autospec=True, return_value=0)
+    @mock.patch('subprocess.check_output', autospec=True)
+    @mock.patch('subprocess.Popen', autospec=False)
+    def test_run_starts_session(self, popen_mock, check_output_mock, call_mock, grp_getgrnam_mock, *args):
+        grp_getgrnam_mock.return_value.gr_gid = 978
+        popen_mock.return_value.returncode = 0
+        check_output_mock.side_effect = subprocess.CalledProcessError(1, 'docker')
+        self.assertEqual(runner.run(['ls', '-l'], FQDN_IMAGE, ENV, session_idle_timeout=60), 0)
+
+        expected_session_command = [
+            'docker', 'run',
+            '-d',
+            '--rm',
+            '--name', self._session_name,
+            '--label', 'skipper.session=' + FQDN_IMAGE,
+            '--net', 'host',
+            '-e', 'KEY1=VAL1',
+            '-e', 'KEY2=VAL2',
+            '-e', 'SKIPPER_USERNAME=testuser',
+            '-e', 'SKIPPER_UID=%(user_uid)s' % dict(user_uid=USER_ID),
+            '-e', 'SKIPPER_DOCKER_GID=978',
+            '-v', '%(workdir)s:%(workdir)s:rw,Z' % dict(workdir=WORKDIR),
+            '-v', '/var/lib/osmosis:/var/lib/osmosis:rw,Z',
+            '-v', '/var/run/docker.sock:/var/run/docker.sock:Z',
+            '-v', '/opt/skipper/skipper-entrypoint.sh:/opt/skipper/skipper-entrypoint.sh:Z',
+            '-w', PROJECT_DIR,
+            '-v', '/opt/skipper/skipper-session.sh:/opt/skipper/skipper-session.sh:Z',
+            '--entrypoint', '/opt/skipper/skipper-session.sh',
+            FQDN_IMAGE,
+            'start', '60'
+        ]
+        call_mock.assert_called_with(expected_session_command, stdout=mock.ANY)
+        popen_mock.assert_called_once_with(['docker', 'exec', '-t', '-w', PROJECT_DIR, self._session_name,
+                                            '/opt/skipper/skipper-session.sh', 'exec', 'ls -l'])
+        self.assertTrue(os.path.exists(os.path.join(self._cache_dir, 'skipper', 'sessions', self._session_name + '.lock')))
+
+    @mock.patch('subprocess.call', autospec=True)
+    @mock.patch('subprocess.check_output', autospec=True)
+    @mock.patch('subprocess.Popen', autospec=False)
+    def test_run_reuses_session(self, popen_mock, check_output_mock, call_mock, *args):
+        popen_mock.return_value.returncode = 0
+        check_output_mock.side_effect = [b'true sha256:aaa\n', b'sha256:aaa\n']
+        runner.run(['pwd'], FQDN_IMAGE, ENV, interactive=True, session_idle_timeout=60)
+        self.assertFalse(call_mock.called)
+        popen_mock.assert_called_once_with(['docker', 'exec', '-i', '-t', '-w', PROJECT_DIR, self._session_name,
+                                            '/opt/skipper/skipper-session.sh', 'exec', 'pwd'])
+
+    @mock.patch('subprocess.call', autospec=True, return_value=0)
+    @mock.patch('subprocess.check_output', autospec=True)
+    @mock.patch('subprocess.Popen', autospec=False)
+    def test_run_recreates_session_of_changed_image(self, popen_mock, check_output_mock, call_mock, grp_getgrnam_mock, *args):
+        grp_getgrnam_mock.return_value.gr_gid = 978
+        popen_mock.return_value.returncode = 0
+        check_output_mock.side_effect = [b'true sha256:aaa\n', b'sha256:bbb\n']
+        runner.run(['pwd'], FQDN_IMAGE, ENV, session_idle_timeout=60)
+        self.assertEqual(call_mock.call_args_list[0], mock.call(['docker', 'rm', '-f', self._session_name], stdout=mock.ANY, stderr=mock.ANY))
+        self.assertEqual(call_mock.call_args_list[1][0][0][:2], ['docker', 'run'])
+        self.assertTrue(popen_mock.called)
+
+    @mock.patch('subprocess.call', autospec=True, return_value=125)
+    @mock.patch('subprocess.check_output', autospec=True)
+    @mock.patch('subprocess.Popen', autospec=False)
+    def test_run_with_failed_session(self, popen_mock, check_output_mock, *args):
+        check_output_mock.side_effect = subprocess.CalledProcessError(1, 'docker')
+        self.assertEqual(runner.run(['pwd'], FQDN_IMAGE, ENV, session_idle_timeout=60), 125)
+        self.assertFalse(popen_mock.called)
+
+    @mock.patch('subprocess.call', autospec=True, return_value=0)
+    @mock.patch('subprocess.check_output', autospec=True)
+    @mock.patch('subprocess.Popen', autospec=False)
+    def test_run_restarts_session_which_exited_before_exec(self, popen_mock, check_output_mock, call_mock, grp_getgrnam_mock, *args):
+        grp_getgrnam_mock.return_value.gr_gid = 978
+        popen_mock.side_effect = [mock.Mock(returncode=1), mock.Mock(returncode=0)]
+        check_output_mock.side_effect = [b'true sha256:aaa\n', b'sha256:aaa\n', b'false\n', subprocess.CalledProcessError(1, 'docker')]
+        self.assertEqual(runner.run(['pwd'], FQDN_IMAGE, ENV, session_idle_timeout=60), 0)
+        self.assertEqual(call_mock.call_args_list[1][0][0][:2], ['docker', 'run'])
+        self.assertEqual(popen_mock.call_count, 2)
+
+    @mock.patch('subprocess.call', autospec=True)
+    @mock.patch('subprocess.check_output', autospec=True)
+    @mock.patch('subprocess.Popen', autospec=False)
+    def test_run_does_not_retry_failed_command(self, popen_mock, check_output_mock, call_mock, *args):
+        popen_mock.return_value.returncode = 2
+        check_output_mock.side_effect = [b'true sha256:aaa\n', b'sha256:aaa\n', b'true\n']
+        self.assertEqual(runner.run(['false'], FQDN_IMAGE, ENV, session_idle_timeout=60), 2)
+        self.assertFalse(call_mock.called)
+        self.assertEqual(popen_mock.call_count, 1)
+
+    def test_session_name_ignores_tag(self, *args):
+        self.assertEqual(self._session_name, runner._get_session_name(REGISTRY + '/' + IMAGE + ':other', ENV))
+        self.assertNotEqual(self._session_name, runner._get_session_name(FQDN_IMAGE, []))
+
+
+@mock.patch('getpass.getuser', autospec=True, return_value='testuser')
+@mock.patch('os.getcwd', autospec=True, return_value=PROJECT_DIR)
+@mock.patch('os.getuid', autospec=True, return_value=USER_ID)
+@mock.patch('grp.getgrnam', autospec=True)
+class TestRunnerUserImage(unittest.TestCase):
+    @mock.patch('os.getgid', autospec=True, return_value=GROUP_ID)
+    @mock.patch('subprocess.check_output', autospec=True, side_effect=[b'sha256:aaa\n', b'sha256:bbb\n'])
+    @mock.patch('subprocess.Popen', autospec=False)
+    def test_run_in_cached_user_image(self, popen_mock, check_output_mock, getgid_mock, grp_getgrnam_mock, *args):
+        grp_getgrnam_mock.return_value.gr_gid = 978
+        command = ['ls', '-l']
+        runner.run(command, FQDN_IMAGE, ENV, user_image=True)
+
+        user_image = check_output_mock.call_args[0][0][-1]
+        self.assertTrue(user_image.startswith(runner.USER_IMAGE_REPOSITORY + ':'))
+        expected_nested_command = [
+            'docker', 'run',
+            '-t',
+            '--rm',
+            '--net', 'host',
+            '-e', 'KEY1=VAL1',
+            '-e', 'KEY2=VAL2',
+            '-v', '%(workdir)s:%(workdir)s:rw,Z' % dict(workdir=WORKDIR),
+            '-v', '/var/lib/osmosis:/var/lib/osmosis:rw,Z',
+            '-v', '/var/run/docker.sock:/var/run/docker.sock:Z',
+            '-w', PROJECT_DIR,
+            '--user', '%(user_uid)s:%(group_id)s' % dict(user_uid=USER_ID, group_id=GROUP_ID),
+            '--group-add', '978',
+            '--entrypoint', '/bin/sh',
+            user_image,
+            '-c',
+            ' '.join(command)
+        ]
+        popen_mock.assert_called_once_with(expected_nested_command)
+
+    @mock.patch('subprocess.check_output', autospec=True)
+    @mock.patch('subprocess.Popen', autospec=False)
+    def test_run_builds_user_image(self, popen_mock, check_output_mock, grp_getgrnam_mock, *args):
+        grp_getgrnam_mock.return_value.gr_gid = 978
+        check_output_mock.side_effect = [b'sha256:aaa\n', subprocess.CalledProcessError(1, 'docker')]
+        popen_mock.return_value.returncode = 0
+        runner.run(['pwd'], FQDN_IMAGE, user_image=True)
+
+        build_call, run_call = popen_mock.call_args_list
+        user_image = build_call[0][0][4]
+        self.assertEqual(build_call, mock.call(['docker', 'build', '-q', '-t', user_image, '-'], stdin=subprocess.PIPE, stdout=mock.ANY))
+        dockerfile = popen_mock.return_value.communicate.call_args[0][0].decode('utf-8')
+        self.assertTrue(dockerfile.startswith('FROM %(image)s\n' % dict(image=FQDN_IMAGE)))
+        self.assertIn('useradd -u %(user_uid)s --non-unique -M testuser' % dict(user_uid=USER_ID), dockerfile)
+        self.assertEqual(run_call[0][0][-3:], [user_image, '-c', 'pwd'])
+
+    @mock.patch('subprocess.check_output', autospec=True)
+    @mock.patch('subprocess.Popen', autospec=False)
+    def test_user_image_owns_cache_paths(self, popen_mock, check_output_mock, grp_getgrnam_mock, *args):
+        grp_getgrnam_mock.return_value.gr_gid = 978
+        check_output_mock.side_effect = [b'sha256:aaa\n', subprocess.CalledProcessError(1, 'docker')]
+        popen_mock.return_value.returncode = 0
+        runner.cache_volumes.configure({'pip': '/cache/pip', 'ccache': '/cache/ccache'}, FQDN_IMAGE)
+        self.addCleanup(runner.cache_volumes.configure, {}, None)
+        runner.run(['pwd'], FQDN_IMAGE, user_image=True)
+
+        dockerfile = popen_mock.return_value.communicate.call_args[0][0].decode('utf-8')
+        self.assertIn('RUN ["mkdir", "-p", "/cache/ccache", "/cache/pip"]\n', dockerfile)
+        self.assertIn('RUN ["chown", "%(user_uid)s", "/cache/ccache", "/cache/pip"]\n' % dict(user_uid=USER_ID), dockerfile)
+        run_command = popen_mock.call_args_list[1][0][0]
+        self.assertIn('--mount', run_command)
+        self.assertNotIn('SKIPPER_CACHE_PATHS=/cache/ccache:/cache/pip', run_command)
+
+    @mock.patch('subprocess.check_output', autospec=True)
+    @mock.patch('subprocess.Popen', autospec=False)
+    def test_user_image_key(self, popen_mock, check_output_mock, grp_getgrnam_mock, *args):
+        grp_getgrnam_mock.return_value.gr_gid = 978
+        check_output_mock.side_effect = lambda cmd, **kwargs: b'sha256:aaa' if cmd[-1] == FQDN_IMAGE else b'sha256:bbb'
+        user_image = runner._get_user_image(FQDN_IMAGE)
+        self.assertEqual(user_image, runner._get_user_image(FQDN_IMAGE))
+        check_output_mock.side_effect = lambda cmd, **kwargs: b'sha256:ccc' if cmd[-1] == FQDN_IMAGE else b'sha256:bbb'
+        self.assertNotEqual(user_image, runner._get_user_image(FQDN_IMAGE))
+        grp_getgrnam_mock.return_value.gr_gid = 979
+        self.assertNotEqual(user_image, runner._get_user_image(FQDN_IMAGE))
+        runner.cache_volumes.configure({'pip': '/cache/pip'}, FQDN_IMAGE)
+        self.addCleanup(runner.cache_volumes.configure, {}, None)
+        self.assertNotEqual(user_image, runner._get_user_image(FQDN_IMAGE))
+        self.assertFalse(popen_mock.called)
+
+    @mock.patch('subprocess.check_output', autospec=True)
+    @mock.patch('subprocess.Popen', autospec=False)
+    def test_run_without_user_image(self, popen_mock, check_output_mock, grp_getgrnam_mock, *args):
+        grp_getgrnam_mock.return_value.gr_gid = 978
+        check_output_mock.side_effect = [b'sha256:aaa\n', subprocess.CalledProcessError(1, 'docker')]
+        popen_mock.return_value.returncode = 1
+        runner.run(['pwd'], FQDN_IMAGE, user_image=True)
+        self.assertEqual(popen_mock.call_args[0][0][-4:], ['--entrypoint', '/opt/skipper/skipper-entrypoint.sh', FQDN_IMAGE, 'pwd'])
+
+    @mock.patch('subprocess.Popen', autospec=False)
+    def test_start_nested_captures_output(self, popen_mock, grp_getgrnam_mock, *args):
+        grp_getgrnam_mock.return_value.gr_gid = 978
+        output = mock.Mock()
+        proc = runner.start_nested(['make', 'lint'], FQDN_IMAGE, ENV, stdout=output)
+        self.assertIsInstance(proc, runner.Process)
+        self.assertEqual(proc.pid, popen_mock.return_value.pid)
+        docker_cmd = popen_mock.call_args[0][0]
+        self.assertEqual(docker_cmd[:3], ['docker', 'run', '--rm'])
+        self.assertNotIn('-t', docker_cmd)
+        self.assertEqual(docker_cmd[-3:], ['/opt/skipper/skipper-entrypoint.sh', FQDN_IMAGE, 'make lint'])
+        self.assertEqual(popen_mock.call_args[1], dict(stdout=output, stderr=subprocess.STDOUT))
+
+
+def _python(code):
+    return [sys.executable, '-c', code]
+
+
+class TestProcess(unittest.TestCase):
+    def test_wait(self):
+        proc = runner.Process(_python('import sys; sys.exit(3)'))
+        self.assertEqual(proc.wait(), 3)
+        self.assertEqual(proc.returncode, 3)
+        self.assertGreaterEqual(proc.end_time, proc.start_time)
+        self.assertFalse(proc.timed_out)
+
+    def test_on_output(self):
+        lines = []
+        exited = threading.Event()
+        proc = runner.Process(_python('import sys; sys.stdout.write("a\\nb")'), on_output=lines.append,
+                              on_exit=lambda process: exited.set())
+        self.assertEqual(proc.wait(), 0)
+        self.assertTrue(exited.is_set())
+        self.assertEqual(lines, [b'a\n', b'b\n'])
+
+    def test_wait_timeout(self):
+        proc = runner.Process(_python('import time; time.sleep(5)'))
+        try:
+            self.assertIsNone(proc.wait(timeout=0.05))
+            self.assertIsNone(proc.returncode)
+        finally:
+            proc.cancel()
+        self.assertNotEqual(proc.wait(), 0)
+        self.assertTrue(proc.cancelled)
+
+    def test_timeout(self):
+        runner.logging.getLogger('skipper').disabled = True
+        try:
+            proc = runner.Process(_python('import time; time.sleep(5)'), timeout=0.05)
+            self.assertNotEqual(proc.wait(timeout=5), 0)
+        finally:
+            runner.logging.getLogger('skipper').disabled = False
+        self.assertTrue(proc.timed_out)
+        self.assertLess(proc.duration, 5)
+
+    @mock.patch('subprocess.Popen', autospec=False)
+    def test_cancel_exited(self, popen_mock):
+        popen_mock.return_value.poll.return_value = 0
+        runner.Process(['true']).cancel()
+        self.assertFalse(popen_mock.return_value.terminate.called)
@@ -0,0 +1,82 @@
+import io
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+from skipper import durations
+from skipper import sharder
+
+
+FQDN_IMAGE = 'build-container-image:build-container-tag'
+ENV = ['KEY1=VAL1']
+
+
+def _start_nested(command, fqdn_image, environment, user_setup, workdir, on_output):
+    index = int(dict(variable.split('=', 1) for variable in environment)[sharder.SHARD_INDEX_VARIABLE])
+    on_output(('%(index)d: %(command)s\n' % dict(index=index, command=' '.join(command))).encode('utf-8'))
+    on_output(b'second line\n')
+    proc = mock.Mock(start_time=10.0, end_time=12.0, duration=2.0)
+    proc.wait.return_value = [0, 3, 1][index]
+    return proc
+
+
+@mock.patch('skipper.runner.get_nested_image', autospec=True, return_value=(FQDN_IMAGE, True))
+@mock.patch('skipper.runner.start_nested', autospec=True, side_effect=_start_nested)
+class TestSharder(unittest.TestCase):
+    def setUp(self):
+        sharder.utils.logger = mock.Mock()
+        self._workdir = tempfile.mkdtemp()
+        self._durations_path = os.path.join(self._workdir, 'shard-durations.json')
+        self._files = []
+        for name, size in [('test_a.py', 100), ('test_b.py', 300), ('test_c.py', 200)]:
+            path = os.path.join(self._workdir, name)
+            with open(path, 'w') as test_file:
+                test_file.write('x' * size)
+            self._files.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self._workdir)
+
+    def test_run_shards(self, start_nested_mock, *args):
+        with mock.patch('sys.stdout', new=io.BytesIO()) as stdout:
+            returncode = sharder.run_shards(['pytest', '-q'], FQDN_IMAGE, ENV, 3, durations_path=self._durations_path)
+
+        self.assertEqual(returncode, 3)
+        start_nested_mock.assert_any_call(['pytest', '-q'], FQDN_IMAGE, ENV + ['SKIPPER_SHARD_INDEX=1', 'SKIPPER_SHARD_COUNT=3'], True,
+                                          workdir=None, on_output=mock.ANY)
+        self.assertEqual(sorted(stdout.getvalue().splitlines()), [b'[shard 0] 0: pytest -q', b'[shard 0] second line',
+                                                                  b'[shard 1] 1: pytest -q', b'[shard 1] second line',
+                                                                  b'[shard 2] 2: pytest -q', b'[shard 2] second line'])
+        self.assertFalse(os.path.exists(self._durations_path))
+
+    def test_run_shards_with_files(self, start_nested_mock, *args):
+        with mock.patch('sys.stdout', new=io.BytesIO()):
+            sharder.run_shards(['pytest'], FQDN_IMAGE, ENV, 2, file_patterns=[os.path.join(self._workdir, 'test_*.py')],
+                               durations_path=self._durations_path)
+
+        commands = sorted(call[0][0] for call in start_nested_mock.call_args_list)
+        self.assertEqual(commands, [['pytest', self._files[0], self._files[2]], ['pytest', self._files[1]]])
+        recorded = durations.load(self._durations_path)[os.getcwd() + ':pytest']
+        self.assertEqual(recorded, {self._files[0]: 2.0 / 3, self._files[1]: 2.0, self._files[2]: 4.0 / 3})
+
+    def test_run_shards_without_files(self, start_nested_mock, *args):
+        returncode = sharder.run_shards(['pytest'], FQDN_IMAGE, ENV, 2, file_patterns=[os.path.join(self._workdir, '*.txt')],
+                                        durations_path=self._durations_path)
+        self.assertEqual(returncode, 1)
+        self.assertFalse(start_nested_mock.called)
+
+    def test_split_files(self, *args):
+        weights = {'a': 5, 'b': 4, 'c': 3, 'd': 3, 'e': 1}
+        self.assertEqual(sharder.split_files(weights, 2), [['a', 'd'], ['b', 'c', 'e']])
+        self.assertEqual(sharder.split_files({'a': 1}, 3), [['a'], [], []])
+
+    def test_file_weights(self, *args):
+        self.assertEqual(sharder.get_file_weights(self._files, {}), dict(zip(self._files, [100, 300, 200])))
+        weights = sharder.get_file_weights(self._files, {self._files[0]: 10.0})
+        self.assertEqual(weights, dict(zip(self._files, [10.0, 30.0, 20.0])))
+
+    def test_worst_exit_code(self, *args):
+        self.assertEqual(sharder.worst_exit_code([0, 0]), 0)
+        self.assertEqual(sharder.worst_exit_code([0, 1, -15, 2]), -15)
+        self.assertEqual(sharder.worst_exit_code([]), 0)
@@ -0,0 +1,85 @@
+import json
+import mock
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from skipper import runner
+from skipper import tracing
+
+
+class TestTracing(unittest.TestCase):
+    def setUp(self):
+        self._workdir = tempfile.mkdtemp()
+        self._path = os.path.join(self._workdir, 'trace.json')
+
+    def tearDown(self):
+        tracing.configure(None)
+        shutil.rmtree(self._workdir)
+
+    def test_disabled_tracing_records_nothing(self):
+        tracing.configure(None)
+        self.assertFalse(tracing.is_enabled())
+        self.assertIs(tracing.span('first'), tracing.span('second'))
+        with tracing.span('span'):
+            pass
+        tracing.add_span('span', 1.0, 2.0)
+        tracing.write()
+        self.assertFalse(os.path.exists(self._path))
+
+    def test_write_spans(self):
+        tracing.configure(self._path)
+        self.assertTrue(tracing.is_enabled())
+        with tracing.span('outer', 'build', image='app'):
+            with tracing.span('inner'):
+                pass
+        tracing.add_span('done', 1.0, 1.5, 'push', status='pushed')
+        tracing.write()
+
+        events = self._read_events()
+        spans = dict((event['name'], event) for event in events if event['ph'] == 'X')
+        self.assertEqual(sorted(spans), ['done', 'inner', 'outer'])
+        self.assertEqual(spans['outer']['cat'], 'build')
+        self.assertEqual(spans['outer']['args'], dict(image='app'))
+        self.assertLessEqual(spans['outer']['ts'], spans['inner']['ts'])
+        self.assertGreaterEqual(spans['outer']['ts'] + spans['outer']['dur'], spans['inner']['ts'] + spans['inner']['dur'])
+        self.assertEqual(spans['done']['ts'], 1000000)
+        self.assertEqual(spans['done']['dur'], 500000)
+        self.assertEqual(spans['done']['args'], dict(status='pushed'))
+
+    def test_span_records_errors(self):
+        tracing.configure(self._path)
+        with self.assertRaises(ValueError):
+            with tracing.span('failing'):
+                raise ValueError()
+        tracing.write()
+        self.assertEqual(self._read_events()[-1]['args'], dict(error='ValueError'))
+
+    def test_spans_of_threads(self):
+        tracing.configure(self._path)
+        thread = threading.Thread(target=tracing.add_span, args=('threaded', 1.0, 2.0), name='worker')
+        thread.start()
+        thread.join()
+        tracing.write()
+
+        events = self._read_events()
+        thread_names = dict((event['tid'], event['args']['name']) for event in events if event['ph'] == 'M')
+        span = [event for event in events if event['ph'] == 'X'][0]
+        self.assertEqual(thread_names[span['tid']], 'worker')
+
+    @mock.patch('subprocess.Popen', autospec=True)
+    def test_runner_traces_commands(self, popen_mock):
+        popen_mock.return_value.returncode = 0
+        tracing.configure(self._path)
+        runner.run(['docker', 'build', '-t', 'app', '.'])
+        tracing.write()
+
+        span = self._read_events()[-1]
+        self.assertEqual(span['name'], 'docker build')
+        self.assertEqual(span['cat'], 'subprocess')
+        self.assertEqual(span['args'], dict(command='docker build -t app .'))
+
+    def _read_events(self):
+        with open(self._path) as trace_file:
+            return json.load(trace_file)['traceEvents']
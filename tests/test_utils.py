@@ -0,0 +1,10 @@
+import unittest
+from skipper import utils
+
+
+class TestUtils(unittest.TestCase):
+    def test_format_size(self):
+        self.assertIsNone(utils.format_size(None))
+        self.assertEqual(utils.format_size(512), '512 B')
+        self.assertEqual(utils.format_size(2500000), '2.5 MB')
+        self.assertEqual(utils.format_size(3 * 10 ** 12), '3.0 TB')